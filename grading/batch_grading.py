@@ -0,0 +1,160 @@
+"""Helpers for grading a wave of submissions against one shared load of the labels.
+
+Both grading scripts use these to implement their `--results_dirs` mode: the labels are
+loaded once by the grading script, bound into a `grade_fn`, and every results directory is
+graded with that function, optionally in a process pool.
+"""
+import glob
+import os
+import pathlib
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+
+# Set in each pool worker by `_init_worker` so the labels bound into the grading function
+#  are sent to a worker once, not once per graded submission.
+_worker_grade_fn: Optional[Callable[..., pd.DataFrame]] = None
+
+
+def expand_results_dirs(patterns: List[str]) -> List[str]:
+    """Expand glob patterns into a sorted, de-duplicated list of results directories.
+
+    :param patterns: Paths and/or glob patterns (e.g. "grading/bth-results-*")
+    :type patterns: List[str]
+    :return: Existing directories matching the patterns
+    :rtype: List[str]
+    """
+    results_dirs = set()
+    for pattern in patterns:
+        matches = glob.glob(pattern) if glob.has_magic(pattern) else [pattern]
+        results_dirs.update(
+            os.path.normpath(match) for match in matches if os.path.isdir(match)
+        )
+    assert results_dirs, f"No results directories match {patterns=}."
+    return sorted(results_dirs)
+
+
+def submission_names(results_dirs: List[str]) -> Dict[str, str]:
+    """Name each results directory uniquely, for its grading CSV and leaderboard row.
+
+    Directories are named after their basename unless two share one, e.g. "teamA/results"
+    and "teamB/results". Then each is named after its path relative to the directories'
+    common parent, with path separators replaced by "__", e.g. "teamA__results".
+
+    :param results_dirs: Distinct results directories
+    :type results_dirs: List[str]
+    :return: Map from results directory to its name
+    :rtype: Dict[str, str]
+    """
+    names = [
+        os.path.basename(os.path.normpath(results_dir)) for results_dir in results_dirs
+    ]
+    if len(set(names)) < len(names):
+        abs_dirs = [os.path.abspath(results_dir) for results_dir in results_dirs]
+        common_dir = os.path.commonpath(abs_dirs)
+        names = [
+            os.path.relpath(abs_dir, common_dir).replace(os.sep, "__")
+            for abs_dir in abs_dirs
+        ]
+    assert len(set(names)) == len(names), f"Results directories with clashing {names=}."
+    return dict(zip(results_dirs, names))
+
+
+def _init_worker(grade_fn: Callable[..., pd.DataFrame]):
+    global _worker_grade_fn
+    _worker_grade_fn = grade_fn
+
+
+def _grade_one(
+        job: Tuple[str, str],
+    ) -> Tuple[str, Optional[pd.DataFrame], Optional[str]]:
+    # One malformed submission must not abort grading for the rest of the wave, so the
+    #  validation errors raised by the grading scripts are recorded instead.
+    results_dir, submission_name = job
+    try:
+        grading_df = _worker_grade_fn(results_dir, submission_name=submission_name)
+        return results_dir, grading_df, None
+    except (AssertionError, ValueError) as e:
+        return results_dir, None, f"{type(e).__name__}: {e}"
+
+
+def grade_results_dirs(
+        grade_fn: Callable[..., pd.DataFrame],
+        results_dirs: List[str],
+        num_workers: int = 1,
+    ) -> Dict[str, Tuple[Optional[pd.DataFrame], Optional[str]]]:
+    """Grade each results directory with `grade_fn`, serially or in a process pool.
+
+    :param grade_fn: Function mapping a results directory to its grading DF (metric names
+        as index, prediction columns as columns), called with the directory's name from
+        `submission_names` as keyword argument `submission_name`. Typically a
+        `functools.partial` of a grading script's `grade_submission` with the labels
+        already bound.
+    :type grade_fn: Callable[..., pd.DataFrame]
+    :param results_dirs: Results directories to grade
+    :type results_dirs: List[str]
+    :param num_workers: Number of worker processes. 1 grades in this process.
+    :type num_workers: int
+    :return: Map from results directory to (grading DF, None) on success or
+        (None, error message) if the submission failed validation
+    :rtype: Dict[str, Tuple[Optional[pd.DataFrame], Optional[str]]]
+    """
+    jobs = list(submission_names(results_dirs).items())
+    if num_workers <= 1:
+        _init_worker(grade_fn)
+        graded = [_grade_one(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(
+            max_workers=num_workers, initializer=_init_worker, initargs=(grade_fn,)
+        ) as executor:
+            graded = list(executor.map(_grade_one, jobs))
+    return {results_dir: (grading_df, error) for results_dir, grading_df, error in graded}
+
+
+def write_leaderboard(
+        graded: Dict[str, Tuple[Optional[pd.DataFrame], Optional[str]]],
+        grading_output_dir: str,
+        sort_by: str,
+        leaderboard_csv_name: str = "leaderboard.csv",
+    ) -> pd.DataFrame:
+    """Flatten per-submission grading DFs into one leaderboard CSV, best submission first.
+
+    :param graded: Output of `grade_results_dirs`
+    :type graded: Dict[str, Tuple[Optional[pd.DataFrame], Optional[str]]]
+    :param grading_output_dir: Directory in which the leaderboard CSV is written
+    :type grading_output_dir: str
+    :param sort_by: Leaderboard column to rank by, named "{metric_name}_{col_name}"
+    :type sort_by: str
+    :param leaderboard_csv_name: File name of the leaderboard CSV
+    :type leaderboard_csv_name: str
+    :return: The leaderboard, one row per submission
+    :rtype: pd.DataFrame
+    """
+    names = submission_names(list(graded))
+    rows = []
+    for results_dir, (grading_df, error) in graded.items():
+        row = {"submission": names[results_dir], "results_dir": results_dir}
+        if grading_df is not None:
+            for metric_name, metric_vals in grading_df.iterrows():
+                for col_name, metric_val in metric_vals.items():
+                    row[f"{metric_name}_{col_name}"] = metric_val
+        row["error"] = error
+        rows.append(row)
+    leaderboard_df = pd.DataFrame(rows)
+    # Keep "error" as the last column regardless of which submissions graded cleanly.
+    leaderboard_df = leaderboard_df[
+        [col for col in leaderboard_df.columns if col != "error"] + ["error"]
+    ]
+    if sort_by in leaderboard_df.columns:
+        leaderboard_df = leaderboard_df.sort_values(
+            sort_by, ascending=False, na_position="last"
+        )
+
+    if not os.path.isdir(grading_output_dir):
+        pathlib.Path(grading_output_dir).mkdir(parents=True)
+    leaderboard_df.to_csv(
+        os.path.join(grading_output_dir, leaderboard_csv_name), index=False
+    )
+    return leaderboard_df
@@ -0,0 +1,499 @@
+"""Benchmark the grading functions on synthetic labels and results at scale.
+
+For each task, size and case, a schema-correct labels.csv and results.csv pair is generated
+(and kept in --work_dir for later runs), then each grading function is timed on it:
+- etl_predictions_csv: load and validate results.csv, or results.npz in the valid_npz case;
+- compare_pred_and_label: index the labels' IDs and reconcile the predictions' IDs to them;
+- merge_and_metrics: line predictions up with labels and compute every metric;
+- stream_confusion_counts: the whole --streaming path, from both files.
+
+Besides valid results, the cases include the pathological submissions the graders must
+reject or handle: duplicate IDs, IDs missing from the labels, and float-typed predictions.
+The valid_npz case holds the valid results as a typed binary results.npz instead.
+A function that raises records the error as its outcome, and the functions that depend on
+it are skipped.
+
+Wall and CPU time are the best of --repeats runs. Peak memory is the high-water mark of
+allocations traced by `tracemalloc` (Python objects and NumPy arrays) in one more run, so
+it is per function rather than per process. Results can be saved as a baseline, and later
+runs compared against it to catch regressions.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import time
+import tracemalloc
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+import binary_results
+import confusion_metrics
+import grade_ha_submission
+import grade_synthbank_submission
+import prediction_checks
+import streaming_grading
+
+
+WINDOWS_MONTHS = [3, 6, 9, 12]
+CASES = ("valid", "valid_npz", "duplicate_ids", "mismatched_ids", "float_preds")
+# In the duplicate_ids and mismatched_ids cases, one in this many result rows is broken.
+BROKEN_ROW_RATE = 1_000
+# Rows generated and written to CSV at a time, so any size can be generated.
+GENERATION_CHUNK_ROWS = 1_000_000
+# A function regressed if it got this much slower or hungrier than the baseline, relative
+#  and absolute, so that noise on functions that take milliseconds is not flagged.
+DEFAULT_TOLERANCE = 0.25
+MIN_REGRESSION_WALL_S = 0.05
+MIN_REGRESSION_PEAK_MB = 1.0
+
+
+class Task(NamedTuple):
+    name: str
+    grading_module: object
+    id_col_name: str
+    label_col_names: List[str]
+    entity: str
+    # Probability that an example is positive (for synthcc, charges off within 12 months).
+    positive_rate: float
+
+
+TASKS = {
+    "ha": Task(
+        "ha", grade_ha_submission, "PatientID", ["HadHeartAttack"], "patients", 0.055
+    ),
+    "synthcc": Task(
+        "synthcc",
+        grade_synthbank_submission,
+        "agent_id",
+        [f"charge_off_within_{months}_months" for months in WINDOWS_MONTHS],
+        "agents",
+        0.03,
+    ),
+}
+
+
+def _generate_chunk(
+        task: Task,
+        chunk_idx: int,
+        start: int,
+        stop: int,
+        seed: int,
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Generate IDs, labels and predictions of rows [start, stop), the same on every call."""
+    rng = np.random.default_rng([seed, chunk_idx])
+    n = stop - start
+    ids = np.arange(start, stop, dtype=np.int64) + 1
+    is_positive = rng.random(n) < task.positive_rate
+    if len(task.label_col_names) == 1:
+        labels = is_positive[:, None]
+    else:
+        # Charge-off in a given month counts towards every window that contains it.
+        charge_off_month = rng.integers(1, WINDOWS_MONTHS[-1] + 1, n)
+        labels = is_positive[:, None] & (
+            charge_off_month[:, None] <= np.array(WINDOWS_MONTHS)[None, :]
+        )
+    # A reasonable model: most positives found, a few false alarms.
+    flip_rate = np.where(labels, 0.3, task.positive_rate / 5)
+    preds = labels ^ (rng.random(labels.shape) < flip_rate)
+    return ids, labels.astype(np.int8), preds.astype(np.int8)
+
+
+def _break_ids(ids: np.ndarray, case: str, n_rows: int, rng: np.random.Generator):
+    broken = rng.choice(len(ids), size=max(len(ids) // BROKEN_ROW_RATE, 1), replace=False)
+    if case == "duplicate_ids":
+        ids[broken] = ids[(broken + 1) % len(ids)]
+    elif case == "mismatched_ids":
+        ids[broken] += n_rows
+
+
+def generate_task_files(
+        task: Task,
+        n_rows: int,
+        case: str,
+        out_dir: str,
+        seed: int = 0,
+    ) -> Tuple[str, str]:
+    """Write a labels.csv and a results dir with results.csv, unless already written.
+
+    Labels are sorted by ID, as in the train sets. Results list the same rows in another
+    order: chunks in reverse, each shuffled. CSVs are written one chunk at a time, so
+    memory stays bounded at any `n_rows`. In the valid_npz case the results dir holds
+    results.npz instead, whose arrays are assembled in memory before being saved.
+
+    :param task: Task whose schema the files follow
+    :type task: Task
+    :param n_rows: Number of labelled examples
+    :type n_rows: int
+    :param case: One of CASES
+    :type case: str
+    :param out_dir: Directory to write into
+    :type out_dir: str
+    :param seed: Seed of the generated values
+    :type seed: int
+    :return: Path to labels.csv and to the results dir
+    :rtype: Tuple[str, str]
+    """
+    assert case in CASES, f"{case=} is not one of {CASES}."
+    data_dir = os.path.join(out_dir, f"{task.name}-{n_rows}-seed{seed}")
+    labels_path = os.path.join(data_dir, "labels.csv")
+    results_dir = os.path.join(data_dir, f"bth-results-{case}")
+    results_path = os.path.join(
+        results_dir, "results.npz" if case == "valid_npz" else "results.csv"
+    )
+    os.makedirs(results_dir, exist_ok=True)
+    chunk_bounds = [
+        (chunk_idx, start, min(start + GENERATION_CHUNK_ROWS, n_rows))
+        for chunk_idx, start in enumerate(range(0, n_rows, GENERATION_CHUNK_ROWS))
+    ]
+    id_and_label_cols = [task.id_col_name] + task.label_col_names
+
+    # Files are written under a temporary name and renamed once complete, so an
+    #  interrupted run never leaves a truncated file that later runs would reuse.
+    if not os.path.isfile(labels_path):
+        with open(labels_path + ".tmp", "w") as f:
+            for chunk_idx, start, stop in chunk_bounds:
+                ids, labels, _ = _generate_chunk(task, chunk_idx, start, stop, seed)
+                chunk_df = pd.DataFrame(labels, columns=task.label_col_names)
+                chunk_df.insert(0, task.id_col_name, ids)
+                chunk_df.to_csv(f, header=chunk_idx == 0, index=False)
+        os.replace(labels_path + ".tmp", labels_path)
+
+    if case == "valid_npz" and not os.path.isfile(results_path):
+        rng = np.random.default_rng([seed, len(chunk_bounds), CASES.index(case)])
+        id_chunks, pred_chunks = [], []
+        for chunk_idx, start, stop in reversed(chunk_bounds):
+            ids, _, preds = _generate_chunk(task, chunk_idx, start, stop, seed)
+            order = rng.permutation(len(ids))
+            id_chunks.append(ids[order].astype(np.int32))
+            pred_chunks.append(preds[order])
+        preds = np.concatenate(pred_chunks)
+        # np.savez adds the extension to names that lack it.
+        np.savez(
+            results_path + ".tmp.npz",
+            **{task.id_col_name: np.concatenate(id_chunks)},
+            **{
+                col_name: np.ascontiguousarray(preds[:, i])
+                for i, col_name in enumerate(task.label_col_names)
+            },
+        )
+        os.replace(results_path + ".tmp.npz", results_path)
+    elif not os.path.isfile(results_path):
+        rng = np.random.default_rng([seed, len(chunk_bounds), CASES.index(case)])
+        with open(results_path + ".tmp", "w") as f:
+            for i, (chunk_idx, start, stop) in enumerate(reversed(chunk_bounds)):
+                ids, _, preds = _generate_chunk(task, chunk_idx, start, stop, seed)
+                order = rng.permutation(len(ids))
+                ids, preds = ids[order], preds[order]
+                _break_ids(ids, case, n_rows, rng)
+                chunk_df = pd.DataFrame(
+                    preds.astype(np.float32) if case == "float_preds" else preds,
+                    columns=task.label_col_names,
+                )
+                chunk_df.insert(0, task.id_col_name, ids)
+                chunk_df[id_and_label_cols].to_csv(f, header=i == 0, index=False)
+        os.replace(results_path + ".tmp", results_path)
+    return labels_path, results_dir
+
+
+def _grading_steps(
+        task: Task,
+        labels_path: str,
+        results_dir: str,
+    ) -> List[Tuple[str, Callable[[dict], None]]]:
+    """Name and function of each benchmarked step. Steps pass their outputs on in a dict."""
+    module = task.grading_module
+    results_path = binary_results.find_results_file(results_dir)
+
+    def etl(state: dict):
+        if task.name == "synthcc":
+            state["pred_df"] = module.etl_predictions_csv(results_path, WINDOWS_MONTHS)
+        else:
+            state["pred_df"] = module.etl_predictions_csv(results_path)
+
+    def compare(state: dict):
+        state["label_ids"] = prediction_checks.sorted_unique_ids(
+            state["label_df"][task.id_col_name].to_numpy(), task.entity, "labels"
+        )
+        prediction_checks.reconcile_ids(
+            state["pred_df"][task.id_col_name].to_numpy(),
+            state["label_df"][task.id_col_name].to_numpy(),
+            task.entity,
+            state["label_ids"],
+        )
+
+    def merge_and_metrics(state: dict):
+        pred_df = state["pred_df"]
+        preds = prediction_checks.align_to_sorted_ids(
+            pred_df[task.id_col_name].to_numpy(),
+            pred_df[task.label_col_names].to_numpy(),
+            state["label_ids"],
+        )
+        labels = state["label_df"][task.label_col_names].to_numpy(dtype=np.int8)
+        counts = confusion_metrics.confusion_counts(labels, preds)
+        if task.name == "synthcc":
+            module.grading_df_from_counts(counts, WINDOWS_MONTHS)
+        else:
+            module.grading_df_from_counts(counts)
+
+    def stream(state: dict):
+        streaming_grading.stream_confusion_counts(
+            results_path,
+            labels_path,
+            task.id_col_name,
+            task.label_col_names,
+            task.entity,
+        )
+
+    return [
+        ("etl_predictions_csv", etl),
+        ("compare_pred_and_label", compare),
+        ("merge_and_metrics", merge_and_metrics),
+        ("stream_confusion_counts", stream),
+    ]
+
+
+def profile(fn: Callable[[dict], None], state: dict, repeats: int) -> dict:
+    """Time `fn(state)` `repeats` times, then run it once more to trace its peak memory.
+
+    :return: Best wall and CPU time, peak traced memory, and the outcome: "ok" or the
+        error `fn` raised, in which case it is run only once
+    :rtype: dict
+    """
+    wall_s = cpu_s = float("inf")
+    # The graders print their metrics; keep the benchmark's output to its own table.
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeats):
+            wall_start = time.perf_counter()
+            cpu_start = time.process_time()
+            try:
+                fn(state)
+            except (AssertionError, ValueError) as e:
+                return {
+                    "outcome": type(e).__name__,
+                    "wall_s": time.perf_counter() - wall_start,
+                    "cpu_s": time.process_time() - cpu_start,
+                    "peak_mb": None,
+                }
+            wall_s = min(wall_s, time.perf_counter() - wall_start)
+            cpu_s = min(cpu_s, time.process_time() - cpu_start)
+
+        tracemalloc.start()
+        try:
+            fn(state)
+            _, peak_bytes = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    return {"outcome": "ok", "wall_s": wall_s, "cpu_s": cpu_s, "peak_mb": peak_bytes / 2**20}
+
+
+def run_benchmarks(
+        task_names: List[str],
+        sizes: List[int],
+        cases: List[str],
+        work_dir: str,
+        repeats: int = 3,
+        seed: int = 0,
+    ) -> pd.DataFrame:
+    """Benchmark every grading step for each task, size and case.
+
+    :return: One row per (task, n_rows, case, function) with outcome, wall_s, cpu_s,
+        peak_mb and rows_per_s
+    :rtype: pd.DataFrame
+    """
+    rows = []
+    for task_name in task_names:
+        task = TASKS[task_name]
+        for n_rows in sizes:
+            for case in cases:
+                labels_path, results_dir = generate_task_files(
+                    task, n_rows, case, work_dir, seed
+                )
+                state = {"label_df": task.grading_module.load_labels(labels_path)}
+                failed = None
+                for function_name, fn in _grading_steps(task, labels_path, results_dir):
+                    row = {
+                        "task": task_name,
+                        "n_rows": n_rows,
+                        "case": case,
+                        "function": function_name,
+                    }
+                    # Streaming does not depend on the in-memory steps before it.
+                    if failed is not None and function_name != "stream_confusion_counts":
+                        row.update(outcome=f"skipped after {failed}")
+                    else:
+                        row.update(profile(fn, state, repeats))
+                        if row["outcome"] != "ok" and failed is None:
+                            failed = function_name
+                        row["rows_per_s"] = n_rows / row["wall_s"] if row["wall_s"] else None
+                    rows.append(row)
+                    print(
+                        f"{task_name} {n_rows:,} {case} {function_name}: {row['outcome']}"
+                    )
+    return pd.DataFrame(rows)
+
+
+def _benchmark_key(row: dict) -> Tuple[str, int, str, str]:
+    return row["task"], int(row["n_rows"]), row["case"], row["function"]
+
+
+def find_regressions(
+        results_df: pd.DataFrame,
+        baseline: Dict,
+        tolerance: float = DEFAULT_TOLERANCE,
+    ) -> List[str]:
+    """Compare results against a baseline saved by `save_baseline`.
+
+    :param results_df: Output of `run_benchmarks`
+    :type results_df: pd.DataFrame
+    :param baseline: Loaded baseline JSON
+    :type baseline: Dict
+    :param tolerance: Allowed relative increase of wall time and peak memory
+    :type tolerance: float
+    :return: One message per regressed or newly failing function
+    :rtype: List[str]
+    """
+    baseline_rows = {_benchmark_key(row): row for row in baseline["results"]}
+    regressions = []
+    for row in results_df.to_dict("records"):
+        base = baseline_rows.get(_benchmark_key(row))
+        if base is None:
+            continue
+        name = " ".join(str(part) for part in _benchmark_key(row))
+        if row["outcome"] != base["outcome"]:
+            regressions.append(f"{name}: outcome {base['outcome']} -> {row['outcome']}")
+            continue
+        if row["outcome"] != "ok":
+            continue
+        for metric, min_diff in (
+            ("wall_s", MIN_REGRESSION_WALL_S), ("peak_mb", MIN_REGRESSION_PEAK_MB)
+        ):
+            if base[metric] is None or row[metric] is None:
+                continue
+            if row[metric] > base[metric] * (1 + tolerance) \
+                    and row[metric] - base[metric] > min_diff:
+                regressions.append(
+                    f"{name}: {metric} {base[metric]:.3f} -> {row[metric]:.3f}"
+                )
+    return regressions
+
+
+def save_baseline(results_df: pd.DataFrame, baseline_path: str):
+    """Save results as the baseline, replacing entries for the benchmarks just run."""
+    try:
+        with open(baseline_path) as f:
+            baseline_rows = {_benchmark_key(row): row for row in json.load(f)["results"]}
+    except FileNotFoundError:
+        baseline_rows = {}
+    for row in results_df.to_dict("records"):
+        baseline_rows[_benchmark_key(row)] = {
+            key: (None if pd.isna(val) else val) for key, val in row.items()
+        }
+    os.makedirs(os.path.dirname(baseline_path) or ".", exist_ok=True)
+    with open(baseline_path, "w") as f:
+        json.dump({"results": list(baseline_rows.values())}, f, indent=2)
+
+
+def main(
+        task_names: List[str],
+        sizes: List[int],
+        cases: List[str],
+        work_dir: str,
+        repeats: int,
+        baseline_path: Optional[str],
+        update_baseline: bool,
+        tolerance: float,
+    ) -> int:
+    # Keep the labels' columnar cache with the generated data rather than in ~/.cache.
+    os.environ.setdefault("BTH_CACHE_DIR", os.path.join(work_dir, "columnar_cache"))
+    results_df = run_benchmarks(task_names, sizes, cases, work_dir, repeats)
+    print(results_df.to_string(index=False))
+    results_df.to_csv(os.path.join(work_dir, "benchmark_results.csv"), index=False)
+
+    if baseline_path is None:
+        return 0
+    if update_baseline:
+        save_baseline(results_df, baseline_path)
+        print(f"Saved baseline to {baseline_path}.")
+        return 0
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    regressions = find_regressions(results_df, baseline, tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    print(f"{len(regressions)} regression(s) against {baseline_path}.")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--tasks",
+        type=str,
+        nargs="+",
+        choices=sorted(TASKS),
+        default=sorted(TASKS),
+        help="Tasks to benchmark."
+    )
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[100_000, 1_000_000],
+        help="Numbers of labelled examples to benchmark at, e.g. 100000 up to 100000000."
+    )
+    parser.add_argument(
+        "--cases",
+        type=str,
+        nargs="+",
+        choices=CASES,
+        default=list(CASES),
+        help="Kinds of results file to benchmark."
+    )
+    parser.add_argument(
+        "--work_dir",
+        type=str,
+        required=True,
+        help=(
+            "Directory for the generated data, reused by later runs, and for "
+            "benchmark_results.csv."
+        )
+    )
+    parser.add_argument(
+        "--repeats",
+        type=int,
+        default=3,
+        help="Runs per function; the fastest is reported."
+    )
+    parser.add_argument(
+        "--baseline",
+        type=str,
+        default=None,
+        help="Baseline JSON to compare against. Exits with code 1 on any regression."
+    )
+    parser.add_argument(
+        "--update_baseline",
+        action="store_true",
+        help="Save this run's results to --baseline instead of comparing against it."
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=DEFAULT_TOLERANCE,
+        help="Allowed relative increase in wall time and peak memory over the baseline."
+    )
+    args = parser.parse_args()
+    assert not args.update_baseline or args.baseline, "--update_baseline needs --baseline."
+    raise SystemExit(main(
+        args.tasks,
+        args.sizes,
+        args.cases,
+        os.path.abspath(args.work_dir),
+        args.repeats,
+        args.baseline,
+        args.update_baseline,
+        args.tolerance,
+    ))
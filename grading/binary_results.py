@@ -0,0 +1,170 @@
+"""Typed binary results files, accepted by the graders alongside results.csv.
+
+A submission may write its predictions as `results.npz` instead of `results.csv`: one 1-D
+array per column, named like the CSV's columns, e.g. written with
+`np.savez(path, agent_id=ids, charge_off_within_3_months=preds_3, ...)`. The ID array must
+have an integer dtype (int32 is enough) and each prediction array must be bool, int8 or
+uint8, so type errors are caught from the file's schema before any value is read. Arrays
+saved with `np.savez` are stored uncompressed and are memory-mapped in place, without
+parsing or copying; `np.savez_compressed` files are accepted too, but are decompressed.
+
+`results.parquet` with the same columns and types is accepted when pyarrow is installed.
+
+A results directory must hold exactly one of RESULTS_FILE_NAMES, so a file left over from
+an earlier run can never be graded in place of the one a rerun wrote.
+"""
+import os
+import struct
+import zipfile
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+
+RESULTS_FILE_NAMES = ("results.npz", "results.parquet", "results.csv")
+PREDICTION_DTYPES = (np.dtype(np.bool_), np.dtype(np.int8), np.dtype(np.uint8))
+# Fixed-size part of a zip local file header, which precedes each member's data.
+_LOCAL_HEADER = struct.Struct("<4s5H3L2H")
+
+
+def find_results_file(results_dir: str) -> str:
+    """Return the path of the results file in a results directory.
+
+    :param results_dir: Directory a submission's `__main__.py` wrote its results to
+    :type results_dir: str
+    :return: Path to the one of RESULTS_FILE_NAMES that exists, else to results.csv
+    :rtype: str
+    """
+    file_names = [
+        file_name for file_name in RESULTS_FILE_NAMES
+        if os.path.isfile(os.path.join(results_dir, file_name))
+    ]
+    assert len(file_names) <= 1, (
+        f"{results_dir} holds more than one results file ({', '.join(file_names)}). "
+        f"Write only one of them."
+    )
+    return os.path.join(results_dir, file_names[0] if file_names else "results.csv")
+
+
+def is_binary_results(path: str) -> bool:
+    """Whether a results file is in a binary format rather than CSV."""
+    return not path.endswith(".csv")
+
+
+def _memmap_stored_member(path: str, info: zipfile.ZipInfo) -> np.ndarray:
+    with open(path, "rb") as f:
+        f.seek(info.header_offset)
+        header = _LOCAL_HEADER.unpack(f.read(_LOCAL_HEADER.size))
+        name_length, extra_length = header[-2:]
+        f.seek(info.header_offset + _LOCAL_HEADER.size + name_length + extra_length)
+        version = np.lib.format.read_magic(f)
+        read_header = (
+            np.lib.format.read_array_header_1_0
+            if version == (1, 0)
+            else np.lib.format.read_array_header_2_0
+        )
+        shape, fortran_order, dtype = read_header(f)
+        offset = f.tell()
+    assert not dtype.hasobject, (
+        f"Array `{info.filename}` in {os.path.basename(path)} holds Python objects."
+    )
+    if not shape or np.prod(shape) == 0:
+        return np.zeros(shape, dtype=dtype)
+    return np.memmap(
+        path,
+        dtype=dtype,
+        mode="r",
+        offset=offset,
+        shape=shape,
+        order="F" if fortran_order else "C",
+    )
+
+
+def _load_npz(path: str) -> Dict[str, np.ndarray]:
+    arrays = {}
+    with zipfile.ZipFile(path) as archive:
+        for info in archive.infolist():
+            assert info.filename.endswith(".npy"), (
+                f"{os.path.basename(path)} holds `{info.filename}`, which is not an array "
+                f"saved by np.savez."
+            )
+            name = info.filename[:-len(".npy")]
+            if info.compress_type == zipfile.ZIP_STORED:
+                arrays[name] = _memmap_stored_member(path, info)
+            else:
+                with archive.open(info) as member:
+                    arrays[name] = np.lib.format.read_array(member, allow_pickle=False)
+    return arrays
+
+
+def _load_parquet(path: str) -> Dict[str, np.ndarray]:
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise AssertionError(
+            f"Reading {os.path.basename(path)} needs pyarrow, which this grading "
+            f"environment lacks. Write results.npz or results.csv instead."
+        ) from None
+    table = pq.read_table(path, memory_map=True)
+    arrays = {}
+    for field, column in zip(table.schema, table.columns):
+        assert column.null_count == 0, (
+            f"Column `{field.name}` in {os.path.basename(path)} has "
+            f"{column.null_count} missing value(s)."
+        )
+        arrays[field.name] = column.to_numpy()
+    return arrays
+
+
+def load_binary_results(
+        path: str,
+        id_col_name: str,
+        pred_col_names: List[str],
+    ) -> pd.DataFrame:
+    """Load a binary results file and check its schema.
+
+    Only the schema is checked here: that the ID and prediction columns exist, are 1-D and
+    of equal length, and have valid dtypes. Whether int8 predictions are all 0 or 1 is
+    checked with the CSV's values, by `prediction_checks.validate_binary_columns`.
+
+    :param path: Path to results.npz or results.parquet
+    :type path: str
+    :param id_col_name: Name of the ID column, e.g. "agent_id"
+    :type id_col_name: str
+    :param pred_col_names: Names of the binary prediction columns
+    :type pred_col_names: List[str]
+    :return: ID and prediction columns, backed by the file's arrays where possible
+    :rtype: pd.DataFrame
+    """
+    assert os.path.isfile(path), f"{path=} is not a file."
+    file_name = os.path.basename(path)
+    arrays = _load_parquet(path) if path.endswith(".parquet") else _load_npz(path)
+
+    for col_name in [id_col_name] + pred_col_names:
+        assert col_name in arrays, f"`{col_name}` must be an array name in {file_name}."
+        assert arrays[col_name].ndim == 1, (
+            f"Array `{col_name}` in {file_name} must be 1-D, not of shape "
+            f"{arrays[col_name].shape}."
+        )
+    n_rows = len(arrays[id_col_name])
+    for col_name in pred_col_names:
+        assert len(arrays[col_name]) == n_rows, (
+            f"Array `{col_name}` in {file_name} has {len(arrays[col_name])} rows, but "
+            f"`{id_col_name}` has {n_rows}."
+        )
+    assert arrays[id_col_name].dtype.kind in "iu", (
+        f"Array `{id_col_name}` in {file_name} must have an integer dtype, not "
+        f"{arrays[id_col_name].dtype}."
+    )
+    for col_name in pred_col_names:
+        assert arrays[col_name].dtype in PREDICTION_DTYPES, (
+            f"Array `{col_name}` in {file_name} must have dtype bool, int8 or uint8, not "
+            f"{arrays[col_name].dtype}."
+        )
+
+    # Column by column, without consolidating them into one block, so nothing is copied.
+    return pd.DataFrame(
+        {col_name: arrays[col_name] for col_name in [id_col_name] + pred_col_names},
+        copy=False,
+    )
@@ -0,0 +1,251 @@
+"""Bootstrap confidence intervals and paired comparisons of confusion-matrix metrics.
+
+Each row falls in one confusion category (TN, FP, FN or TP) per prediction column. A
+bootstrap resample of the rows only changes how many rows fall in each distinct combination
+of categories across the columns, so it is drawn as one multinomial over the combinations
+seen, weighted by how often each was seen. A resample then costs O(n_combinations), however
+many rows there are, and the metrics of every resample come from one matrix product plus
+the vectorized functions of `confusion_metrics`.
+
+Resampling every column's categories jointly keeps the columns' correlation, so averages
+across columns get valid intervals too, and comparing two submissions on the same rows
+(a paired comparison) is a resample of both submissions' categories side by side.
+"""
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from confusion_metrics import ConfusionCounts, confusion_counts
+
+
+TN, FP, FN, TP = 0, 1, 2, 3
+# Caps resamples x distinct combinations drawn at once, i.e. the size of one batch of draws.
+MAX_DRAWS_PER_BATCH = 2**24
+
+
+def confusion_categories(labels: np.ndarray, preds: np.ndarray) -> np.ndarray:
+    """Confusion category of each cell of aligned 0/1 label and prediction blocks.
+
+    :param labels: (n_rows, n_cols) block of 0/1 labels
+    :type labels: np.ndarray
+    :param preds: (n_rows, n_cols) block of 0/1 predictions, row-aligned with `labels`
+    :type preds: np.ndarray
+    :return: (n_rows, n_cols) int8 block of TN, FP, FN or TP
+    :rtype: np.ndarray
+    """
+    assert labels.shape == preds.shape, f"{labels.shape=} != {preds.shape=}"
+    return 2 * labels.astype(bool).astype(np.int8) + preds.astype(bool).astype(np.int8)
+
+
+def category_combinations(categories: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Distinct rows of a block of confusion categories and how many rows have each.
+
+    :param categories: (n_rows, n_cols) block from `confusion_categories`
+    :type categories: np.ndarray
+    :return: (n_combinations, n_cols) distinct rows and (n_combinations,) row counts
+    :rtype: Tuple[np.ndarray, np.ndarray]
+    """
+    n_cols = categories.shape[1]
+    # Two bits per column, packed into one int64 key per row.
+    assert n_cols <= 31, f"{n_cols=} columns do not fit in an int64 key."
+    place_values = 4 ** np.arange(n_cols, dtype=np.int64)
+    keys, frequencies = np.unique(
+        categories.astype(np.int64) @ place_values, return_counts=True
+    )
+    combinations = (keys[:, None] // place_values) % 4
+    return combinations.astype(np.int8), frequencies
+
+
+def resample_counts(
+        combinations: np.ndarray,
+        frequencies: np.ndarray,
+        n_resamples: int,
+        rng: np.random.Generator,
+    ) -> ConfusionCounts:
+    """Draw confusion counts of bootstrap resamples of the rows.
+
+    :param combinations: Distinct category rows, from `category_combinations`
+    :type combinations: np.ndarray
+    :param frequencies: Number of rows with each combination
+    :type frequencies: np.ndarray
+    :param n_resamples: Number of resamples to draw
+    :type n_resamples: int
+    :param rng: Random generator
+    :type rng: np.random.Generator
+    :return: Confusion counts, each an int64 array of shape (n_resamples, n_cols)
+    :rtype: ConfusionCounts
+    """
+    n_rows = int(frequencies.sum())
+    draws = rng.multinomial(n_rows, frequencies / n_rows, size=n_resamples)
+    return ConfusionCounts(
+        *(
+            draws @ (combinations == category).astype(np.int64)
+            for category in (TP, FP, FN, TN)
+        )
+    )
+
+
+def bootstrap_metrics(
+        categories: np.ndarray,
+        metrics: Dict[str, Callable],
+        n_resamples: int,
+        seed: Optional[int] = None,
+    ) -> Dict[str, np.ndarray]:
+    """Compute each metric on bootstrap resamples of the rows.
+
+    :param categories: (n_rows, n_cols) block from `confusion_categories`
+    :type categories: np.ndarray
+    :param metrics: Metric functions of ConfusionCounts, e.g. `confusion_metrics.f1`
+    :type metrics: Dict[str, Callable]
+    :param n_resamples: Number of resamples
+    :type n_resamples: int
+    :param seed: Seed of the resampling
+    :type seed: Optional[int]
+    :return: (n_resamples, n_cols) metric values per metric name
+    :rtype: Dict[str, np.ndarray]
+    """
+    combinations, frequencies = category_combinations(categories)
+    rng = np.random.default_rng(seed)
+    batch_size = max(1, MAX_DRAWS_PER_BATCH // len(frequencies))
+    samples: Dict[str, List[np.ndarray]] = {metric_name: [] for metric_name in metrics}
+    for start in range(0, n_resamples, batch_size):
+        counts = resample_counts(
+            combinations, frequencies, min(batch_size, n_resamples - start), rng
+        )
+        for metric_name, metric_fn in metrics.items():
+            samples[metric_name].append(metric_fn(counts))
+    return {
+        metric_name: np.concatenate(metric_samples)
+        for metric_name, metric_samples in samples.items()
+    }
+
+
+def _with_avg(values: np.ndarray, avg_col_name: Optional[str]) -> np.ndarray:
+    # Appends the average across columns as one more column.
+    if avg_col_name is None:
+        return values
+    return np.concatenate([values, values.mean(axis=-1, keepdims=True)], axis=-1)
+
+
+def percentile_interval(
+        samples: np.ndarray,
+        confidence: float,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+    """Percentile bootstrap interval per column of (n_resamples, n_cols) samples."""
+    alpha = 1 - confidence
+    low, high = np.quantile(samples, [alpha / 2, 1 - alpha / 2], axis=0)
+    return low, high
+
+
+def confidence_interval_df(
+        samples: Dict[str, np.ndarray],
+        col_names: List[str],
+        confidence: float,
+        avg_col_name: Optional[str] = None,
+    ) -> pd.DataFrame:
+    """Lay out the intervals of bootstrapped metrics like a grading DF.
+
+    :param samples: Output of `bootstrap_metrics`
+    :type samples: Dict[str, np.ndarray]
+    :param col_names: Names of the prediction columns
+    :type col_names: List[str]
+    :param confidence: Confidence level of the intervals, e.g. 0.95
+    :type confidence: float
+    :param avg_col_name: If given, also report the interval of the average across columns
+        under this column name
+    :type avg_col_name: Optional[str]
+    :return: Rows "{metric_name}_ci_low" and "{metric_name}_ci_high" per metric, with
+        prediction columns as columns
+    :rtype: pd.DataFrame
+    """
+    rows = {}
+    for metric_name, metric_samples in samples.items():
+        low, high = percentile_interval(_with_avg(metric_samples, avg_col_name), confidence)
+        rows[f"{metric_name}_ci_low"] = low
+        rows[f"{metric_name}_ci_high"] = high
+    return pd.DataFrame.from_dict(
+        rows,
+        orient="index",
+        columns=col_names + ([avg_col_name] if avg_col_name is not None else []),
+    ).rename_axis("metric_name")
+
+
+def paired_comparison_df(
+        labels: np.ndarray,
+        baseline_preds: np.ndarray,
+        candidate_preds: np.ndarray,
+        metrics: Dict[str, Callable],
+        col_names: List[str],
+        n_resamples: int,
+        confidence: float,
+        seed: Optional[int] = None,
+        avg_col_name: Optional[str] = None,
+    ) -> pd.DataFrame:
+    """Compare two submissions' metrics on the same rows with a paired bootstrap.
+
+    Both submissions are scored on each resample of the rows, so the interval of their
+    difference excludes the noise that the rows' sampling adds to both alike.
+
+    :param labels: (n_rows, n_cols) block of 0/1 labels
+    :type labels: np.ndarray
+    :param baseline_preds: Baseline's 0/1 predictions, row-aligned with `labels`
+    :type baseline_preds: np.ndarray
+    :param candidate_preds: Candidate's 0/1 predictions, row-aligned with `labels`
+    :type candidate_preds: np.ndarray
+    :param metrics: Metric functions of ConfusionCounts, e.g. `confusion_metrics.f1`
+    :type metrics: Dict[str, Callable]
+    :param col_names: Names of the prediction columns
+    :type col_names: List[str]
+    :param n_resamples: Number of resamples
+    :type n_resamples: int
+    :param confidence: Confidence level of the difference's interval, e.g. 0.95
+    :type confidence: float
+    :param seed: Seed of the resampling
+    :type seed: Optional[int]
+    :param avg_col_name: If given, also compare the averages across columns under this
+        column name
+    :type avg_col_name: Optional[str]
+    :return: Per metric, rows "{metric_name}_baseline", "{metric_name}_candidate",
+        "{metric_name}_diff" (candidate minus baseline), "{metric_name}_diff_ci_low",
+        "{metric_name}_diff_ci_high" and "{metric_name}_p_value", the two-sided bootstrap
+        p-value of no difference; prediction columns as columns
+    :rtype: pd.DataFrame
+    """
+    n_cols = labels.shape[1]
+    categories = np.concatenate(
+        [
+            confusion_categories(labels, baseline_preds),
+            confusion_categories(labels, candidate_preds),
+        ],
+        axis=1,
+    )
+    samples = bootstrap_metrics(categories, metrics, n_resamples, seed)
+    baseline_counts = confusion_counts(labels, baseline_preds)
+    candidate_counts = confusion_counts(labels, candidate_preds)
+
+    rows = {}
+    for metric_name, metric_fn in metrics.items():
+        baseline = _with_avg(metric_fn(baseline_counts), avg_col_name)
+        candidate = _with_avg(metric_fn(candidate_counts), avg_col_name)
+        diff_samples = (
+            _with_avg(samples[metric_name][:, n_cols:], avg_col_name)
+            - _with_avg(samples[metric_name][:, :n_cols], avg_col_name)
+        )
+        low, high = percentile_interval(diff_samples, confidence)
+        rows[f"{metric_name}_baseline"] = baseline
+        rows[f"{metric_name}_candidate"] = candidate
+        rows[f"{metric_name}_diff"] = candidate - baseline
+        rows[f"{metric_name}_diff_ci_low"] = low
+        rows[f"{metric_name}_diff_ci_high"] = high
+        rows[f"{metric_name}_p_value"] = np.minimum(
+            1.0,
+            2 * np.minimum(
+                (diff_samples <= 0).mean(axis=0), (diff_samples >= 0).mean(axis=0)
+            ),
+        )
+    return pd.DataFrame.from_dict(
+        rows,
+        orient="index",
+        columns=col_names + ([avg_col_name] if avg_col_name is not None else []),
+    ).rename_axis("metric_name")
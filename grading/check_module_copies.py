@@ -0,0 +1,68 @@
+"""Check that the modules shared by the grading scripts and the example submissions agree.
+
+Each copy of a shared module must be byte-for-byte identical to the others. Edit one copy,
+then copy it over the rest; this script exits with code 1 and lists the copies that differ
+from the first one of their group otherwise.
+"""
+import argparse
+import filecmp
+import os
+from typing import Dict, List
+
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SUBMISSION_DIRS = ["ha_example_submission", "synthcc_example_submission"]
+# Module file name -> directories, relative to the repo root, that hold a copy of it.
+SHARED_MODULES: Dict[str, List[str]] = {
+    "columnar_cache.py": ["grading", *SUBMISSION_DIRS],
+    "schemas.py": ["grading", *SUBMISSION_DIRS],
+    "confusion_metrics.py": ["grading", *SUBMISSION_DIRS],
+    "linear_model.py": SUBMISSION_DIRS,
+    "cross_validation.py": SUBMISSION_DIRS,
+}
+
+
+def find_diverged_copies(repo_dir: str = REPO_DIR) -> List[str]:
+    """Describe every copy of a shared module that is missing or differs from the first.
+
+    :param repo_dir: Root of the starter pack repo
+    :type repo_dir: str
+    :return: One message per missing or diverged copy, empty if all copies agree
+    :rtype: List[str]
+    """
+    problems = []
+    for module_name, dir_names in SHARED_MODULES.items():
+        paths = [os.path.join(repo_dir, dir_name, module_name) for dir_name in dir_names]
+        reference_path = paths[0]
+        for path in paths:
+            if not os.path.isfile(path):
+                problems.append(f"{os.path.relpath(path, repo_dir)} is missing.")
+            elif path != reference_path and os.path.isfile(reference_path) and not (
+                filecmp.cmp(reference_path, path, shallow=False)
+            ):
+                problems.append(
+                    f"{os.path.relpath(path, repo_dir)} differs from "
+                    f"{os.path.relpath(reference_path, repo_dir)}."
+                )
+    return problems
+
+
+def main(repo_dir: str) -> int:
+    problems = find_diverged_copies(repo_dir)
+    for problem in problems:
+        print(problem)
+    print(f"{len(problems)} problem(s) with the copies of {len(SHARED_MODULES)} modules.")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--repo_dir",
+        type=str,
+        default=REPO_DIR,
+        help="Root of the starter pack repo. Defaults to the one holding this script."
+    )
+
+    args = parser.parse_args()
+    raise SystemExit(main(args.repo_dir))
@@ -40,12 +40,92 @@ fi
 
 SUBMISSION_REPO_NAME=$1
 RESULTS_DIR="$GRADING_REPO_DIR/bth-results-$SUBMISSION_REPO_NAME"
-mkdir $RESULTS_DIR  # Ensure dir exists for user to write to.
+# Emptied first, so results left by an earlier run of the submission are never graded.
+rm -rf "$RESULTS_DIR"
+mkdir "$RESULTS_DIR"  # Ensure dir exists for user to write to.
 chmod -R 744 $RESULTS_DIR  # Results dir must be written to by team-provided script.
 
+# Every stage below -- env activation, the submission's __main__.py, and each stage of the
+#  grading script -- is timed into one JSON report next to the grading CSV.
+GRADING_OUTPUT_DIR="$GRADING_REPO_DIR/grading_results"
+TIMINGS_REPORT="$GRADING_OUTPUT_DIR/bth-results-$SUBMISSION_REPO_NAME.timings.json"
+# Started afresh, so stages recorded by an earlier run never mix with this run's.
+rm -f "$TIMINGS_REPORT"
+INSTRUMENTATION="$GRADING_REPO_DIR/instrumentation.py"
+# Set BTH_INFERENCE_TIMEOUT_S to kill __main__.py once it exceeds its time budget.
+BTH_INFERENCE_TIMEOUT_S="${BTH_INFERENCE_TIMEOUT_S:-}"
+
 # -------------------------------------------
 
-# Install and activate hackathon team's conda env.
+printf "\nInitializing conda in the shell may throw errors unrelated "\
+    "to the environment used for grading. As long as the grading script does not , " \
+    "error, this is fine.\n"
+source ~/opt/miniconda3/bin/activate
+
+# Conda envs are cached by a hash of their spec file's contents: each spec is solved and
+#  installed once into $BTH_ENV_CACHE_DIR/<name>-<hash>, and every later run with a
+#  byte-identical spec just activates that prefix. Editing the spec changes the hash, so
+#  a stale env is never reused. Specs with unpinned versions resolve once per hash, not
+#  once per run.
+BTH_ENV_CACHE_DIR="${BTH_ENV_CACHE_DIR:-$HOME/.cache/bth-conda-envs}"
+mkdir -p "$BTH_ENV_CACHE_DIR"
+
+# Runs the command in its remaining arguments while holding an exclusive lock on the file
+#  in its first. The lock is an flock taken through Python, since macOS ships neither
+#  flock(1) nor a bash new enough to open a file descriptor into a variable. The command
+#  inherits the locked file, so the lock is held until both it and the Python process exit,
+#  and the kernel releases it however they die.
+with_lock() {
+    python -c '
+import fcntl, subprocess, sys
+with open(sys.argv[1], "w") as lock_file:
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        print(f"\nWaiting for another eval to release {sys.argv[1]}.", flush=True)
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+    sys.exit(subprocess.call(sys.argv[2:], pass_fds=(lock_file.fileno(),)))
+' "$@"
+}
+
+build_cached_env() {
+    local spec_path=$1
+    local env_prefix=$2
+    if [[ -f "$env_prefix/.bth-env-complete" ]]; then
+        printf "\nReusing cached environment '$env_prefix'.\n"
+    else
+        printf "\nCreating environment '$env_prefix' from $spec_path.\n"
+        rm -rf "$env_prefix"
+        # Runs in a child shell, where conda's shell function is not defined.
+        if "${CONDA_EXE:-conda}" env create -f "$spec_path" -p "$env_prefix"; then
+            touch "$env_prefix/.bth-env-complete"
+        fi
+    fi
+}
+export -f build_cached_env
+
+activate_cached_env() {
+    local spec_path=$1
+    local env_name=$2
+    local spec_hash=`python -c "import hashlib, sys; print(hashlib.sha256(open(sys.argv[1], 'rb').read()).hexdigest()[:16])" "$spec_path"`
+    local env_prefix="$BTH_ENV_CACHE_DIR/$env_name-$spec_hash"
+
+    # Envs are not relocatable, so they cannot be built elsewhere and renamed into place.
+    #  Instead, concurrent evals with the same spec take turns: the first builds, the rest
+    #  wait and then reuse it. The marker file is only written once a build succeeds, so
+    #  an interrupted build, whose lock the kernel releases, is redone by the next eval.
+    with_lock "$env_prefix.flock" \
+        bash -c 'build_cached_env "$1" "$2"' _ "$spec_path" "$env_prefix"
+
+    if [[ ! -f "$env_prefix/.bth-env-complete" ]]; then
+        printf "\nCould not create environment from $spec_path.\n"
+        exit 1
+    fi
+    printf "\nActivating environment '$env_prefix'\n"
+    conda activate "$env_prefix"
+}
+
+# Install (if not cached) and activate hackathon team's conda env.
 SUBMISSION_ENV_NAME=`python << EOF
 import yaml
 import os
@@ -57,55 +137,51 @@ assert "name" in env.keys(), "./env.yaml does not contain a 'name'"
 print(env["name"])
 EOF
 `
-# if conda env list | grep -q "^$SUBMISSION_ENV_NAME "; then
-#     printf "\nEnvironment '$SUBMISSION_ENV_NAME' exists. Deleting and re-installing.\n"
-#     conda activate base
-#     conda env remove -n $SUBMISSION_ENV_NAME
-# fi
-# printf "\nCreating environment '$SUBMISSION_ENV_NAME'.\n"
-# conda env create -f env.yaml
-
-printf "\nInitializing conda in the shell may throw errors unrelated "\
-    "to the environment used for grading. As long as the grading script does not , " \
-    "error, this is fine.\n"
-source ~/opt/miniconda3/bin/activate
-
-printf "\nActivating environment '$SUBMISSION_ENV_NAME'\n"
-conda activate $SUBMISSION_ENV_NAME
+STAGE_STARTED_AT=`python -c "import time; print(time.time())"`
+activate_cached_env ./env.yaml $SUBMISSION_ENV_NAME
+python "$INSTRUMENTATION" record --report "$TIMINGS_REPORT" --stage submission_env \
+    --started_at $STAGE_STARTED_AT
 
 # -------------------------------------------
 
 printf "\nRunning team-provided submission script.\n"
-python __main__.py --bth_test_set $TEST_SET_INPUTS_DIR --bth_results $RESULTS_DIR
+python "$INSTRUMENTATION" run --report "$TIMINGS_REPORT" --stage inference \
+    --rows_csv "$RESULTS_DIR/results.csv" \
+    ${BTH_INFERENCE_TIMEOUT_S:+--timeout_s $BTH_INFERENCE_TIMEOUT_S} \
+    -- python __main__.py --bth_test_set $TEST_SET_INPUTS_DIR --bth_results $RESULTS_DIR
+INFERENCE_EXIT_CODE=$?
+if [[ $INFERENCE_EXIT_CODE != 0 ]]; then
+    printf "\nTeam-provided submission script failed with exit code $INFERENCE_EXIT_CODE.\n"
+    exit $INFERENCE_EXIT_CODE
+fi
 
 # -------------------------------------------
 
 printf "\nCreating grading conda env if it needs to be created.\n"
 GRADING_ENV_NAME="grading-env" 
-if conda env list | grep -q "^$GRADING_ENV_NAME "; then
-    printf "Environment '$GRADING_ENV_NAME' exists."
-else
-    printf "Creating environment '$GRADING_ENV_NAME'."
-    conda env create -f $GRADING_REPO_DIR/grading_env.yaml
-fi
-
-printf "\nActivating grading conda env.\n"
-conda activate $GRADING_ENV_NAME
+STAGE_STARTED_AT=`python -c "import time; print(time.time())"`
+activate_cached_env $GRADING_REPO_DIR/grading_env.yaml $GRADING_ENV_NAME
+python "$INSTRUMENTATION" record --report "$TIMINGS_REPORT" --stage grading_env \
+    --started_at $STAGE_STARTED_AT
 
 # -------------------------------------------
 
 printf "\nRunning grading script.\n"
 if [[ $DATASET == "ha" ]]; then
-    python "$GRADING_REPO_DIR/grade_ha_submission.py" \
+    python "$INSTRUMENTATION" run --report "$TIMINGS_REPORT" --stage grading \
+        -- python "$GRADING_REPO_DIR/grade_ha_submission.py" \
         --results_dir $RESULTS_DIR \
         --test_labels_path $TEST_SET_LABELS_PATH \
-        --grading_output_dir "$GRADING_REPO_DIR/grading_results"
+        --grading_output_dir "$GRADING_OUTPUT_DIR"
 elif [[ $DATASET == "synthcc" ]]; then
-    python "$GRADING_REPO_DIR/grade_synthbank_submission.py" \
+    python "$INSTRUMENTATION" run --report "$TIMINGS_REPORT" --stage grading \
+        -- python "$GRADING_REPO_DIR/grade_synthbank_submission.py" \
         --results_dir $RESULTS_DIR \
         --test_labels_path $TEST_SET_LABELS_PATH \
-        --grading_output_dir "$GRADING_REPO_DIR/grading_results"
+        --grading_output_dir "$GRADING_OUTPUT_DIR"
 else
     printf "Value for DATSET is $DATASET, which is neither 'ha' or 'synthcc'. It must be one of those."
     exit 1
 fi
+
+printf "\nStage timings written to $TIMINGS_REPORT.\n"
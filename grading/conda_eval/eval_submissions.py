@@ -0,0 +1,593 @@
+"""Evaluate many submissions at once: check out, run inference in parallel, then grade.
+
+`eval_wrapper.sh` evaluates one submission repo at a time. At a deadline, this script
+evaluates every team's tag in one go instead. It reads a CSV of (repo, tag, dataset) rows
+and does the following for each submission:
+1. Check out the tag into its own git worktree, so submissions never share a directory.
+2. Build or reuse the submission's conda env. The env cache is the one `eval.sh` uses,
+    keyed by a hash of env.yaml.
+3. Run `__main__.py` against the dataset's test set, with per-job CPU, memory and time
+    limits.
+
+Up to --num_workers submissions go through these steps at once. Then all results
+directories of a dataset are graded in one batch by that dataset's grading script. The
+grades are joined with each submission's status and per-stage timings into
+`leaderboard_{dataset}.csv` in --work_dir. Each submission's stages are also written, with
+CPU time and peak RSS, to its JSON timing report next to its grading CSV (see
+`instrumentation.py`).
+"""
+import argparse
+import fcntl
+import hashlib
+import os
+import queue
+import re
+import shutil
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import pandas as pd
+
+
+GRADING_REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, GRADING_REPO_DIR)
+import binary_results  # noqa: E402
+import instrumentation  # noqa: E402
+
+GRADING_SCRIPTS = {
+    "synthcc": "grade_synthbank_submission.py",
+    "ha": "grade_ha_submission.py",
+}
+SORT_BY = {"synthcc": "f1_avg", "ha": "f1_HadHeartAttack"}
+# Env vars that cap the threads numpy/BLAS and friends start, set to --cpus_per_job.
+THREAD_ENV_VARS = (
+    "OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS", "NUMEXPR_NUM_THREADS"
+)
+DEFAULT_ENV_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "bth-conda-envs")
+# Run by the orchestrator's Python in front of each inference command: applies the job's
+#  memory and CPU limits to itself, then execs the command, which inherits them. Setting
+#  them in a `preexec_fn` instead is unsafe while the orchestrator's threads are running.
+LIMIT_AND_EXEC = """
+import os, resource, sys
+memory_bytes, cpus, *args = sys.argv[1:]
+if memory_bytes:
+    resource.setrlimit(resource.RLIMIT_AS, (int(memory_bytes), int(memory_bytes)))
+if cpus and hasattr(os, "sched_setaffinity"):
+    os.sched_setaffinity(0, [int(cpu) for cpu in cpus.split(",")])
+os.execvp(args[0], args)
+"""
+
+
+class Submission(NamedTuple):
+    name: str
+    repo: str
+    tag: str
+    dataset: str
+
+
+class JobLimits(NamedTuple):
+    timeout_s: Optional[float]
+    memory_bytes: Optional[int]
+    cpus_per_job: Optional[int]
+
+
+def read_submissions(submissions_csv: str) -> List[Submission]:
+    """Read the (repo, tag, dataset) rows to evaluate.
+
+    :param submissions_csv: CSV with columns [repo, tag, dataset]. `repo` is a git URL or a
+        local path; `dataset` is "synthcc" or "ha".
+    :type submissions_csv: str
+    :return: Submissions, each with a unique, filesystem-safe name
+    :rtype: List[Submission]
+    """
+    submissions_df = pd.read_csv(submissions_csv, dtype=str)
+    missing_cols = {"repo", "tag", "dataset"} - set(submissions_df.columns)
+    assert not missing_cols, f"{submissions_csv} lacks the columns {sorted(missing_cols)}."
+    submissions = []
+    names = set()
+    for row in submissions_df.itertuples(index=False):
+        assert row.dataset in GRADING_SCRIPTS, (
+            f"Dataset {row.dataset!r} for {row.repo}@{row.tag} is neither 'ha' nor "
+            "'synthcc'."
+        )
+        repo_name = os.path.basename(row.repo.rstrip("/"))
+        repo_name = repo_name[:-len(".git")] if repo_name.endswith(".git") else repo_name
+        base_name = re.sub(r"[^A-Za-z0-9._-]+", "_", f"{repo_name}-{row.tag}")
+        name = base_name
+        i = 1
+        while name in names:
+            i += 1
+            name = f"{base_name}-{i}"
+        names.add(name)
+        submissions.append(Submission(name, row.repo, row.tag, row.dataset))
+    return submissions
+
+
+def _run(args: List[str], **kwargs) -> subprocess.CompletedProcess:
+    return subprocess.run(args, check=True, capture_output=True, text=True, **kwargs)
+
+
+def checkout(submission: Submission, work_dir: str) -> str:
+    """Check out a submission's tag into a fresh worktree of a shared mirror of its repo.
+
+    :return: Path to the worktree
+    :rtype: str
+    """
+    repo_key = hashlib.sha1(submission.repo.encode()).hexdigest()[:12]
+    mirror_dir = os.path.join(work_dir, "repos", f"{repo_key}.git")
+    if os.path.isdir(mirror_dir):
+        _run(["git", "--git-dir", mirror_dir, "fetch", "--prune", "--tags", "origin"])
+    else:
+        _run(["git", "clone", "--mirror", submission.repo, mirror_dir])
+
+    worktree_dir = os.path.join(work_dir, "worktrees", submission.name)
+    if os.path.isdir(worktree_dir):
+        _run([
+            "git", "--git-dir", mirror_dir, "worktree", "remove", "--force", worktree_dir
+        ])
+    _run(["git", "--git-dir", mirror_dir, "worktree", "prune"])
+    _run([
+        "git", "--git-dir", mirror_dir, "worktree", "add", "--detach", worktree_dir,
+        submission.tag,
+    ])
+    return worktree_dir
+
+
+def ensure_env(conda: str, spec_path: str, env_cache_dir: str) -> str:
+    """Build a conda env from a spec unless `eval.sh`'s hash-keyed cache already has it.
+
+    :param conda: Path to the conda executable
+    :type conda: str
+    :param spec_path: Path to env.yaml
+    :type spec_path: str
+    :param env_cache_dir: Cache directory, shared with `eval.sh`
+    :type env_cache_dir: str
+    :return: Prefix of the env
+    :rtype: str
+    """
+    assert os.path.isfile(spec_path), f"{spec_path} does not exist"
+    with open(spec_path, "rb") as f:
+        spec = f.read()
+    # Same prefix as eval.sh's activate_cached_env: <name>-<first 16 hex of sha256>.
+    match = re.search(rb"""^name:\s*["']?([^"'\s#]+)""", spec, re.MULTILINE)
+    assert match, f"{spec_path} does not contain a 'name'"
+    env_name = match.group(1).decode()
+    env_prefix = os.path.join(
+        env_cache_dir, f"{env_name}-{hashlib.sha256(spec).hexdigest()[:16]}"
+    )
+    marker_path = os.path.join(env_prefix, ".bth-env-complete")
+    lock_path = f"{env_prefix}.flock"
+
+    os.makedirs(env_cache_dir, exist_ok=True)
+    # The same flock eval.sh takes. The kernel releases it when its holder exits, however
+    #  it dies, so a killed build never blocks later runs; they find no marker and rebuild.
+    with open(lock_path, "w") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            print(
+                f"Waiting for another eval to finish building {env_prefix} ({lock_path})."
+            )
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        if not os.path.isfile(marker_path):
+            shutil.rmtree(env_prefix, ignore_errors=True)
+            _run([conda, "env", "create", "-f", spec_path, "-p", env_prefix])
+            open(marker_path, "w").close()
+    return env_prefix
+
+
+def limited_command(
+        args: List[str],
+        memory_bytes: Optional[int],
+        cpus: Optional[List[int]],
+    ) -> List[str]:
+    """Prefix a command so that it runs under an address-space limit and CPU affinity.
+
+    :return: The command, started through LIMIT_AND_EXEC if any limit is set
+    :rtype: List[str]
+    """
+    if memory_bytes is None and cpus is None:
+        return args
+    return [
+        sys.executable, "-c", LIMIT_AND_EXEC,
+        str(memory_bytes) if memory_bytes is not None else "",
+        ",".join(str(cpu) for cpu in cpus) if cpus is not None else "",
+        *args,
+    ]
+
+
+def run_inference(
+        conda: str,
+        env_prefix: str,
+        worktree_dir: str,
+        test_set_dir: str,
+        results_dir: str,
+        log_path: str,
+        limits: JobLimits,
+        cpus: Optional[List[int]],
+    ) -> Tuple[Optional[str], dict]:
+    """Run a submission's `__main__.py` in its env with the job limits applied.
+
+    :return: None on success, otherwise why the run failed; and the "inference" stage's
+        timing report entry
+    :rtype: Tuple[Optional[str], dict]
+    """
+    env = dict(os.environ)
+    if limits.cpus_per_job is not None:
+        env.update({var: str(limits.cpus_per_job) for var in THREAD_ENV_VARS})
+    args = [
+        conda, "run", "--no-capture-output", "-p", env_prefix,
+        "python", "__main__.py",
+        "--bth_test_set", test_set_dir,
+        "--bth_results", results_dir,
+    ]
+    results_csv = os.path.join(results_dir, "results.csv")
+    with open(log_path, "w") as log_file:
+        # Its own session, so a timeout kills conda run and everything it started.
+        returncode, record = instrumentation.run_command(
+            limited_command(args, limits.memory_bytes, cpus),
+            "inference",
+            timeout_s=limits.timeout_s,
+            rows_csv=results_csv,
+            cwd=worktree_dir,
+            env=env,
+            stdout=log_file,
+            stderr=subprocess.STDOUT,
+            start_new_session=True,
+        )
+    if returncode == 124 and limits.timeout_s is not None \
+            and record["wall_s"] > limits.timeout_s:
+        return f"Inference timed out after {limits.timeout_s:.0f}s; see {log_path}.", record
+    if returncode != 0:
+        return f"Inference exited with code {returncode}; see {log_path}.", record
+    try:
+        results_path = binary_results.find_results_file(results_dir)
+    except AssertionError as e:
+        return f"{e} See {log_path}.", record
+    if not os.path.isfile(results_path):
+        return (
+            f"Inference wrote none of {', '.join(binary_results.RESULTS_FILE_NAMES)}; "
+            f"see {log_path}."
+        ), record
+    return None, record
+
+
+def results_dir_of(work_dir: str, submission: Submission) -> str:
+    """Return the directory a submission's `__main__.py` writes its results file to."""
+    return os.path.join(work_dir, "results", f"bth-results-{submission.name}")
+
+
+def evaluate(
+        submission: Submission,
+        worktree_dir: str,
+        test_set_dir: str,
+        work_dir: str,
+        conda: str,
+        env_cache_dir: str,
+        limits: JobLimits,
+        cpu_slots: Optional["queue.Queue[List[int]]"],
+    ) -> Tuple[dict, List[dict]]:
+    """Build or reuse a checked-out submission's env and run its inference.
+
+    :return: Leaderboard row fields (status, error and per-stage timings), and the
+        stages' timing report entries
+    :rtype: Tuple[dict, List[dict]]
+    """
+    row = {}
+    start = time.perf_counter()
+    try:
+        env_prefix = ensure_env(
+            conda, os.path.join(worktree_dir, "env.yaml"), env_cache_dir
+        )
+    except (AssertionError, subprocess.CalledProcessError) as e:
+        row["env_s"] = time.perf_counter() - start
+        stderr = getattr(e, "stderr", None) or ""
+        row.update(status="env_failed", error=f"{e} {stderr.strip()}".strip())
+        return row, [instrumentation.stage_record("submission_env", row["env_s"])]
+    row["env_s"] = time.perf_counter() - start
+    stages = [instrumentation.stage_record("submission_env", row["env_s"])]
+
+    results_dir = results_dir_of(work_dir, submission)
+    # Emptied first, so results left by an earlier run of the submission are never graded.
+    shutil.rmtree(results_dir, ignore_errors=True)
+    os.makedirs(results_dir)
+    log_path = os.path.join(work_dir, "logs", f"{submission.name}.log")
+    cpus = cpu_slots.get() if cpu_slots is not None else None
+    try:
+        error, record = run_inference(
+            conda, env_prefix, worktree_dir, test_set_dir, results_dir, log_path,
+            limits, cpus,
+        )
+    finally:
+        if cpus is not None:
+            cpu_slots.put(cpus)
+    stages.append(record)
+    row["inference_s"] = record["wall_s"]
+    row["inference_cpu_s"] = record["cpu_s"]
+    row["inference_peak_rss_mb"] = record["peak_rss_mb"]
+    row.update(status="inference_failed" if error else "ok", error=error)
+    row["results_dir"] = os.path.normpath(results_dir)
+    return row, stages
+
+
+def grading_output_dir_of(work_dir: str, dataset: str) -> str:
+    """Return the directory a dataset's grading CSVs and timing reports are written to."""
+    return os.path.join(work_dir, "grading_results", dataset)
+
+
+def grade(
+        dataset: str,
+        results_dirs: List[str],
+        test_labels_path: str,
+        work_dir: str,
+        conda: str,
+        env_cache_dir: str,
+        num_workers: int,
+    ) -> pd.DataFrame:
+    """Grade a dataset's results directories in one batch in the grading env.
+
+    :return: The grading script's leaderboard
+    :rtype: pd.DataFrame
+    """
+    grading_env_prefix = ensure_env(
+        conda, os.path.join(GRADING_REPO_DIR, "grading_env.yaml"), env_cache_dir
+    )
+    grading_output_dir = grading_output_dir_of(work_dir, dataset)
+    _run([
+        conda, "run", "-p", grading_env_prefix,
+        "python", os.path.join(GRADING_REPO_DIR, GRADING_SCRIPTS[dataset]),
+        "--results_dirs", *results_dirs,
+        "--test_labels_path", test_labels_path,
+        "--grading_output_dir", grading_output_dir,
+        "--num_workers", str(num_workers),
+    ])
+    return pd.read_csv(os.path.join(grading_output_dir, "leaderboard.csv"))
+
+
+def _cpu_slots(num_workers: int, cpus_per_job: Optional[int]):
+    # Disjoint CPU sets, one per concurrent job, handed out and returned through a queue.
+    if cpus_per_job is None or not hasattr(os, "sched_getaffinity"):
+        return None
+    cpus = sorted(os.sched_getaffinity(0))
+    assert num_workers * cpus_per_job <= len(cpus), (
+        f"{num_workers=} jobs x {cpus_per_job=} exceeds the {len(cpus)} available CPUs."
+    )
+    slots = queue.Queue()
+    for i in range(num_workers):
+        slots.put(cpus[i * cpus_per_job:(i + 1) * cpus_per_job])
+    return slots
+
+
+def main(
+        submissions_csv: str,
+        work_dir: str,
+        test_set_dirs: Dict[str, str],
+        test_labels_paths: Dict[str, str],
+        conda: str,
+        env_cache_dir: str,
+        num_workers: int,
+        limits: JobLimits,
+    ):
+    submissions = read_submissions(submissions_csv)
+    for dir_name in ("worktrees", "results", "logs"):
+        os.makedirs(os.path.join(work_dir, dir_name), exist_ok=True)
+    # As in eval.sh: submissions must not modify the test set. This is to prevent
+    #  accidents, not to stop a determined submission.
+    for dataset in {submission.dataset for submission in submissions}:
+        assert os.path.isdir(test_set_dirs[dataset]), \
+            f"{test_set_dirs[dataset]=} is not a directory."
+        for file_name in os.listdir(test_set_dirs[dataset]):
+            os.chmod(os.path.join(test_set_dirs[dataset], file_name), 0o444)
+
+    # Checkouts share a mirror per repo, so they run one at a time; they are quick
+    #  next to inference.
+    rows = {}
+    stages = {}
+    worktree_dirs = {}
+    for submission in submissions:
+        rows[submission] = {
+            "submission": submission.name,
+            "repo": submission.repo,
+            "tag": submission.tag,
+            "dataset": submission.dataset,
+        }
+        start = time.perf_counter()
+        try:
+            worktree_dirs[submission] = checkout(submission, work_dir)
+        except subprocess.CalledProcessError as e:
+            rows[submission].update(status="checkout_failed", error=e.stderr.strip())
+        rows[submission]["checkout_s"] = time.perf_counter() - start
+        stages[submission] = [
+            instrumentation.stage_record("checkout", rows[submission]["checkout_s"])
+        ]
+
+    cpu_slots = _cpu_slots(num_workers, limits.cpus_per_job)
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        futures = {
+            submission: executor.submit(
+                evaluate,
+                submission,
+                worktree_dir,
+                test_set_dirs[submission.dataset],
+                work_dir,
+                conda,
+                env_cache_dir,
+                limits,
+                cpu_slots,
+            )
+            for submission, worktree_dir in worktree_dirs.items()
+        }
+        for submission, future in futures.items():
+            row, evaluate_stages = future.result()
+            rows[submission].update(row)
+            stages[submission] += evaluate_stages
+            print(f"{submission.name}: {rows[submission]['status']}")
+
+    # Written before grading, which adds its own stages to the same reports. A report left
+    #  by an earlier run is replaced, not merged, so a stage that did not run this time
+    #  (e.g. grading a submission whose inference failed) leaves no stale entry.
+    for submission, submission_stages in stages.items():
+        report_path = instrumentation.timings_path(
+            results_dir_of(work_dir, submission),
+            grading_output_dir_of(work_dir, submission.dataset),
+        )
+        if os.path.exists(report_path):
+            os.remove(report_path)
+        instrumentation.append_stages(report_path, submission_stages)
+
+    for dataset in sorted({submission.dataset for submission in submissions}):
+        dataset_rows = [row for row in rows.values() if row["dataset"] == dataset]
+        results_dirs = [row["results_dir"] for row in dataset_rows if row["status"] == "ok"]
+        leaderboard_df = pd.DataFrame(dataset_rows)
+        grades_df = None
+        if results_dirs:
+            is_ok = leaderboard_df["status"] == "ok"
+            start = time.perf_counter()
+            try:
+                grades_df = grade(
+                    dataset, results_dirs, test_labels_paths[dataset], work_dir, conda,
+                    env_cache_dir, num_workers,
+                )
+            except (AssertionError, subprocess.CalledProcessError) as e:
+                # The inference results are kept and the leaderboard still written, with
+                #  every submission of the failed batch marked as such.
+                stderr = getattr(e, "stderr", None) or ""
+                leaderboard_df.loc[is_ok, "status"] = "grading_failed"
+                leaderboard_df.loc[is_ok, "error"] = f"{e} {stderr.strip()}".strip()
+            # Grading runs as one batch per dataset, so its time is shared.
+            leaderboard_df.loc[is_ok, "grading_batch_s"] = time.perf_counter() - start
+        if grades_df is not None:
+            grades_df = grades_df.drop(columns="submission").rename(
+                columns={"error": "grading_error"}
+            )
+            grades_df["results_dir"] = grades_df["results_dir"].map(os.path.normpath)
+            leaderboard_df = leaderboard_df.merge(grades_df, on="results_dir", how="left")
+            leaderboard_df.loc[leaderboard_df["grading_error"].notna(), "status"] = \
+                "grading_failed"
+            leaderboard_df["error"] = leaderboard_df["error"].fillna(
+                leaderboard_df.pop("grading_error")
+            )
+            sort_by = SORT_BY[dataset]
+            if sort_by in leaderboard_df.columns:
+                leaderboard_df = leaderboard_df.sort_values(
+                    sort_by, ascending=False, na_position="last"
+                )
+        # Keep "error" as the last column, as in the grading scripts' leaderboards.
+        leaderboard_df = leaderboard_df[
+            [col for col in leaderboard_df.columns if col != "error"] + ["error"]
+        ]
+        leaderboard_path = os.path.join(work_dir, f"leaderboard_{dataset}.csv")
+        leaderboard_df.to_csv(leaderboard_path, index=False)
+        print(f"\n{dataset} leaderboard ({leaderboard_path}):")
+        print(leaderboard_df.to_string(index=False))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--submissions_csv",
+        type=str,
+        required=True,
+        help=(
+            "CSV with columns [repo, tag, dataset], one row per submission to evaluate. "
+            "`repo` is a git URL or local path and `dataset` is 'synthcc' or 'ha'."
+        )
+    )
+    parser.add_argument(
+        "--work_dir",
+        type=str,
+        required=True,
+        help=(
+            "Directory for repo mirrors, worktrees, results, logs, grading output and "
+            "the leaderboards."
+        )
+    )
+    for dataset in ("synthcc", "ha"):
+        parser.add_argument(
+            f"--{dataset}_test_set",
+            type=str,
+            default=os.path.join(GRADING_REPO_DIR, "..", f"{dataset}_train_set"),
+            help=f"Directory of {dataset} test set inputs. Defaults to the training set."
+        )
+        parser.add_argument(
+            f"--{dataset}_labels_path",
+            type=str,
+            default=None,
+            help=(
+                f"Path to the {dataset} test labels. Defaults to labels.csv in the test "
+                "set."
+            )
+        )
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        default=1,
+        help="Number of submissions evaluated (and processes grading) at once."
+    )
+    parser.add_argument(
+        "--cpus_per_job",
+        type=int,
+        default=None,
+        help=(
+            "Pin each inference job to this many CPUs of its own and cap its BLAS/OpenMP "
+            "threads to match. By default jobs are not pinned."
+        )
+    )
+    parser.add_argument(
+        "--memory_gb_per_job",
+        type=float,
+        default=None,
+        help="Address-space limit per inference job, in GiB. By default, unlimited."
+    )
+    parser.add_argument(
+        "--timeout_minutes",
+        type=float,
+        default=60,
+        help="Inference jobs running longer than this are killed and marked failed."
+    )
+    parser.add_argument(
+        "--conda",
+        type=str,
+        default=os.environ.get(
+            "CONDA_EXE", os.path.expanduser("~/opt/miniconda3/bin/conda")
+        ),
+        help="Path to the conda executable."
+    )
+    parser.add_argument(
+        "--env_cache_dir",
+        type=str,
+        default=os.environ.get("BTH_ENV_CACHE_DIR", DEFAULT_ENV_CACHE_DIR),
+        help="Conda env cache shared with eval.sh."
+    )
+    args = parser.parse_args()
+    test_set_dirs = {
+        dataset: os.path.abspath(getattr(args, f"{dataset}_test_set"))
+        for dataset in GRADING_SCRIPTS
+    }
+    test_labels_paths = {
+        dataset: os.path.abspath(
+            getattr(args, f"{dataset}_labels_path")
+            or os.path.join(test_set_dirs[dataset], "labels.csv")
+        )
+        for dataset in GRADING_SCRIPTS
+    }
+    main(
+        args.submissions_csv,
+        os.path.abspath(args.work_dir),
+        test_set_dirs,
+        test_labels_paths,
+        args.conda,
+        args.env_cache_dir,
+        args.num_workers,
+        JobLimits(
+            timeout_s=args.timeout_minutes * 60,
+            memory_bytes=(
+                int(args.memory_gb_per_job * 2**30)
+                if args.memory_gb_per_job is not None else None
+            ),
+            cpus_per_job=args.cpus_per_job,
+        ),
+    )
@@ -1,5 +1,8 @@
 #!/usr/bin/env bash
 
+# Evaluates one submission repo. To evaluate many tags at once, e.g. at a deadline, use
+#  eval_submissions.py instead.
+
 # Get absolute path to `grading` folder within the starter pack. This allows the script
 #  to work regardless of where you put the starter pack on your machine. I.e. don't 
 #  change this, especially since you should place your submission repo in the starter pack.
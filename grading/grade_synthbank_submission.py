@@ -1,58 +1,70 @@
 import argparse
+import functools
 import os
 import pathlib
-from typing import List, Dict, Callable
+from typing import List, Dict, Callable, Optional
 
+import numpy as np
 import pandas as pd
-from sklearn.metrics import f1_score
+
+import batch_grading
+import binary_results
+import bootstrap_metrics
+import confusion_metrics
+import instrumentation
+import prediction_checks
+import schemas
+import streaming_grading
+
+
+# F1 works well in unbalanced env with few positives because if the user attempts to max 
+#  recall by predicting all pos, precision will fall dramatically. Likewise, could try 
+#  to max precision by predicting few positives, but then recall would suffer. And 
+#  neither metric is skewed by the large quantity of actual negatives because they do 
+#  not consider true negatives, which are likely abundant in any model trained on this
+#  data. The other metrics are cheap to report alongside since all are derived from the
+#  same confusion counts.
+METRICS: Dict[str, Callable] = {
+    "f1": confusion_metrics.f1,
+    "precision": confusion_metrics.precision,
+    "recall": confusion_metrics.recall,
+    "mcc": confusion_metrics.mcc,
+}
 
 
 def etl_predictions_csv(
         csv_path: str, 
         prediction_windows_months: List[int],
+        stages: Optional[instrumentation.StageRecorder] = None,
     ) -> pd.DataFrame:
-    """Validate the hackathon team's submission and cast prediction cols to int.
+    """Validate the hackathon team's submission and cast prediction cols to int8.
 
-    :param csv_path: Path to results.csv
+    :param csv_path: Path to results.csv, or to a binary results file (see
+        `binary_results`)
     :type csv_path: str
     :param prediction_windows_months: List of numbers of months over which charge-off is
         predicted
     :type prediction_windows_months: List[int]
-    :return: Loaded and validated predictions CSV with predictions cast to int
+    :param stages: Records the "load_csv" and "validate" stages, if given
+    :type stages: Optional[instrumentation.StageRecorder]
+    :return: Loaded and validated predictions CSV with predictions cast to int8
     :rtype: pd.DataFrame
     """
 
-    assert os.path.isfile(csv_path), f"{csv_path=} is not a file."
-    pred_df = pd.read_csv(csv_path)
-    assert "agent_id" in pred_df.columns, (
-        "`agent_id` must be a column name in results.csv."
+    col_names = [
+        f"charge_off_within_{months}_months" for months in prediction_windows_months
+    ]
+    # All windows are checked in one vectorized pass and cast to a compact int8 block.
+    pred_df = prediction_checks.etl_binary_predictions(
+        csv_path, "agent_id", col_names, stages
     )
-    for months in prediction_windows_months:
-        col_name = f"charge_off_within_{months}_months"
-        assert col_name in pred_df.columns, (
-            f"`{col_name}` must be a column name in results.csv"
-        )
-        months_col = pred_df[col_name]
-        assert pd.api.types.is_numeric_dtype(months_col), (
-            f"Column `{col_name}` in results.csv does not consist of numbers: "
-            f"{months_col.head()=}"
-        )
-        assert (months_col % 1 == 0).all(), (
-            f"Column `{col_name}` in results.csv does not consist of integers: "
-            f"{months_col.head()=}"
-        )
-        assert months_col.isin({0, 1}).all(), (
-            f"Column `{col_name}` in results.csv does not consist of 0s and 1s: "
-            f"{months_col.head()=}"
-        )
-        # Cast to int dtype if it isn't already.
-        pred_df[col_name] = pred_df[col_name].astype(int)
     return pred_df
 
 
 def compare_pred_and_label_agents(
         pred_df: pd.DataFrame, 
-        label_df: pd.DataFrame
+        label_df: pd.DataFrame,
+        label_agents: Optional[np.ndarray] = None,
     ):
     """Raise an error if the sets of agents in predictions and labels aren't the same.
 
@@ -60,81 +72,59 @@ def compare_pred_and_label_agents(
     :type pred_df: pd.DataFrame
     :param label_df: DF of labels
     :type label_df: pd.DataFrame
+    :param label_agents: Sorted agents in `label_df`, as returned by
+        `prediction_checks.sorted_unique_ids`, if already built. Pass this when comparing
+        many prediction DFs against the same labels.
+    :type label_agents: Optional[np.ndarray]
     """
-    pred_agents = set(pred_df.agent_id)
-    label_agents = set(label_df.agent_id)
-    if pred_agents > label_agents:
-        raise ValueError(
-            f"Predictions have more agents than labels. Agents in pred but not in "
-            f"labels: {pred_agents - label_agents}"
-        )
-    elif label_agents > pred_agents:
-        raise ValueError(
-            f"Labels have more agents than predictions. Agents in labels but not in "
-            f"pred: {label_agents - pred_agents}"
-        )
-    if pred_agents != label_agents:
-        raise ValueError(
-            f"Labels and preds have different sets of agents. Agents in labels but not "
-            f"in pred: {label_agents - pred_agents}.\nAgents in pred but not in labels: "
-            f"{pred_agents - label_agents}"
-        )
-    
-    if len(pred_df) != len(label_df):
-        raise ValueError(
-            f"Labels and preds have different numbers of rows. There should be one row "
-            f"per test set example in need of a prediction. {len(pred_df)=}; "
-            f"{len(label_df)=}"
-        )
+    prediction_checks.reconcile_ids(
+        pred_df.agent_id.to_numpy(), label_df.agent_id.to_numpy(), "agents", label_agents
+    )
 
 
-def main(
-        results_dir: str, 
-        test_labels_path: str,
-        grading_output_dir: str,
-        prediction_windows_months: List[int] = [3, 6, 9, 12]
-    ):
-    # Load and check schema of predictions.
-    csv_path = os.path.join(results_dir, "results.csv")
-    pred_df = etl_predictions_csv(csv_path, prediction_windows_months)
+def load_labels(test_labels_path: str) -> pd.DataFrame:
+    """Load the test set labels. Load them once when grading many submissions.
 
+    :param test_labels_path: Path to labels.csv
+    :type test_labels_path: str
+    :return: Loaded labels, sorted by agent_id so that rows line up with sorted agents
+    :rtype: pd.DataFrame
+    """
     assert os.path.isfile(test_labels_path), f"{test_labels_path=} is not a file."
-    label_df = pd.read_csv(test_labels_path)
+    # Parsed and sorted once, then memory-mapped from the columnar cache as is on later
+    #  grading runs.
+    return schemas.read_table(test_labels_path, "synthcc_labels", cached=True, sort_by="agent_id")
 
-    compare_pred_and_label_agents(pred_df, label_df)
 
-    merged_df = pd.merge(
-        pred_df, 
-        label_df, 
-        on="agent_id", 
-        how="inner", 
-        suffixes=("_pred", "_label")
-    )
-    print(merged_df.info())
-
-    # F1 works well in unbalanced env with few positives because if the user attempts to max 
-    #  recall by predicting all pos, precision will fall dramatically. Likewise, could try 
-    #  to max precision by predicting few positives, but then recall would suffer. And 
-    #  neither metric is skewed by the large quantity of actual negatives because they do 
-    #  not consider true negatives, which are likely abundant in any model trained on this
-    #  data.
-    metrics: Dict[str, Callable] = {"f1": f1_score}
+def grading_df_from_counts(
+        counts: confusion_metrics.ConfusionCounts,
+        prediction_windows_months: List[int] = [3, 6, 9, 12],
+    ) -> pd.DataFrame:
+    """Compute every grading metric from per-window confusion counts.
+
+    :param counts: Confusion counts, one entry per window in `prediction_windows_months`
+    :type counts: confusion_metrics.ConfusionCounts
+    :param prediction_windows_months: List of numbers of months over which charge-off is
+        predicted
+    :type prediction_windows_months: List[int]
+    :return: Grading DF with metric names as index and prediction columns as columns
+    :rtype: pd.DataFrame
+    """
     col_names: Dict[int, str] = {
         months: f"charge_off_within_{months}_months" for months in prediction_windows_months
     }
+    print(pd.DataFrame(counts._asdict(), index=list(col_names.values())))
+
     grading_df = pd.DataFrame(
-        index=pd.Index(data=metrics.keys(), name="metric_name"), 
+        index=pd.Index(data=METRICS.keys(), name="metric_name"), 
         columns=list(col_names.values()) + ["avg"]
     )
-    for metric_name, metric_fn in metrics.items():
+    for metric_name, metric_fn in METRICS.items():
+        metric_vals = metric_fn(counts)
         avg_metric_val = 0  # across diff months windows
-        for months in prediction_windows_months:
+        for months, metric_val in zip(prediction_windows_months, metric_vals):
 
             col_name = col_names[months]
-            preds = merged_df[col_name + "_pred"]
-            labels = merged_df[col_name + "_label"]
-
-            metric_val = metric_fn(labels, preds)
             print(f"{metric_name} for {months} months: {metric_val}")
 
             grading_df.loc[metric_name, col_name] = metric_val
@@ -142,21 +132,291 @@ def main(
             avg_metric_val += metric_val / len(prediction_windows_months)
 
         print(f"Average {metric_name} score across prediction windows: {avg_metric_val}")
-        grading_df.loc[metric_name, "avg"] = metric_val
+        grading_df.loc[metric_name, "avg"] = avg_metric_val
+
+    return grading_df
 
-    # Write grading outputs to a CSV.
+
+def write_grading_csv(grading_df: pd.DataFrame, results_dir: str, grading_output_dir: str):
+    """Write a grading DF to `grading_output_dir` as a CSV named after `results_dir`."""
     if not os.path.isdir(grading_output_dir):
         pathlib.Path(grading_output_dir).mkdir(parents=True)
     grading_csv_name = os.path.basename(results_dir + ".csv")
     grading_df.to_csv(os.path.join(grading_output_dir, grading_csv_name), index=True)
 
 
+def write_timings(
+        stages: instrumentation.StageRecorder,
+        results_dir: str,
+        grading_output_dir: str,
+    ):
+    """Print the grading stages and add them to the submission's JSON timing report."""
+    stages.print_summary()
+    instrumentation.append_stages(
+        instrumentation.timings_path(results_dir, grading_output_dir), stages.stages
+    )
+
+
+def load_aligned_predictions(
+        results_dir: str,
+        label_df: pd.DataFrame,
+        prediction_windows_months: List[int] = [3, 6, 9, 12],
+        label_agents: Optional[np.ndarray] = None,
+        stages: Optional[instrumentation.StageRecorder] = None,
+    ) -> np.ndarray:
+    """Load and check a team's results file and line its predictions up with the labels.
+
+    :param results_dir: Directory containing results.csv or a binary results file
+    :type results_dir: str
+    :param label_df: DF of labels, as returned by `load_labels` (i.e. sorted by agent_id)
+    :type label_df: pd.DataFrame
+    :param prediction_windows_months: List of numbers of months over which charge-off is
+        predicted
+    :type prediction_windows_months: List[int]
+    :param label_agents: Sorted agents in `label_df`, if already built
+    :type label_agents: Optional[np.ndarray]
+    :param stages: Records the loading, "reconcile_ids" and "merge" stages, if given
+    :type stages: Optional[instrumentation.StageRecorder]
+    :return: (n_agents, n_windows) int8 predictions, row-aligned with `label_df`
+    :rtype: np.ndarray
+    """
+    # Load and check schema of predictions.
+    stages = stages if stages is not None else instrumentation.StageRecorder()
+    results_path = binary_results.find_results_file(results_dir)
+    pred_df = etl_predictions_csv(results_path, prediction_windows_months, stages)
+    n_rows = len(pred_df)
+
+    with stages.stage("reconcile_ids", rows=n_rows):
+        if label_agents is None:
+            label_agents = prediction_checks.sorted_unique_ids(
+                label_df.agent_id.to_numpy(), "agents", "labels"
+            )
+        compare_pred_and_label_agents(pred_df, label_df, label_agents)
+
+    col_names = [
+        f"charge_off_within_{months}_months" for months in prediction_windows_months
+    ]
+    # Line predictions up with the labels, which are sorted by agent.
+    with stages.stage("merge", rows=n_rows):
+        return prediction_checks.align_to_sorted_ids(
+            pred_df.agent_id.to_numpy(), pred_df[col_names].to_numpy(), label_agents
+        )
+
+
+def grade_submission(
+        results_dir: str, 
+        label_df: pd.DataFrame,
+        grading_output_dir: str,
+        prediction_windows_months: List[int] = [3, 6, 9, 12],
+        label_agents: Optional[np.ndarray] = None,
+        stages: Optional[instrumentation.StageRecorder] = None,
+        n_bootstrap: int = 0,
+        confidence: float = 0.95,
+        seed: Optional[int] = None,
+        submission_name: Optional[str] = None,
+    ) -> pd.DataFrame:
+    """Grade one team's results dir against already-loaded labels and write its CSV.
+
+    Each grading stage is timed and added to the submission's report, next to its CSV.
+
+    :param results_dir: Directory containing results.csv
+    :type results_dir: str
+    :param label_df: DF of labels, as returned by `load_labels` (i.e. sorted by agent_id)
+    :type label_df: pd.DataFrame
+    :param grading_output_dir: Directory in which the grading output CSV is written
+    :type grading_output_dir: str
+    :param prediction_windows_months: List of numbers of months over which charge-off is
+        predicted
+    :type prediction_windows_months: List[int]
+    :param label_agents: Sorted agents in `label_df`, if already built
+    :type label_agents: Optional[np.ndarray]
+    :param stages: Stages already measured for this submission, e.g. loading the labels
+    :type stages: Optional[instrumentation.StageRecorder]
+    :param n_bootstrap: Number of bootstrap resamples of the agents from which to add
+        confidence intervals of every metric. 0 adds none.
+    :type n_bootstrap: int
+    :param confidence: Confidence level of the intervals
+    :type confidence: float
+    :param seed: Seed of the bootstrap resampling
+    :type seed: Optional[int]
+    :param submission_name: Name of the grading CSV and timing report. Defaults to the
+        name of `results_dir`.
+    :type submission_name: Optional[str]
+    :return: Grading DF with metric names as index and prediction columns as columns
+    :rtype: pd.DataFrame
+    """
+    stages = stages if stages is not None else instrumentation.StageRecorder()
+    preds = load_aligned_predictions(
+        results_dir, label_df, prediction_windows_months, label_agents, stages
+    )
+    n_rows = len(preds)
+    col_names = [
+        f"charge_off_within_{months}_months" for months in prediction_windows_months
+    ]
+    labels = label_df[col_names].to_numpy(dtype=np.int8)
+
+    # Count TP/FP/FN/TN for all windows in one pass.
+    with stages.stage("metrics", rows=n_rows):
+        counts = confusion_metrics.confusion_counts(labels, preds)
+        grading_df = grading_df_from_counts(counts, prediction_windows_months)
+    if n_bootstrap > 0:
+        with stages.stage("bootstrap", rows=n_rows):
+            samples = bootstrap_metrics.bootstrap_metrics(
+                bootstrap_metrics.confusion_categories(labels, preds),
+                METRICS,
+                n_bootstrap,
+                seed,
+            )
+            ci_df = bootstrap_metrics.confidence_interval_df(
+                samples, col_names, confidence, avg_col_name="avg"
+            )
+        print(ci_df.to_string())
+        grading_df = pd.concat([grading_df, ci_df])
+    submission_name = submission_name or results_dir
+    write_grading_csv(grading_df, submission_name, grading_output_dir)
+    write_timings(stages, submission_name, grading_output_dir)
+    return grading_df
+
+
+def main(
+        results_dir: str, 
+        test_labels_path: str,
+        grading_output_dir: str,
+        prediction_windows_months: List[int] = [3, 6, 9, 12],
+        n_bootstrap: int = 0,
+        confidence: float = 0.95,
+        seed: Optional[int] = None,
+    ):
+    stages = instrumentation.StageRecorder()
+    with stages.stage("load_labels") as counts:
+        label_df = load_labels(test_labels_path)
+        counts["rows"] = len(label_df)
+    grade_submission(
+        results_dir, 
+        label_df, 
+        grading_output_dir, 
+        prediction_windows_months, 
+        stages=stages,
+        n_bootstrap=n_bootstrap,
+        confidence=confidence,
+        seed=seed,
+    )
+
+
+def main_paired(
+        baseline_results_dir: str,
+        candidate_results_dir: str,
+        test_labels_path: str,
+        grading_output_dir: str,
+        prediction_windows_months: List[int] = [3, 6, 9, 12],
+        n_bootstrap: int = 10_000,
+        confidence: float = 0.95,
+        seed: Optional[int] = None,
+    ):
+    # Both submissions are scored on the same bootstrap resamples of the agents, so the
+    #  interval of their difference tells a real change from test set noise.
+    label_df = load_labels(test_labels_path)
+    label_agents = prediction_checks.sorted_unique_ids(
+        label_df.agent_id.to_numpy(), "agents", "labels"
+    )
+    baseline_preds, candidate_preds = (
+        load_aligned_predictions(
+            results_dir, label_df, prediction_windows_months, label_agents
+        )
+        for results_dir in (baseline_results_dir, candidate_results_dir)
+    )
+    col_names = [
+        f"charge_off_within_{months}_months" for months in prediction_windows_months
+    ]
+    comparison_df = bootstrap_metrics.paired_comparison_df(
+        label_df[col_names].to_numpy(dtype=np.int8),
+        baseline_preds,
+        candidate_preds,
+        METRICS,
+        col_names,
+        n_bootstrap,
+        confidence,
+        seed,
+        avg_col_name="avg",
+    )
+    print(comparison_df.to_string())
+    comparison_name = (
+        f"paired-{os.path.basename(os.path.normpath(baseline_results_dir))}"
+        f"-vs-{os.path.basename(os.path.normpath(candidate_results_dir))}"
+    )
+    write_grading_csv(comparison_df, comparison_name, grading_output_dir)
+
+
+def main_streaming(
+        results_dir: str, 
+        test_labels_path: str,
+        grading_output_dir: str,
+        prediction_windows_months: List[int] = [3, 6, 9, 12],
+        chunk_size: int = 1_000_000,
+    ):
+    # Same checks and outputs as `main`, but neither CSV is ever fully loaded in memory.
+    col_names = [
+        f"charge_off_within_{months}_months" for months in prediction_windows_months
+    ]
+    # Loading, validation and ID reconciliation interleave chunk by chunk, so they are
+    #  timed as one stage.
+    stages = instrumentation.StageRecorder()
+    with stages.stage("stream_confusion_counts") as stage_counts:
+        counts = streaming_grading.stream_confusion_counts(
+            binary_results.find_results_file(results_dir), 
+            test_labels_path, 
+            "agent_id", 
+            col_names, 
+            "agents", 
+            chunk_size,
+        )
+        stage_counts["rows"] = int(sum(counts)[0])
+    with stages.stage("metrics", rows=stage_counts["rows"]):
+        grading_df = grading_df_from_counts(counts, prediction_windows_months)
+    write_grading_csv(grading_df, results_dir, grading_output_dir)
+    write_timings(stages, results_dir, grading_output_dir)
+
+
+def main_batch(
+        results_dirs: List[str], 
+        test_labels_path: str,
+        grading_output_dir: str,
+        prediction_windows_months: List[int] = [3, 6, 9, 12],
+        num_workers: int = 1,
+        n_bootstrap: int = 0,
+        confidence: float = 0.95,
+        seed: Optional[int] = None,
+    ):
+    # Load and index the labels once for the whole wave of submissions.
+    label_df = load_labels(test_labels_path)
+    label_agents = prediction_checks.sorted_unique_ids(
+        label_df.agent_id.to_numpy(), "agents", "labels"
+    )
+    grade_fn = functools.partial(
+        grade_submission,
+        label_df=label_df,
+        grading_output_dir=grading_output_dir,
+        prediction_windows_months=prediction_windows_months,
+        label_agents=label_agents,
+        n_bootstrap=n_bootstrap,
+        confidence=confidence,
+        seed=seed,
+    )
+    graded = batch_grading.grade_results_dirs(
+        grade_fn, batch_grading.expand_results_dirs(results_dirs), num_workers
+    )
+    leaderboard_df = batch_grading.write_leaderboard(
+        graded, grading_output_dir, sort_by="f1_avg"
+    )
+    print(leaderboard_df.to_string(index=False))
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
-    parser.add_argument(
+    results_group = parser.add_mutually_exclusive_group(required=True)
+    results_group.add_argument(
         "--results_dir", 
         type=str,
-        required=True,
         help=(
             "Directory containing a file results.csv with the following column names: "
             "[agent_id, charge_off_within_3_months, charge_off_within_6_months, "
@@ -165,7 +425,33 @@ if __name__ == "__main__":
             "of whether charge-off happens over 3, 6, 9, and 12 months, respectively. "
             "Each row has all four predictions for *one* test set agent. Note that this is the "
             "path to the directory containing the CSV, not the CSV itself, in case we "
-            "decide we need additional outputs in the future."
+            "decide we need additional outputs in the future. Instead of results.csv, "
+            "the directory may hold a typed binary results.npz (or results.parquet, if "
+            "pyarrow is installed) with the same columns; see binary_results.py."
+        )
+    )
+    results_group.add_argument(
+        "--results_dirs",
+        type=str,
+        nargs="+",
+        help=(
+            "Batch mode: results directories and/or quoted glob patterns (e.g. "
+            "'bth-results-*'), each laid out like --results_dir. The labels are loaded "
+            "once and shared across all of them. Writes the usual per-submission CSVs "
+            "plus leaderboard.csv to --grading_output_dir. Directories that share a name "
+            "are told apart by their paths, e.g. teamA__bth-results.csv."
+        )
+    )
+    results_group.add_argument(
+        "--paired_results_dirs",
+        type=str,
+        nargs=2,
+        metavar=("BASELINE_RESULTS_DIR", "CANDIDATE_RESULTS_DIR"),
+        help=(
+            "Paired comparison mode: grade two results directories, each laid out like "
+            "--results_dir, on the same --bootstrap resamples of the agents (10,000 by "
+            "default) and write the candidate-minus-baseline difference of every metric, "
+            "its confidence interval and its p-value to --grading_output_dir."
         )
     )
     parser.add_argument(
@@ -184,5 +470,87 @@ if __name__ == "__main__":
         required=True,
         help="Path to directory in which grading output CSV is written."
     )
+    parser.add_argument(
+        "--streaming",
+        action="store_true",
+        help=(
+            "Grade --results_dir reading results.csv and labels in chunks, so memory "
+            "stays bounded for test sets too large to load at once. Outputs match the "
+            "default mode."
+        )
+    )
+    parser.add_argument(
+        "--chunk_size",
+        type=int,
+        default=1_000_000,
+        help="Number of CSV rows read at a time in --streaming mode."
+    )
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        default=1,
+        help="Number of processes used to grade submissions in --results_dirs mode."
+    )
+    parser.add_argument(
+        "--bootstrap",
+        type=int,
+        default=None,
+        metavar="N",
+        help=(
+            "Add confidence intervals of every metric, from N bootstrap resamples of the "
+            "agents, to the grading output as rows \"{metric}_ci_low\" and "
+            "\"{metric}_ci_high\". Not supported with --streaming."
+        )
+    )
+    parser.add_argument(
+        "--confidence",
+        type=float,
+        default=0.95,
+        help="Confidence level of the --bootstrap intervals."
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=None,
+        help="Seed of the --bootstrap resampling, for reproducible intervals."
+    )
     args = parser.parse_args()
-    main(args.results_dir, args.test_labels_path, args.grading_output_dir)
\ No newline at end of file
+    if args.streaming and args.bootstrap:
+        parser.error("--bootstrap is not supported with --streaming.")
+    if args.streaming and args.results_dir is None:
+        parser.error("--streaming is only supported with --results_dir.")
+    if args.paired_results_dirs is not None:
+        main_paired(
+            *args.paired_results_dirs, 
+            args.test_labels_path, 
+            args.grading_output_dir, 
+            n_bootstrap=args.bootstrap if args.bootstrap is not None else 10_000,
+            confidence=args.confidence,
+            seed=args.seed,
+        )
+    elif args.results_dirs is not None:
+        main_batch(
+            args.results_dirs, 
+            args.test_labels_path, 
+            args.grading_output_dir, 
+            num_workers=args.num_workers,
+            n_bootstrap=args.bootstrap or 0,
+            confidence=args.confidence,
+            seed=args.seed,
+        )
+    elif args.streaming:
+        main_streaming(
+            args.results_dir, 
+            args.test_labels_path, 
+            args.grading_output_dir, 
+            chunk_size=args.chunk_size,
+        )
+    else:
+        main(
+            args.results_dir, 
+            args.test_labels_path, 
+            args.grading_output_dir, 
+            n_bootstrap=args.bootstrap or 0,
+            confidence=args.confidence,
+            seed=args.seed,
+        )
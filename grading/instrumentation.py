@@ -0,0 +1,267 @@
+"""Per-stage wall time, CPU time, peak RSS and throughput for the eval pipeline.
+
+Each stage of grading a submission is recorded as one entry of a JSON report written next
+to its grading CSV, as `<results dir name>.timings.json`. The grading scripts record their
+own stages with `StageRecorder`. Stages that run outside them are recorded by running this
+file as a script:
+- from eval.sh, activating conda envs and running the team's `__main__.py`;
+- from eval_submissions.py, the same stages for every submission.
+All of these append to the same report.
+
+Peak RSS is the high-water mark of the measured process when the stage ends. For stages
+inside a grading script it is therefore never lower than an earlier stage's, and the stage
+that raised it is the one to look at.
+
+This module only uses the standard library, so it runs in any submission's env.
+"""
+import argparse
+import contextlib
+import json
+import os
+import resource
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Iterator, List, Optional, Tuple
+
+
+TIMINGS_SUFFIX = ".timings.json"
+
+
+def timings_path(results_dir: str, grading_output_dir: str) -> str:
+    """Return the path of a submission's report, next to its grading CSV."""
+    return os.path.join(
+        grading_output_dir, os.path.basename(os.path.normpath(results_dir)) + TIMINGS_SUFFIX
+    )
+
+
+def _maxrss_mb(rusage: resource.struct_rusage) -> float:
+    # ru_maxrss is in bytes on macOS and in KiB elsewhere.
+    return rusage.ru_maxrss / (2**20 if sys.platform == "darwin" else 2**10)
+
+
+def stage_record(
+        stage_name: str,
+        wall_s: float,
+        cpu_s: Optional[float] = None,
+        peak_rss_mb: Optional[float] = None,
+        rows: Optional[int] = None,
+    ) -> dict:
+    """Build one report entry. Rows/sec is derived from `rows` when it is known."""
+    return {
+        "stage": stage_name,
+        "wall_s": wall_s,
+        "cpu_s": cpu_s,
+        "peak_rss_mb": peak_rss_mb,
+        "rows": rows,
+        "rows_per_s": rows / wall_s if rows is not None and wall_s > 0 else None,
+    }
+
+
+class StageRecorder:
+    """Collects the stages measured in this process, in the order they finish."""
+
+    def __init__(self):
+        self.stages: List[dict] = []
+
+    @contextlib.contextmanager
+    def stage(self, stage_name: str, rows: Optional[int] = None) -> Iterator[dict]:
+        """Measure the enclosed block as one stage.
+
+        Yields a dict in which the block may set "rows" once it knows how many it handled.
+        """
+        counts = {"rows": rows}
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield counts
+        finally:
+            self.stages.append(stage_record(
+                stage_name,
+                time.perf_counter() - wall_start,
+                time.process_time() - cpu_start,
+                _maxrss_mb(resource.getrusage(resource.RUSAGE_SELF)),
+                counts["rows"],
+            ))
+
+    def print_summary(self):
+        for record in self.stages:
+            cpu_s = "?" if record["cpu_s"] is None else f"{record['cpu_s']:.3f}s"
+            rows_per_s = record["rows_per_s"]
+            rows_per_s = "" if rows_per_s is None else f", {rows_per_s:,.0f} rows/s"
+            print(
+                f"Stage {record['stage']}: {record['wall_s']:.3f}s wall, {cpu_s} CPU, "
+                f"{record['peak_rss_mb']:.0f} MiB peak RSS{rows_per_s}"
+            )
+
+
+def append_stages(report_path: str, stages: List[dict]):
+    """Add stages to a report, creating it if needed.
+
+    A stage already in the report is replaced, so re-running part of the pipeline (e.g.
+    re-grading) keeps one entry per stage.
+    """
+    os.makedirs(os.path.dirname(report_path) or ".", exist_ok=True)
+    try:
+        with open(report_path) as f:
+            report = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        report = {"stages": []}
+    new_stage_names = {record["stage"] for record in stages}
+    report["stages"] = [
+        record for record in report["stages"] if record["stage"] not in new_stage_names
+    ] + stages
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(report_path) or ".", suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        json.dump(report, f, indent=2)
+    os.replace(tmp_path, report_path)
+
+
+def _count_csv_rows(csv_path: str) -> Optional[int]:
+    if not os.path.isfile(csv_path):
+        return None
+    n_lines = 0
+    last_byte = b"\n"
+    with open(csv_path, "rb") as f:
+        for block in iter(lambda: f.read(2**20), b""):
+            n_lines += block.count(b"\n")
+            last_byte = block[-1:]
+    # A last line without a trailing newline is still a row. Less the header.
+    n_lines += last_byte != b"\n"
+    return max(n_lines - 1, 0)
+
+
+def _exit_code(wait_status: int) -> int:
+    # As subprocess reports it: negative for a process killed by a signal.
+    if os.WIFSIGNALED(wait_status):
+        return -os.WTERMSIG(wait_status)
+    return os.WEXITSTATUS(wait_status)
+
+
+def run_command(
+        command: List[str],
+        stage_name: str,
+        timeout_s: Optional[float] = None,
+        rows_csv: Optional[str] = None,
+        **popen_kwargs,
+    ) -> Tuple[int, dict]:
+    """Run a command as a stage, measuring its CPU time and peak RSS with `os.wait4`.
+
+    CPU time and peak RSS cover the command and every descendant it waited for, e.g. the
+    python process under `conda run`.
+
+    :param command: Command and arguments
+    :type command: List[str]
+    :param stage_name: Name of the stage in the report
+    :type stage_name: str
+    :param timeout_s: Kill the command after this long; its return code is then 124
+    :type timeout_s: Optional[float]
+    :param rows_csv: CSV whose data rows count as the rows the stage handled, e.g. the
+        results.csv that `__main__.py` writes
+    :type rows_csv: Optional[str]
+    :param popen_kwargs: Passed on to `subprocess.Popen`, e.g. cwd or stdout. With
+        start_new_session=True, a timeout kills the command's whole process group.
+    :return: The command's return code and the stage's report entry
+    :rtype: Tuple[int, dict]
+    """
+    wall_start = time.perf_counter()
+    process = subprocess.Popen(command, **popen_kwargs)
+
+    def kill():
+        if popen_kwargs.get("start_new_session"):
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            process.kill()
+
+    deadline = None if timeout_s is None else wall_start + timeout_s
+    try:
+        while True:
+            pid, status, rusage = os.wait4(process.pid, os.WNOHANG)
+            if pid != 0:
+                returncode = _exit_code(status)
+                break
+            if deadline is not None and time.perf_counter() > deadline:
+                kill()
+                pid, status, rusage = os.wait4(process.pid, 0)
+                returncode = 124
+                break
+            time.sleep(0.05)
+    except BaseException:
+        # E.g. Ctrl-C: a command in its own session does not get the terminal's SIGINT.
+        with contextlib.suppress(ProcessLookupError):
+            kill()
+        os.wait4(process.pid, 0)
+        process.returncode = -signal.SIGKILL
+        raise
+    # The child is reaped by wait4 above; stop Popen from trying again.
+    process.returncode = returncode
+    record = stage_record(
+        stage_name,
+        time.perf_counter() - wall_start,
+        rusage.ru_utime + rusage.ru_stime,
+        _maxrss_mb(rusage),
+        _count_csv_rows(rows_csv) if rows_csv is not None and returncode == 0 else None,
+    )
+    return returncode, record
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="mode", required=True)
+    run_parser = subparsers.add_parser(
+        "run",
+        help="Run a command as a stage: instrumentation.py run --report R --stage S -- cmd"
+    )
+    record_parser = subparsers.add_parser(
+        "record",
+        help="Record a stage measured elsewhere, e.g. a shell function like conda activate."
+    )
+    for subparser in (run_parser, record_parser):
+        subparser.add_argument(
+            "--report",
+            type=str,
+            required=True,
+            help="Path to the JSON report to append the stage to."
+        )
+        subparser.add_argument("--stage", type=str, required=True, help="Stage name.")
+    run_parser.add_argument(
+        "--timeout_s",
+        type=float,
+        default=None,
+        help="Kill the command after this many seconds and exit with code 124."
+    )
+    run_parser.add_argument(
+        "--rows_csv",
+        type=str,
+        default=None,
+        help="CSV whose data rows count as the rows handled by the stage."
+    )
+    run_parser.add_argument("command", nargs=argparse.REMAINDER)
+    record_parser.add_argument(
+        "--started_at",
+        type=float,
+        required=True,
+        help="Unix time at which the stage started. It ends now."
+    )
+    args = parser.parse_args()
+
+    if args.mode == "run":
+        command = args.command[1:] if args.command[:1] == ["--"] else args.command
+        assert command, "No command given to run."
+        # The command runs in its own session so that a timeout kills everything it
+        #  started, e.g. the workers of a submission's multiprocessing pool, not just the
+        #  direct child. SIGTERM exits through run_command's cleanup, which kills them too.
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
+        returncode, record = run_command(
+            command, args.stage, args.timeout_s, args.rows_csv, start_new_session=True
+        )
+        append_stages(args.report, [record])
+        if returncode == 124 and args.timeout_s is not None:
+            print(f"Stage {args.stage} exceeded its {args.timeout_s:g}s budget.")
+        sys.exit(returncode)
+    else:
+        append_stages(
+            args.report, [stage_record(args.stage, time.time() - args.started_at)]
+        )
@@ -0,0 +1,389 @@
+"""Schema, value and ID checks shared by the grading scripts.
+
+The checks run over all prediction columns at once as a single NumPy block instead of one
+pandas pass per check and per column, and report the first offending row and column. IDs
+are reconciled with sorted NumPy arrays rather than Python sets, and mismatches are
+reported as counts plus a capped sample of IDs.
+"""
+import os
+from typing import List, NamedTuple, Optional
+
+import numpy as np
+import pandas as pd
+
+import binary_results
+from instrumentation import StageRecorder
+
+
+# Mismatch errors list at most this many example IDs so they stay readable at any scale.
+MAX_REPORTED_IDS = 10
+
+
+def _as_numeric(col: pd.Series, csv_name: str, first_row: int) -> pd.Series:
+    """Return `col` as a numeric column, or raise an error citing its first non-number.
+
+    Columns pandas could not type as numeric can still hold only numbers, e.g. when parsed
+    from mixed-type chunks, and are converted rather than rejected.
+    """
+    if pd.api.types.is_numeric_dtype(col):
+        return col
+    coerced = pd.to_numeric(col, errors="coerce")
+    non_numeric = np.flatnonzero((coerced.isna() & col.notna()).to_numpy())
+    if len(non_numeric) > 0:
+        row = int(non_numeric[0])
+        raise AssertionError(
+            f"Column `{col.name}` in {csv_name} does not consist of numbers: row "
+            f"{first_row + row} (line {first_row + row + 2} of {csv_name}) has value "
+            f"{col.iloc[row]!r}."
+        )
+    return coerced
+
+
+def check_has_rows(n_rows: int, csv_name: str = "results.csv"):
+    """Assert that a results file has at least one row of predictions."""
+    assert n_rows > 0, (
+        f"{csv_name} has no rows. There should be one row per test set example in need "
+        f"of a prediction."
+    )
+
+
+def validate_binary_columns(
+        pred_df: pd.DataFrame,
+        pred_col_names: List[str],
+        csv_name: str = "results.csv",
+        first_row: int = 0,
+    ) -> np.ndarray:
+    """Check that every prediction column holds only 0s and 1s and return them as int8.
+
+    Integrality and the {0, 1} domain are checked together in one vectorized pass over all
+    columns: a value is valid iff it equals 0 or 1, which also rules out NaNs, fractions,
+    and out-of-range integers.
+
+    :param pred_df: DF of predictions, as parsed from the CSV
+    :type pred_df: pd.DataFrame
+    :param pred_col_names: Names of the binary prediction columns
+    :type pred_col_names: List[str]
+    :param csv_name: Name of the file the predictions were read from, for error messages
+    :type csv_name: str
+    :param first_row: Row of the CSV that `pred_df` starts at, when it is one chunk of a
+        larger file. Only used to report row numbers.
+    :type first_row: int
+    :return: (n_rows, n_cols) int8 block of predictions, columns in `pred_col_names` order
+    :rtype: np.ndarray
+    """
+    # Dtype checks only touch metadata, so numeric columns are used as they are.
+    cols = [
+        _as_numeric(pred_df[col_name], csv_name, first_row) for col_name in pred_col_names
+    ]
+    common_dtype = np.result_type(*(col.dtype for col in cols))
+    values = np.empty((len(pred_df), len(cols)), dtype=common_dtype)
+    for col_idx, col in enumerate(cols):
+        values[:, col_idx] = col.to_numpy()
+    if values.dtype.kind == "b":
+        return values.astype(np.int8)
+    if values.dtype.kind in "iu":
+        # Viewing as unsigned maps negatives to huge values, so one comparison suffices.
+        invalid = values.view(values.dtype.str.replace("i", "u")) > 1
+    else:
+        invalid = (values != 0) & (values != 1)
+
+    if invalid.any():
+        row, col_idx = np.unravel_index(np.argmax(invalid), invalid.shape)
+        col_name = pred_col_names[col_idx]
+        value = values[row, col_idx]
+        if pd.isna(value):
+            problem = "is missing a value"
+        elif value % 1 != 0:
+            problem = f"does not consist of integers: value {value!r}"
+        else:
+            problem = f"does not consist of 0s and 1s: value {value!r}"
+        # Only a CSV has lines: its header, then one line per row.
+        line = ""
+        if csv_name.endswith(".csv"):
+            line = f" (line {first_row + row + 2} of {csv_name})"
+        raise AssertionError(
+            f"Column `{col_name}` in {csv_name} {problem} at row {first_row + row}{line}. "
+            f"{int(invalid.sum())} invalid prediction(s) among rows {first_row} to "
+            f"{first_row + len(values) - 1}."
+        )
+
+    return values.astype(np.int8)
+
+
+def check_results_columns(
+        columns: pd.Index,
+        id_col_name: str,
+        pred_col_names: List[str],
+        csv_name: str = "results.csv",
+    ):
+    """Assert that a results file has the ID column and every prediction column.
+
+    :param columns: Column names of the results file
+    :type columns: pd.Index
+    :param id_col_name: Name of the ID column, e.g. "agent_id"
+    :type id_col_name: str
+    :param pred_col_names: Names of the binary prediction columns
+    :type pred_col_names: List[str]
+    :param csv_name: Name of the results file, for error messages
+    :type csv_name: str
+    """
+    assert id_col_name in columns, (
+        f"`{id_col_name}` must be a column name in {csv_name}."
+    )
+    for col_name in pred_col_names:
+        assert col_name in columns, (
+            f"`{col_name}` must be a column name in {csv_name}"
+        )
+
+
+def check_id_column(
+        id_col: pd.Series,
+        csv_name: str = "results.csv",
+        first_row: int = 0,
+    ) -> pd.Series:
+    """Assert that an ID column is numeric so it can be reconciled with the labels' IDs.
+
+    :param id_col: ID column of the results file, or of one chunk of it
+    :type id_col: pd.Series
+    :param csv_name: Name of the results file, for error messages
+    :type csv_name: str
+    :param first_row: Row of the results file that `id_col` starts at
+    :type first_row: int
+    :return: The ID column, converted to a numeric dtype if pandas parsed it as objects
+    :rtype: pd.Series
+    """
+    return _as_numeric(id_col, csv_name, first_row)
+
+
+def etl_binary_predictions_csv(
+        csv_path: str,
+        id_col_name: str,
+        pred_col_names: List[str],
+        stages: Optional[StageRecorder] = None,
+    ) -> pd.DataFrame:
+    """Load a results CSV, check its schema and values, and cast predictions to int8.
+
+    :param csv_path: Path to results.csv
+    :type csv_path: str
+    :param id_col_name: Name of the ID column, e.g. "agent_id"
+    :type id_col_name: str
+    :param pred_col_names: Names of the binary prediction columns
+    :type pred_col_names: List[str]
+    :param stages: Records the "load_csv" and "validate" stages, if given
+    :type stages: Optional[StageRecorder]
+    :return: Loaded and validated predictions with prediction columns cast to int8
+    :rtype: pd.DataFrame
+    """
+    assert os.path.isfile(csv_path), f"{csv_path=} is not a file."
+    stages = stages if stages is not None else StageRecorder()
+    csv_name = os.path.basename(csv_path)
+    with stages.stage("load_csv") as counts:
+        pred_df = pd.read_csv(csv_path)
+        counts["rows"] = len(pred_df)
+
+    with stages.stage("validate", rows=len(pred_df)):
+        check_results_columns(pred_df.columns, id_col_name, pred_col_names, csv_name)
+        check_has_rows(len(pred_df), csv_name)
+        pred_df[id_col_name] = check_id_column(pred_df[id_col_name], csv_name)
+        pred_block = validate_binary_columns(pred_df, pred_col_names, csv_name)
+        pred_df[pred_col_names] = pred_block
+    return pred_df
+
+
+def etl_binary_predictions(
+        results_path: str,
+        id_col_name: str,
+        pred_col_names: List[str],
+        stages: Optional[StageRecorder] = None,
+    ) -> pd.DataFrame:
+    """Load a results file of any accepted format, check it, and cast predictions to int8.
+
+    results.csv goes through `etl_binary_predictions_csv`. A binary results file is
+    memory-mapped and its schema checked by `binary_results.load_binary_results`, as the
+    "load_binary" stage, so only its prediction values are left to validate.
+
+    :param results_path: Path to results.csv, or to a binary results file
+    :type results_path: str
+    :param id_col_name: Name of the ID column, e.g. "agent_id"
+    :type id_col_name: str
+    :param pred_col_names: Names of the binary prediction columns
+    :type pred_col_names: List[str]
+    :param stages: Records the loading and "validate" stages, if given
+    :type stages: Optional[StageRecorder]
+    :return: Loaded and validated predictions with prediction columns cast to int8
+    :rtype: pd.DataFrame
+    """
+    if not binary_results.is_binary_results(results_path):
+        return etl_binary_predictions_csv(results_path, id_col_name, pred_col_names, stages)
+    stages = stages if stages is not None else StageRecorder()
+    with stages.stage("load_binary") as counts:
+        pred_df = binary_results.load_binary_results(
+            results_path, id_col_name, pred_col_names
+        )
+        counts["rows"] = len(pred_df)
+
+    with stages.stage("validate", rows=len(pred_df)):
+        results_name = os.path.basename(results_path)
+        check_has_rows(len(pred_df), results_name)
+        pred_block = validate_binary_columns(pred_df, pred_col_names, results_name)
+        pred_df[pred_col_names] = pred_block
+    return pred_df
+
+
+class CappedIds(NamedTuple):
+    """How many IDs have some problem, plus the smallest few of them for error messages.
+
+    Keeping only a capped sample lets problems found in separate chunks or partitions of
+    the data be merged cheaply with `merge_capped_ids`.
+    """
+    count: int
+    sample: np.ndarray
+
+
+def capped_ids(sorted_ids: np.ndarray) -> CappedIds:
+    """Summarize sorted problem IDs as their count plus the smallest MAX_REPORTED_IDS."""
+    return CappedIds(len(sorted_ids), sorted_ids[:MAX_REPORTED_IDS])
+
+
+def merge_capped_ids(a: CappedIds, b: CappedIds) -> CappedIds:
+    """Combine summaries of two disjoint sets of problem IDs."""
+    return CappedIds(
+        a.count + b.count, np.sort(np.concatenate([a.sample, b.sample]))[:MAX_REPORTED_IDS]
+    )
+
+
+def _id_sample(ids: CappedIds) -> str:
+    return f"{ids.sample.tolist()}{' ...' if ids.count > len(ids.sample) else ''}"
+
+
+def find_duplicate_ids(sorted_ids: np.ndarray) -> np.ndarray:
+    """Return the sorted unique IDs that appear more than once in `sorted_ids`."""
+    is_duplicate = sorted_ids[1:] == sorted_ids[:-1]
+    return np.unique(sorted_ids[1:][is_duplicate])
+
+
+def raise_for_duplicate_ids(duplicate_ids: CappedIds, entity: str, source: str):
+    """Raise an error if any ID appears more than once.
+
+    :param duplicate_ids: IDs that appear more than once
+    :type duplicate_ids: CappedIds
+    :param entity: Plural name of what the IDs identify, e.g. "agents", for error messages
+    :type entity: str
+    :param source: Where the IDs come from, e.g. "labels", for error messages
+    :type source: str
+    """
+    if duplicate_ids.count > 0:
+        raise ValueError(
+            f"{source.capitalize()} have {duplicate_ids.count} {entity} with more than one "
+            f"row. There should be one row per test set example in need of a prediction. "
+            f"Duplicated {entity}: {_id_sample(duplicate_ids)}"
+        )
+
+
+def sorted_unique_ids(ids: np.ndarray, entity: str, source: str) -> np.ndarray:
+    """Sort IDs, raising an error if any ID appears more than once.
+
+    :param ids: IDs, one per row
+    :type ids: np.ndarray
+    :param entity: Plural name of what the IDs identify, e.g. "agents", for error messages
+    :type entity: str
+    :param source: Where the IDs come from, e.g. "labels", for error messages
+    :type source: str
+    :return: The IDs, sorted
+    :rtype: np.ndarray
+    """
+    sorted_ids = np.sort(np.asarray(ids))
+    raise_for_duplicate_ids(capped_ids(find_duplicate_ids(sorted_ids)), entity, source)
+    return sorted_ids
+
+
+def ids_not_in(sorted_ids: np.ndarray, sorted_ref_ids: np.ndarray) -> np.ndarray:
+    """Return the IDs in sorted array `sorted_ids` missing from sorted `sorted_ref_ids`."""
+    if len(sorted_ref_ids) == 0:
+        return sorted_ids
+    pos = np.searchsorted(sorted_ref_ids, sorted_ids)
+    pos[pos == len(sorted_ref_ids)] = 0
+    return sorted_ids[sorted_ref_ids[pos] != sorted_ids]
+
+
+def raise_for_id_mismatches(pred_only: CappedIds, label_only: CappedIds, entity: str):
+    """Raise an error if any ID is only in the predictions or only in the labels.
+
+    :param pred_only: IDs in the predictions but not in the labels
+    :type pred_only: CappedIds
+    :param label_only: IDs in the labels but not in the predictions
+    :type label_only: CappedIds
+    :param entity: Plural name of what the IDs identify, e.g. "agents", for error messages
+    :type entity: str
+    """
+    if pred_only.count == 0 and label_only.count == 0:
+        return
+    elif label_only.count == 0:
+        raise ValueError(
+            f"Predictions have more {entity} than labels. {pred_only.count} {entity} in "
+            f"pred but not in labels: {_id_sample(pred_only)}"
+        )
+    elif pred_only.count == 0:
+        raise ValueError(
+            f"Labels have more {entity} than predictions. {label_only.count} {entity} in "
+            f"labels but not in pred: {_id_sample(label_only)}"
+        )
+    raise ValueError(
+        f"Labels and preds have different sets of {entity}. {label_only.count} {entity} "
+        f"in labels but not in pred: {_id_sample(label_only)}.\n{pred_only.count} "
+        f"{entity} in pred but not in labels: {_id_sample(pred_only)}"
+    )
+
+
+def reconcile_ids(
+        pred_ids: np.ndarray,
+        label_ids: np.ndarray,
+        entity: str,
+        sorted_label_ids: Optional[np.ndarray] = None,
+    ):
+    """Raise an error unless predictions and labels have exactly the same unique IDs.
+
+    :param pred_ids: IDs from the predictions, one per row
+    :type pred_ids: np.ndarray
+    :param label_ids: IDs from the labels, one per row
+    :type label_ids: np.ndarray
+    :param entity: Plural name of what the IDs identify, e.g. "agents", for error messages
+    :type entity: str
+    :param sorted_label_ids: `sorted_unique_ids` of `label_ids`, if already built. Pass
+        this when reconciling many predictions against the same labels.
+    :type sorted_label_ids: Optional[np.ndarray]
+    """
+    if sorted_label_ids is None:
+        sorted_label_ids = sorted_unique_ids(label_ids, entity, "labels")
+    sorted_pred_ids = sorted_unique_ids(pred_ids, entity, "predictions")
+    if np.array_equal(sorted_pred_ids, sorted_label_ids):
+        return
+    raise_for_id_mismatches(
+        capped_ids(ids_not_in(sorted_pred_ids, sorted_label_ids)),
+        capped_ids(ids_not_in(sorted_label_ids, sorted_pred_ids)),
+        entity,
+    )
+
+
+def align_to_sorted_ids(
+        ids: np.ndarray,
+        values: np.ndarray,
+        sorted_ref_ids: np.ndarray,
+    ) -> np.ndarray:
+    """Reorder rows of `values` so that row i belongs to `sorted_ref_ids[i]`.
+
+    Call only after `reconcile_ids` has confirmed that `ids` and `sorted_ref_ids` hold the
+    same unique IDs.
+
+    :param ids: ID of each row of `values`
+    :type ids: np.ndarray
+    :param values: Per-row values, e.g. an (n_rows, n_cols) block of predictions
+    :type values: np.ndarray
+    :param sorted_ref_ids: Sorted unique IDs to align to, e.g. the labels' IDs
+    :type sorted_ref_ids: np.ndarray
+    :return: `values` with rows in `sorted_ref_ids` order
+    :rtype: np.ndarray
+    """
+    aligned = np.empty_like(values)
+    aligned[np.searchsorted(sorted_ref_ids, ids)] = values
+    return aligned
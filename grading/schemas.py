@@ -0,0 +1,151 @@
+"""Declared column dtypes of the ha and synthcc inputs and labels.
+
+Loading with these dtypes instead of pandas' defaults keeps large test sets small in memory:
+IDs and flags are downcast to int32/int8, ratios to float32 (money stays float64, whose
+sums must be exact to the cent), timestamps are parsed to datetime64, and categorical
+columns are loaded as `category`. High-cardinality string columns, which categories do not
+compress well, are backed by pyarrow when it is installed.
+
+Columns a table does not declare are loaded as pandas infers them, except that strings
+become `category`, as in the columnar cache.
+"""
+import os
+from typing import Dict, NamedTuple, Optional, Sequence, Tuple
+
+import pandas as pd
+
+import columnar_cache
+
+
+try:
+    import pyarrow  # noqa: F401
+    STRING_DTYPE = "string[pyarrow]"
+except ImportError:
+    STRING_DTYPE = "category"
+
+
+class TableSchema(NamedTuple):
+    dtypes: Dict[str, str]
+    parse_dates: Tuple[str, ...] = ()
+
+
+SYNTHCC_WINDOWS_MONTHS = (3, 6, 9, 12)
+HA_FLOAT_COLS = (
+    "HeightInMeters",
+    "WeightInKilograms",
+    "BMI",
+    "PhysicalHealthDays",
+    "MentalHealthDays",
+    "SleepHours",
+)
+
+SCHEMAS = {
+    "account_state_log": TableSchema(
+        {
+            "agent_id": "int32",
+            "credit_balance": "float64",
+            "credit_utilization": "float32",
+            "interest_rate": "float32",
+            "min_payment_factor": "float32",
+            "current_missed_payments": "int8",
+        },
+        ("timestamp",),
+    ),
+    "payments_log": TableSchema(
+        {"agent_id": "int32", "amount": "float64"}, ("timestamp",)
+    ),
+    "transactions_log": TableSchema(
+        {
+            "agent_id": "int32",
+            "status": "category",
+            "amount": "float64",
+            "merchant_category": "category",
+            "merchant_id": STRING_DTYPE,
+            "online": "int8",
+        },
+        ("timestamp",),
+    ),
+    "synthcc_labels": TableSchema(
+        {
+            "agent_id": "int32",
+            **{
+                f"charge_off_within_{months}_months": "int8"
+                for months in SYNTHCC_WINDOWS_MONTHS
+            },
+        },
+    ),
+    # Every other ha input column is categorical, e.g. State, Sex or SmokerStatus.
+    "ha_inputs": TableSchema(
+        {"PatientID": "int32", **{col_name: "float32" for col_name in HA_FLOAT_COLS}}
+    ),
+    "ha_labels": TableSchema({"PatientID": "int32", "HadHeartAttack": "int8"}),
+}
+
+
+def read_options(
+        table_name: str,
+        columns: Sequence[str],
+        strings_as: Optional[str] = None,
+    ) -> Tuple[Dict[str, str], list]:
+    """Return the `dtype` and `parse_dates` arguments of `pd.read_csv` for a table.
+
+    :param table_name: Key of SCHEMAS
+    :type table_name: str
+    :param columns: Columns of the file being read. Declared columns it lacks are skipped.
+    :type columns: Sequence[str]
+    :param strings_as: Dtype used instead of every declared `category` or string dtype,
+        e.g. `str` when chunks are read separately and their categories would not match
+    :type strings_as: Optional[str]
+    :return: Dtype per column and columns to parse as datetimes
+    :rtype: Tuple[Dict[str, str], list]
+    """
+    schema = SCHEMAS[table_name]
+    dtypes = {
+        col_name: (
+            strings_as
+            if strings_as is not None and dtype in ("category", STRING_DTYPE)
+            else dtype
+        )
+        for col_name, dtype in schema.dtypes.items()
+        if col_name in columns
+    }
+    return dtypes, [col_name for col_name in schema.parse_dates if col_name in columns]
+
+
+def read_table(
+        csv_path: str,
+        table_name: str,
+        cached: bool = False,
+        sort_by: Optional[str] = None,
+    ) -> pd.DataFrame:
+    """Load a CSV with its table's declared dtypes.
+
+    :param csv_path: Path to the CSV
+    :type csv_path: str
+    :param table_name: Key of SCHEMAS, e.g. "transactions_log"
+    :type table_name: str
+    :param cached: Load through the columnar cache, which memory-maps the columns on
+        later loads. Strings are then loaded as `category`, which the cache can map.
+    :type cached: bool
+    :param sort_by: Column to (stably) sort the rows by. Cached tables are stored sorted,
+        so loading them sorted costs no copy.
+    :type sort_by: Optional[str]
+    :return: Loaded table
+    :rtype: pd.DataFrame
+    """
+    assert os.path.isfile(csv_path), f"{csv_path=} is not a file."
+    columns = pd.read_csv(csv_path, nrows=0).columns
+    if cached:
+        dtypes, parse_dates = read_options(table_name, columns, strings_as="category")
+        return columnar_cache.read_csv_cached(
+            csv_path, dtype=dtypes, parse_dates=parse_dates, sort_by=sort_by
+        )
+
+    dtypes, parse_dates = read_options(table_name, columns)
+    df = pd.read_csv(csv_path, dtype=dtypes, parse_dates=parse_dates)
+    for col_name in df.columns:
+        if df[col_name].dtype == object:
+            df[col_name] = df[col_name].astype("category")
+    if sort_by is not None:
+        df = df.sort_values(sort_by, kind="stable", ignore_index=True)
+    return df
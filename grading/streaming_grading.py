@@ -0,0 +1,208 @@
+"""Bounded-memory grading for results and labels files too large to load at once.
+
+Both CSVs are read in chunks and hash-partitioned by ID into temporary binary files, so each
+ID lands in the same partition for predictions and labels whatever order the files are in.
+Each partition is then small enough to check and count in memory, and confusion counts are
+summed across partitions. Validation and ID errors are reported as in the in-memory path.
+A binary results file is memory-mapped instead of read, and partitioned chunk by chunk too.
+"""
+import math
+import os
+import tempfile
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+
+import binary_results
+import prediction_checks
+from confusion_metrics import ConfusionCounts, confusion_counts
+
+
+# Each partition holds roughly this much CSV text from the larger of the two input files.
+PARTITION_BYTES = 64 * 2**20
+
+
+def _record_dtype(n_cols: int) -> np.dtype:
+    return np.dtype([("id", np.int64), ("values", np.int8, (n_cols,))])
+
+
+def _partition_csv(
+        csv_path: str,
+        id_col_name: str,
+        value_col_names: List[str],
+        partition_paths: List[str],
+        chunk_size: int,
+        validate: bool,
+    ):
+    """Split a CSV by `id % len(partition_paths)` into binary files of (id, values) records.
+
+    :param validate: Whether to check the file as a team's results file. Labels are
+        trusted and only cast.
+    :type validate: bool
+    """
+    csv_name = os.path.basename(csv_path)
+    if binary_results.is_binary_results(csv_path):
+        # Its schema is checked as it is mapped, and slicing it copies nothing.
+        results_df = binary_results.load_binary_results(
+            csv_path, id_col_name, value_col_names
+        )
+        chunks = (
+            results_df.iloc[start:start + chunk_size]
+            for start in range(0, len(results_df), chunk_size)
+        )
+    else:
+        if validate:
+            columns = pd.read_csv(csv_path, nrows=0).columns
+            prediction_checks.check_results_columns(
+                columns, id_col_name, value_col_names, csv_name
+            )
+        chunks = pd.read_csv(
+            csv_path, usecols=[id_col_name] + value_col_names, chunksize=chunk_size
+        )
+    record_dtype = _record_dtype(len(value_col_names))
+    num_partitions = len(partition_paths)
+
+    partition_files = [open(path, "wb") for path in partition_paths]
+    try:
+        first_row = 0
+        for chunk in chunks:
+            ids = chunk[id_col_name]
+            if validate:
+                ids = prediction_checks.check_id_column(ids, csv_name, first_row)
+                values = prediction_checks.validate_binary_columns(
+                    chunk, value_col_names, csv_name, first_row
+                )
+            else:
+                values = chunk[value_col_names].to_numpy(dtype=np.int8)
+            ids = ids.to_numpy()
+            int_ids = ids.astype(np.int64)
+            if validate and not np.array_equal(int_ids, ids):
+                row = int(np.argmax(int_ids != ids))
+                raise AssertionError(
+                    f"Column `{id_col_name}` in {csv_name} does not consist of integers: "
+                    f"row {first_row + row} (line {first_row + row + 2} of {csv_name}) has "
+                    f"value {ids[row]!r}."
+                )
+
+            records = np.empty(len(chunk), dtype=record_dtype)
+            records["id"] = int_ids
+            records["values"] = values
+            partitions = int_ids % num_partitions
+            order = np.argsort(partitions, kind="stable")
+            bounds = np.searchsorted(partitions[order], np.arange(num_partitions + 1))
+            records = records[order]
+            for partition, partition_file in enumerate(partition_files):
+                records[bounds[partition]:bounds[partition + 1]].tofile(partition_file)
+
+            first_row += len(chunk)
+        if validate:
+            prediction_checks.check_has_rows(first_row, csv_name)
+    finally:
+        for partition_file in partition_files:
+            partition_file.close()
+
+
+def _load_partition(path: str, record_dtype: np.dtype) -> np.ndarray:
+    records = np.fromfile(path, dtype=record_dtype)
+    return records[np.argsort(records["id"], kind="stable")]
+
+
+def stream_confusion_counts(
+        csv_path: str,
+        test_labels_path: str,
+        id_col_name: str,
+        pred_col_names: List[str],
+        entity: str,
+        chunk_size: int = 1_000_000,
+        num_partitions: Optional[int] = None,
+    ) -> ConfusionCounts:
+    """Check a results CSV against the labels and count TP/FP/FN/TN with bounded memory.
+
+    :param csv_path: Path to results.csv, or to a binary results file (see
+        `binary_results`)
+    :type csv_path: str
+    :param test_labels_path: Path to labels.csv
+    :type test_labels_path: str
+    :param id_col_name: Name of the ID column, e.g. "agent_id"
+    :type id_col_name: str
+    :param pred_col_names: Names of the binary prediction columns, which are also the
+        label column names
+    :type pred_col_names: List[str]
+    :param entity: Plural name of what the IDs identify, e.g. "agents", for error messages
+    :type entity: str
+    :param chunk_size: Number of CSV rows read at a time
+    :type chunk_size: int
+    :param num_partitions: Number of ID partitions. By default, enough that each holds
+        about PARTITION_BYTES of CSV text.
+    :type num_partitions: Optional[int]
+    :return: Confusion counts per prediction column, as the in-memory path computes them
+    :rtype: ConfusionCounts
+    """
+    assert os.path.isfile(csv_path), f"{csv_path=} is not a file."
+    assert os.path.isfile(test_labels_path), f"{test_labels_path=} is not a file."
+    if num_partitions is None:
+        largest_bytes = max(os.path.getsize(csv_path), os.path.getsize(test_labels_path))
+        num_partitions = max(1, math.ceil(largest_bytes / PARTITION_BYTES))
+    record_dtype = _record_dtype(len(pred_col_names))
+
+    with tempfile.TemporaryDirectory(prefix="bth-grading-") as partition_dir:
+        label_paths = [
+            os.path.join(partition_dir, f"labels-{i}.bin") for i in range(num_partitions)
+        ]
+        pred_paths = [
+            os.path.join(partition_dir, f"preds-{i}.bin") for i in range(num_partitions)
+        ]
+        _partition_csv(
+            test_labels_path, id_col_name, pred_col_names, label_paths, chunk_size, False
+        )
+        _partition_csv(csv_path, id_col_name, pred_col_names, pred_paths, chunk_size, True)
+
+        no_ids = prediction_checks.capped_ids(np.empty(0, dtype=np.int64))
+        label_duplicates = pred_duplicates = pred_only = label_only = no_ids
+        counts = ConfusionCounts(
+            *(np.zeros(len(pred_col_names), dtype=np.int64) for _ in range(4))
+        )
+        for label_path, pred_path in zip(label_paths, pred_paths):
+            labels = _load_partition(label_path, record_dtype)
+            preds = _load_partition(pred_path, record_dtype)
+
+            label_duplicates = prediction_checks.merge_capped_ids(
+                label_duplicates,
+                prediction_checks.capped_ids(
+                    prediction_checks.find_duplicate_ids(labels["id"])
+                ),
+            )
+            pred_duplicates = prediction_checks.merge_capped_ids(
+                pred_duplicates,
+                prediction_checks.capped_ids(
+                    prediction_checks.find_duplicate_ids(preds["id"])
+                ),
+            )
+            pred_only = prediction_checks.merge_capped_ids(
+                pred_only,
+                prediction_checks.capped_ids(
+                    prediction_checks.ids_not_in(preds["id"], labels["id"])
+                ),
+            )
+            label_only = prediction_checks.merge_capped_ids(
+                label_only,
+                prediction_checks.capped_ids(
+                    prediction_checks.ids_not_in(labels["id"], preds["id"])
+                ),
+            )
+
+            # Once any ID problem is found grading fails, so skip counting from then on.
+            id_problems = (label_duplicates, pred_duplicates, pred_only, label_only)
+            if any(ids.count > 0 for ids in id_problems):
+                continue
+            partition_counts = confusion_counts(labels["values"], preds["values"])
+            counts = ConfusionCounts(
+                *(total + count for total, count in zip(counts, partition_counts))
+            )
+
+    # Raise in the same order as the in-memory path.
+    prediction_checks.raise_for_duplicate_ids(label_duplicates, entity, "labels")
+    prediction_checks.raise_for_duplicate_ids(pred_duplicates, entity, "predictions")
+    prediction_checks.raise_for_id_mismatches(pred_only, label_only, entity)
+    return counts
@@ -1,36 +1,46 @@
 import argparse
 import os
 
-import pandas as pd
-import numpy as np
+from streaming_inference import CHUNK_BYTES, default_num_workers, write_results
 
 
-PREDICTION_WINDOW_MONTHS = [3, 6, 9, 12]  # Constant for this charge-off prediction task.
+# Written by train.py.
+MODEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "model")
 
 
-def main(test_set_dir: str, results_dir: str):
-    
-    # Load test set data.
-    input_df = pd.read_csv(os.path.join(test_set_dir, "inputs.csv"))
+def main(
+        test_set_dir: str,
+        results_dir: str,
+        num_workers: int = 1,
+        chunk_bytes: int = CHUNK_BYTES,
+    ):
 
     # ---------------------------------
     # START PROCESSING TEST SET INPUTS
     # Beep boop bop you should do something with test inputs unlike this script.
 
-    # In lieu of doing something test inputs, maybe you "learned" from training data that
-    #  20% of patients have heart attacks, so you randomly guess with that percentage.
-    patients = list(input_df.PatientID)
-    output_df = pd.DataFrame(columns=["PatientID", "HadHeartAttack"])
-    output_df["PatientID"] = patients
-    heart_attack_percent = 0.2
-    had_heart_attack = np.random.random(len(patients)) < heart_attack_percent
-    output_df["HadHeartAttack"] = had_heart_attack
+    # inputs.csv is streamed in chunks: workers parse and score chunks in parallel while
+    #  their rows are written to results.csv in input order, so memory stays flat however
+    #  many patients there are.
+    if os.path.isfile(os.path.join(MODEL_DIR, "meta.json")):
+        # Fitted ahead of time by train.py, so inference is just encoding the inputs plus
+        #  one matrix product per chunk of patients.
+        model_dir = MODEL_DIR
+    else:
+        # In lieu of a trained model, patients are guessed randomly.
+        model_dir = None
 
     # END PROCESSING TEST SET INPUTS
     # ---------------------------------
 
     # NOTE: name "results.csv" is a must.
-    output_df.to_csv(os.path.join(results_dir, "results.csv"), index=False)
+    write_results(
+        os.path.join(test_set_dir, "inputs.csv"),
+        os.path.join(results_dir, "results.csv"),
+        model_dir,
+        num_workers=num_workers,
+        chunk_bytes=chunk_bytes,
+    )
 
 
 if __name__ == "__main__":
@@ -45,6 +55,23 @@ if __name__ == "__main__":
         type=str,
         required=True
     )
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        default=default_num_workers(),
+        help="Worker processes that score chunks of inputs.csv. 1 scores in this process.",
+    )
+    parser.add_argument(
+        "--chunk_mb",
+        type=float,
+        default=CHUNK_BYTES / 2**20,
+        help="Approximate MiB of inputs.csv scored per chunk.",
+    )
 
     args = parser.parse_args()
-    main(args.bth_test_set, args.bth_results)
\ No newline at end of file
+    main(
+        args.bth_test_set,
+        args.bth_results,
+        num_workers=args.num_workers,
+        chunk_bytes=int(args.chunk_mb * 2**20),
+    )
\ No newline at end of file
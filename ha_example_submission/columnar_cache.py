@@ -0,0 +1,231 @@
+"""Typed, memory-mapped columnar cache for CSV inputs.
+
+The first `read_csv_cached` of a CSV parses it once and saves every column as a `.npy`
+file: numbers keep their (optionally downcast) dtype, parsed timestamps are stored as
+datetime64, and strings are stored as categorical codes plus their categories. Later calls
+memory-map those files instead of re-parsing the text, so loading costs little more than an
+mmap.
+
+Caches are keyed by a hash of the CSV's contents together with the read options. The hash
+of each CSV path is remembered alongside its size and mtime so unchanged files are not
+re-hashed; a file that changes on disk is re-hashed and, if its contents differ, re-parsed.
+
+Each load marks its entry as used. Whenever a new entry is written, the least recently
+used entries are removed until the cache fits in $BTH_CACHE_MAX_BYTES (10 GiB by default).
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+
+# Bump when the on-disk layout changes so stale caches are ignored, not misread.
+CACHE_FORMAT_VERSION = 1
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "bth-columnar")
+DEFAULT_CACHE_MAX_BYTES = 10 * 2**30
+
+
+def _cache_root(cache_dir: Optional[str]) -> str:
+    return cache_dir or os.environ.get("BTH_CACHE_DIR", DEFAULT_CACHE_DIR)
+
+
+def _cache_max_bytes() -> int:
+    return int(os.environ.get("BTH_CACHE_MAX_BYTES", DEFAULT_CACHE_MAX_BYTES))
+
+
+def _write_json_atomic(path: str, obj: dict):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        json.dump(obj, f)
+    os.replace(tmp_path, path)
+
+
+def file_digest(csv_path: str, cache_root: str) -> str:
+    """Return the SHA-1 of a file's contents, reusing the last hash if size/mtime match.
+
+    :param csv_path: Path to the file to hash
+    :type csv_path: str
+    :param cache_root: Cache directory holding the path -> hash index
+    :type cache_root: str
+    :return: Hex digest of the file's contents
+    :rtype: str
+    """
+    index_path = os.path.join(cache_root, "index.json")
+    stat = os.stat(csv_path)
+    abs_path = os.path.abspath(csv_path)
+    try:
+        with open(index_path) as f:
+            index = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        index = {}
+    entry = index.get(abs_path)
+    if entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+        return entry["sha1"]
+
+    sha1 = hashlib.sha1()
+    with open(csv_path, "rb") as f:
+        for block in iter(lambda: f.read(8 * 2**20), b""):
+            sha1.update(block)
+    index[abs_path] = {
+        "size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha1": sha1.hexdigest()
+    }
+    _write_json_atomic(index_path, index)
+    return sha1.hexdigest()
+
+
+def _write_cache(df: pd.DataFrame, entry_dir: str):
+    # Build the entry in a temp dir and rename it into place, so a crash or a concurrent
+    #  reader never sees a half-written cache.
+    tmp_dir = tempfile.mkdtemp(dir=os.path.dirname(entry_dir), suffix=".tmp")
+    columns = []
+    for i, (col_name, col) in enumerate(df.items()):
+        stem = os.path.join(tmp_dir, f"{i}")
+        if isinstance(col.dtype, pd.CategoricalDtype):
+            categories = col.cat.categories.to_numpy()
+            if categories.dtype == object:
+                # Fixed-width strings load without pickle.
+                categories = categories.astype(str)
+            np.save(stem + ".codes.npy", col.cat.codes.to_numpy())
+            np.save(stem + ".categories.npy", categories)
+            columns.append({"name": col_name, "kind": "category"})
+        else:
+            np.save(stem + ".npy", col.to_numpy())
+            columns.append({"name": col_name, "kind": "array"})
+    _write_json_atomic(
+        os.path.join(tmp_dir, "meta.json"), {"columns": columns, "n_rows": len(df)}
+    )
+    try:
+        os.rename(tmp_dir, entry_dir)
+    except OSError:
+        # Another process finished writing the same entry first.
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def _read_cache(entry_dir: str) -> pd.DataFrame:
+    with open(os.path.join(entry_dir, "meta.json")) as f:
+        meta = json.load(f)
+    # Copy-on-write maps let callers modify the DF without touching the cache. Empty
+    #  files cannot be mapped.
+    mmap_mode = "c" if meta["n_rows"] > 0 else None
+    data = {}
+    for i, column in enumerate(meta["columns"]):
+        stem = os.path.join(entry_dir, f"{i}")
+        if column["kind"] == "category":
+            data[column["name"]] = pd.Categorical.from_codes(
+                np.load(stem + ".codes.npy", mmap_mode=mmap_mode),
+                categories=np.load(stem + ".categories.npy"),
+            )
+        else:
+            data[column["name"]] = np.load(stem + ".npy", mmap_mode=mmap_mode)
+    return pd.DataFrame(data, copy=False)
+
+
+def _entry_size(entry_dir: str) -> int:
+    return sum(entry.stat().st_size for entry in os.scandir(entry_dir) if entry.is_file())
+
+
+def prune_cache(cache_root: str, max_bytes: int, keep: Sequence[str] = ()) -> List[str]:
+    """Remove the least recently used cache entries until the rest fit in `max_bytes`.
+
+    :param cache_root: Cache directory
+    :type cache_root: str
+    :param max_bytes: Total size of the entries to keep
+    :type max_bytes: int
+    :param keep: Entry directories never removed, e.g. the one just written
+    :type keep: Sequence[str]
+    :return: Removed entry directories, least recently used first
+    :rtype: List[str]
+    """
+    entries = []
+    for entry in os.scandir(cache_root):
+        # Skips the path -> hash index and entries still being written or removed.
+        if not entry.is_dir() or entry.name.endswith(".tmp"):
+            continue
+        try:
+            last_used_ns = os.stat(os.path.join(entry.path, "meta.json")).st_mtime_ns
+            entries.append((last_used_ns, entry.path, _entry_size(entry.path)))
+        except FileNotFoundError:
+            continue
+    total_bytes = sum(size for _, _, size in entries)
+    removed = []
+    for _, entry_dir, size in sorted(entries):
+        if total_bytes <= max_bytes:
+            break
+        if entry_dir in keep:
+            continue
+        # Renamed away first, so readers see the entry either whole or not at all. Files
+        #  they already mapped stay readable after the removal.
+        removing_dir = tempfile.mkdtemp(dir=cache_root, suffix=".tmp")
+        try:
+            os.rename(entry_dir, os.path.join(removing_dir, "entry"))
+        except FileNotFoundError:
+            # Another process removed it first.
+            os.rmdir(removing_dir)
+            continue
+        shutil.rmtree(removing_dir, ignore_errors=True)
+        total_bytes -= size
+        removed.append(entry_dir)
+    return removed
+
+
+def read_csv_cached(
+        csv_path: str,
+        dtype: Optional[Dict[str, str]] = None,
+        parse_dates: Sequence[str] = (),
+        sort_by: Optional[str] = None,
+        cache_dir: Optional[str] = None,
+    ) -> pd.DataFrame:
+    """Load a CSV through the columnar cache, parsing the text only on the first call.
+
+    String columns that are not in `parse_dates` are loaded as `category`.
+
+    :param csv_path: Path to the CSV
+    :type csv_path: str
+    :param dtype: Column dtypes passed to `pd.read_csv`, e.g. {"agent_id": "int32"}
+    :type dtype: Optional[Dict[str, str]]
+    :param parse_dates: Columns parsed as datetime64
+    :type parse_dates: Sequence[str]
+    :param sort_by: Column to (stably) sort the rows by. They are sorted once, before they
+        are cached, so sorted loads map the cache as they do unsorted ones.
+    :type sort_by: Optional[str]
+    :param cache_dir: Cache directory. Defaults to $BTH_CACHE_DIR, else
+        ~/.cache/bth-columnar.
+    :type cache_dir: Optional[str]
+    :return: Loaded CSV, with columns memory-mapped from the cache
+    :rtype: pd.DataFrame
+    """
+    assert os.path.isfile(csv_path), f"{csv_path=} is not a file."
+    cache_root = _cache_root(cache_dir)
+    os.makedirs(cache_root, exist_ok=True)
+
+    options = {
+        "version": CACHE_FORMAT_VERSION,
+        "dtype": dict(sorted((dtype or {}).items())),
+        "parse_dates": sorted(parse_dates),
+        "sort_by": sort_by,
+    }
+    options_digest = hashlib.sha1(json.dumps(options).encode()).hexdigest()[:12]
+    entry_dir = os.path.join(
+        cache_root, f"{file_digest(csv_path, cache_root)}-{options_digest}"
+    )
+
+    try:
+        # Marks the entry as used, for pruning.
+        os.utime(os.path.join(entry_dir, "meta.json"))
+        return _read_cache(entry_dir)
+    except FileNotFoundError:
+        pass
+    df = pd.read_csv(csv_path, dtype=dtype, parse_dates=list(parse_dates))
+    for col_name in df.columns:
+        if df[col_name].dtype == object:
+            df[col_name] = df[col_name].astype("category")
+    if sort_by is not None:
+        df = df.sort_values(sort_by, kind="stable", ignore_index=True)
+    _write_cache(df, entry_dir)
+    prune_cache(cache_root, _cache_max_bytes(), keep=[entry_dir])
+    return _read_cache(entry_dir)
@@ -0,0 +1,354 @@
+"""Stratified cross-validation of the linear model, with cached folds and parallel jobs.
+
+Rows are assigned to folds once, stratified on one label column so that every fold has about
+the same share of positives. Each fold's training and validation feature matrices are then
+built, standardized with the training rows' statistics and saved as `.npy` files, keyed by
+the contents of the train set and of the code that builds the features. Later runs, and
+every configuration within a run, memory-map those files instead of recomputing features.
+
+Each (configuration, fold) pair is one job: fit on the fold's training rows, tune the
+decision thresholds for F1 on them as train.py does, predict the validation rows and count
+their TP/FP/FN/TN with the grading scripts' `confusion_metrics`. Jobs run in a process pool,
+every configuration's first fold before any configuration's second, and a configuration is
+dropped once it trails another by more than a margin on the folds both have been scored on,
+so its remaining folds are never fitted.
+"""
+import hashlib
+import itertools
+import json
+import os
+import shutil
+import tempfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+import confusion_metrics
+import linear_model
+from columnar_cache import file_digest
+
+
+# Bump when the on-disk layout changes so stale caches are ignored, not misread.
+CACHE_FORMAT_VERSION = 1
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "bth-cv-folds")
+# The grading scripts' metrics. Configurations are ranked by PRIMARY_METRIC averaged across
+#  the label columns, like the graders' "avg" column.
+METRICS: Dict[str, Callable] = {
+    "f1": confusion_metrics.f1,
+    "precision": confusion_metrics.precision,
+    "recall": confusion_metrics.recall,
+    "mcc": confusion_metrics.mcc,
+}
+PRIMARY_METRIC = "f1"
+
+
+class FitConfig(NamedTuple):
+    """Hyperparameters of one cross-validated configuration."""
+    l2: float
+    joint: bool = False
+    tune_thresholds: bool = True
+
+
+def default_num_workers() -> int:
+    """Number of CPUs this process may run on."""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def stratified_folds(strata: np.ndarray, n_folds: int, seed: int = 0) -> np.ndarray:
+    """Assign rows to folds at random, spreading each stratum's rows evenly across folds.
+
+    :param strata: Stratum of each row, e.g. its 0/1 label
+    :type strata: np.ndarray
+    :param n_folds: Number of folds
+    :type n_folds: int
+    :param seed: Seed of the assignment
+    :type seed: int
+    :return: int8 fold of each row, in [0, n_folds)
+    :rtype: np.ndarray
+    """
+    strata = np.asarray(strata)
+    assert 2 <= n_folds <= min(len(strata), 127), \
+        f"{n_folds=} must be at least 2 and at most the {len(strata)} rows."
+    order = np.random.default_rng(seed).permutation(len(strata))
+    # A stable sort groups rows by stratum and keeps them shuffled within each, so dealing
+    #  them out to the folds in turn balances every stratum.
+    order = order[np.argsort(strata[order], kind="stable")]
+    folds = np.empty(len(strata), dtype=np.int8)
+    folds[order] = np.arange(len(strata)) % n_folds
+    return folds
+
+
+def _save_standardized(
+        path: str,
+        model: linear_model.LinearModel,
+        features_df: pd.DataFrame,
+    ):
+    # Written one batch at a time, so the float64 copy of the whole matrix never exists.
+    X = np.lib.format.open_memmap(
+        path, mode="w+", dtype=np.float32, shape=(len(features_df), len(model.center))
+    )
+    start = 0
+    for block in linear_model.standardized_batches(
+        model, features_df, linear_model.BATCH_SIZE
+    ):
+        X[start:start + len(block)] = block
+        start += len(block)
+    X.flush()
+    del X
+
+
+def _write_folds(
+        entry_dir: str,
+        features_fn: Callable[[np.ndarray], pd.DataFrame],
+        labels_df: pd.DataFrame,
+        folds: np.ndarray,
+    ):
+    # Build the entry in a temp dir and rename it into place, so a crash or a concurrent
+    #  run never sees a half-written cache.
+    tmp_dir = tempfile.mkdtemp(dir=os.path.dirname(entry_dir), suffix=".tmp")
+    labels = labels_df.to_numpy(dtype=np.int8)
+    n_folds = int(folds.max()) + 1
+    for fold in range(n_folds):
+        is_valid = folds == fold
+        features_df = features_fn(~is_valid)
+        assert len(features_df) == len(labels_df), \
+            f"{len(features_df)=} != {len(labels_df)=}"
+        train_df = features_df.iloc[np.flatnonzero(~is_valid)]
+        # Standardized with the training rows' statistics only, as train.py would be.
+        model = linear_model.init_model(train_df, list(labels_df.columns))
+        fold_dir = os.path.join(tmp_dir, f"fold{fold}")
+        os.makedirs(fold_dir)
+        _save_standardized(os.path.join(fold_dir, "X_train.npy"), model, train_df)
+        _save_standardized(
+            os.path.join(fold_dir, "X_valid.npy"),
+            model,
+            features_df.iloc[np.flatnonzero(is_valid)],
+        )
+        np.save(os.path.join(fold_dir, "Y_train.npy"), labels[~is_valid])
+        np.save(os.path.join(fold_dir, "Y_valid.npy"), labels[is_valid])
+    np.save(os.path.join(tmp_dir, "folds.npy"), folds)
+    with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+        json.dump(
+            {
+                "n_folds": n_folds,
+                "n_rows": len(labels_df),
+                "feature_names": model.feature_names,
+                "target_names": model.target_names,
+            },
+            f,
+            indent=2,
+        )
+    try:
+        os.rename(tmp_dir, entry_dir)
+    except OSError:
+        # Another process finished writing the same entry first.
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def prepare_folds(
+        features_fn: Callable[[np.ndarray], pd.DataFrame],
+        labels_df: pd.DataFrame,
+        strata_col_name: str,
+        source_paths: Sequence[str],
+        n_folds: int = 5,
+        seed: int = 0,
+        cache_dir: Optional[str] = None,
+    ) -> str:
+    """Assign folds and cache each fold's standardized feature matrices, unless cached.
+
+    :param features_fn: Given a boolean mask of a fold's training rows, returns the
+        feature matrix of every row, row-aligned with `labels_df`. Anything learned from
+        rows, like category lists, must be learned from the masked rows only. It is only
+        called when the folds are not cached yet.
+    :type features_fn: Callable[[np.ndarray], pd.DataFrame]
+    :param labels_df: 0/1 label columns only, one per target
+    :type labels_df: pd.DataFrame
+    :param strata_col_name: Label column the folds are stratified on
+    :type strata_col_name: str
+    :param source_paths: Files whose contents the features depend on: the train set's
+        files and the code building the features. Editing any of them rebuilds the folds.
+    :type source_paths: Sequence[str]
+    :param n_folds: Number of folds
+    :type n_folds: int
+    :param seed: Seed of the fold assignment
+    :type seed: int
+    :param cache_dir: Cache directory. Defaults to $BTH_CV_CACHE_DIR, else
+        ~/.cache/bth-cv-folds.
+    :type cache_dir: Optional[str]
+    :return: Directory of the cached folds, for `cross_validate`
+    :rtype: str
+    """
+    cache_root = cache_dir or os.environ.get("BTH_CV_CACHE_DIR", DEFAULT_CACHE_DIR)
+    os.makedirs(cache_root, exist_ok=True)
+    # This module and linear_model decide how the cached matrices are standardized.
+    source_paths = list(source_paths) + [__file__, linear_model.__file__]
+    key = {
+        "version": CACHE_FORMAT_VERSION,
+        "sources": sorted(file_digest(path, cache_root) for path in source_paths),
+        "target_names": [str(col_name) for col_name in labels_df.columns],
+        "strata_col_name": strata_col_name,
+        "n_folds": n_folds,
+        "seed": seed,
+    }
+    entry_dir = os.path.join(
+        cache_root, hashlib.sha1(json.dumps(key).encode()).hexdigest()[:16]
+    )
+    if not os.path.isfile(os.path.join(entry_dir, "meta.json")):
+        folds = stratified_folds(labels_df[strata_col_name].to_numpy(), n_folds, seed)
+        _write_folds(entry_dir, features_fn, labels_df, folds)
+    return entry_dir
+
+
+def _evaluate(fold_dir: str, config: FitConfig) -> confusion_metrics.ConfusionCounts:
+    X_train, Y_train, X_valid, Y_valid = (
+        np.load(os.path.join(fold_dir, f"{array_name}.npy"), mmap_mode="r")
+        for array_name in ("X_train", "Y_train", "X_valid", "Y_valid")
+    )
+    coef, intercept = linear_model.fit_weights(X_train, Y_train, config.l2, config.joint)
+    threshold = np.full(Y_train.shape[1], 0.5)
+    if config.tune_thresholds:
+        threshold, _ = linear_model.best_f1_thresholds(
+            linear_model.proba_of_standardized(X_train, coef, intercept, config.joint),
+            Y_train,
+        )
+    preds = linear_model.apply_thresholds(
+        linear_model.proba_of_standardized(X_valid, coef, intercept, config.joint),
+        threshold,
+        config.joint,
+    )
+    return confusion_metrics.confusion_counts(Y_valid, preds)
+
+
+def _is_outclassed(
+        scores: List[Dict[int, float]],
+        config_idx: int,
+        min_folds: int,
+        prune_margin: float,
+    ) -> bool:
+    # Compared on the same folds only, so a config is never judged on easier folds.
+    own = scores[config_idx]
+    if len(own) < min_folds:
+        return False
+    own_mean = np.mean(list(own.values()))
+    for other_idx, other in enumerate(scores):
+        if other_idx == config_idx or not all(fold in other for fold in own):
+            continue
+        if np.mean([other[fold] for fold in own]) - own_mean > prune_margin:
+            return True
+    return False
+
+
+def _summary_df(
+        configs: List[FitConfig],
+        counts: Dict[Tuple[int, int], confusion_metrics.ConfusionCounts],
+        pruned: set,
+    ) -> pd.DataFrame:
+    rows = []
+    for config_idx, config in enumerate(configs):
+        config_counts = [
+            fold_counts for (idx, _), fold_counts in counts.items() if idx == config_idx
+        ]
+        row = {**config._asdict(), "folds_scored": len(config_counts)}
+        row["pruned"] = config_idx in pruned
+        for metric_name, metric_fn in METRICS.items():
+            fold_values = [metric_fn(fold_counts).mean() for fold_counts in config_counts]
+            row[f"{metric_name}_avg"] = np.mean(fold_values) if fold_values else np.nan
+            if metric_name == PRIMARY_METRIC:
+                row[f"{metric_name}_avg_std"] = (
+                    np.std(fold_values) if fold_values else np.nan
+                )
+        rows.append(row)
+    return pd.DataFrame(rows).sort_values(
+        ["pruned", f"{PRIMARY_METRIC}_avg"], ascending=[True, False]
+    ).reset_index(drop=True)
+
+
+def cross_validate(
+        entry_dir: str,
+        configs: List[FitConfig],
+        num_workers: int = 1,
+        min_folds: int = 2,
+        prune_margin: float = 0.02,
+    ) -> pd.DataFrame:
+    """Score every configuration on the cached folds, dropping clearly worse ones early.
+
+    :param entry_dir: Directory of the cached folds, from `prepare_folds`
+    :type entry_dir: str
+    :param configs: Configurations to compare
+    :type configs: List[FitConfig]
+    :param num_workers: Number of worker processes. 1 fits in this process.
+    :type num_workers: int
+    :param min_folds: Number of folds a configuration is scored on before it may be dropped
+    :type min_folds: int
+    :param prune_margin: Drop a configuration once another's average PRIMARY_METRIC beats
+        its own by more than this on the same folds. Use inf to score every fold.
+    :type prune_margin: float
+    :return: One row per configuration, best first: its hyperparameters, the number of
+        folds it was scored on, whether it was dropped, and "{metric_name}_avg" per metric,
+        the mean over folds of the metric averaged across label columns
+    :rtype: pd.DataFrame
+    """
+    with open(os.path.join(entry_dir, "meta.json")) as f:
+        n_folds = json.load(f)["n_folds"]
+    # Fold-major order: every configuration gets a first score before any gets a second,
+    #  so poor ones are dropped before most of their folds start.
+    jobs = [
+        (config_idx, fold) for fold in range(n_folds) for config_idx in range(len(configs))
+    ]
+    counts: Dict[Tuple[int, int], confusion_metrics.ConfusionCounts] = {}
+    scores: List[Dict[int, float]] = [{} for _ in configs]
+    pruned = set()
+
+    def record(
+            config_idx: int,
+            fold: int,
+            fold_counts: confusion_metrics.ConfusionCounts,
+        ):
+        counts[config_idx, fold] = fold_counts
+        scores[config_idx][fold] = METRICS[PRIMARY_METRIC](fold_counts).mean()
+        print(
+            f"{configs[config_idx]} fold {fold}: {PRIMARY_METRIC}_avg "
+            f"{scores[config_idx][fold]:.4f}"
+        )
+        newly_pruned = [
+            idx for idx in range(len(configs))
+            if idx not in pruned and _is_outclassed(scores, idx, min_folds, prune_margin)
+        ]
+        for idx in newly_pruned:
+            print(f"Dropping {configs[idx]} after {len(scores[idx])} fold(s).")
+        pruned.update(newly_pruned)
+
+    # Lazily skips jobs of configurations dropped by the time the job is reached.
+    queued_jobs = (job for job in jobs if job[0] not in pruned)
+    if num_workers <= 1:
+        for config_idx, fold in queued_jobs:
+            fold_dir = os.path.join(entry_dir, f"fold{fold}")
+            record(config_idx, fold, _evaluate(fold_dir, configs[config_idx]))
+        return _summary_df(configs, counts, pruned)
+
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        job_of = {}
+
+        def submit(config_idx: int, fold: int):
+            fold_dir = os.path.join(entry_dir, f"fold{fold}")
+            job_of[executor.submit(_evaluate, fold_dir, configs[config_idx])] = (
+                config_idx, fold
+            )
+
+        # At most one job per worker is in flight, and the next is only taken once one
+        #  finishes, so a configuration dropped meanwhile never starts its remaining folds.
+        #  Jobs already running when it is dropped finish, and are still reported.
+        for config_idx, fold in itertools.islice(queued_jobs, num_workers):
+            submit(config_idx, fold)
+        while job_of:
+            done, _ = wait(job_of, return_when=FIRST_COMPLETED)
+            for future in done:
+                record(*job_of.pop(future), future.result())
+                next_job = next(queued_jobs, None)
+                if next_job is not None:
+                    submit(*next_job)
+    return _summary_df(configs, counts, pruned)
@@ -0,0 +1,63 @@
+"""Numeric feature matrix built from the ha inputs.
+
+Numeric columns are used as they are, and every other column is one-hot encoded against the
+categories seen in training. Those categories are saved with the model, so inference
+encodes the test inputs exactly as training did; a category not seen in training encodes
+as all zeros.
+"""
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+
+ID_COL_NAME = "PatientID"
+
+
+def learn_categories(input_df: pd.DataFrame) -> Dict[str, List[str]]:
+    """Return the sorted categories of each non-numeric input column.
+
+    :param input_df: Training inputs
+    :type input_df: pd.DataFrame
+    :return: Category names per non-numeric column
+    :rtype: Dict[str, List[str]]
+    """
+    return {
+        col_name: sorted(str(category) for category in col.dropna().unique())
+        for col_name, col in input_df.items()
+        if col_name != ID_COL_NAME and not pd.api.types.is_numeric_dtype(col)
+    }
+
+
+def build_features(
+        input_df: pd.DataFrame,
+        categories: Dict[str, List[str]],
+    ) -> pd.DataFrame:
+    """Build the patient x feature matrix from the ha inputs.
+
+    :param input_df: inputs.csv
+    :type input_df: pd.DataFrame
+    :param categories: Categories per non-numeric column, from `learn_categories` on the
+        training inputs
+    :type categories: Dict[str, List[str]]
+    :return: float32 features, one row per input row, indexed by PatientID
+    :rtype: pd.DataFrame
+    """
+    n_rows = len(input_df)
+    features = {}
+    for col_name, col in input_df.items():
+        if col_name == ID_COL_NAME or col_name in categories:
+            continue
+        features[col_name] = col.to_numpy(dtype=np.float32, na_value=np.nan)
+
+    for col_name, col_categories in categories.items():
+        one_hot = np.zeros((n_rows, len(col_categories)), dtype=np.float32)
+        if col_name in input_df:
+            codes = pd.Categorical(
+                input_df[col_name].astype(str), categories=col_categories
+            ).codes
+            rows = np.flatnonzero(codes >= 0)
+            one_hot[rows, codes[rows]] = 1
+        for i, category in enumerate(col_categories):
+            features[f"{col_name}={category}"] = one_hot[:, i]
+    return pd.DataFrame(features, index=pd.Index(input_df[ID_COL_NAME], name=ID_COL_NAME))
@@ -0,0 +1,163 @@
+"""Chunked, multi-process inference from inputs.csv straight to results.csv.
+
+inputs.csv is split into byte ranges of about `chunk_bytes` that end on line boundaries.
+Each worker process loads the model once, then parses, encodes and scores whole ranges and
+returns them already formatted as CSV rows, so parsing and formatting run on every core and
+the parent only copies bytes to results.csv, in input order. At most a few ranges per
+worker are in flight at a time, so memory stays flat however many patients there are.
+
+Ranges are split at newlines, so quoted fields must not contain line breaks, which the ha
+inputs never do.
+
+Without a model, each range's random guesses come from its own child of the seed's
+`np.random.SeedSequence`, so no two ranges share a random stream and the guesses are the
+same whichever worker scores a range, and however many workers there are.
+"""
+import io
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from features import ID_COL_NAME, build_features
+from linear_model import LinearModel, load_model, predict
+from schemas import read_options
+
+
+CHUNK_BYTES = 32 * 2**20
+# In lieu of a trained model, maybe you "learned" from training data that 20% of patients
+#  have heart attacks, so you randomly guess with that percentage.
+HEART_ATTACK_PERCENT = 0.2
+
+# Set in each pool worker by `_init_worker` so the model is loaded once per worker, not
+#  once per chunk.
+_worker_model: Optional[LinearModel] = None
+
+
+def default_num_workers() -> int:
+    """Number of CPUs this process may run on."""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def chunk_ranges(
+        csv_path: str,
+        chunk_bytes: int = CHUNK_BYTES,
+    ) -> Tuple[bytes, List[Tuple[int, int]]]:
+    """Split a CSV's rows into byte ranges of about `chunk_bytes` that end on line ends.
+
+    :param csv_path: Path to the CSV
+    :type csv_path: str
+    :param chunk_bytes: Approximate size of each range. Each ends at the first line end
+        at or after this many bytes from its start.
+    :type chunk_bytes: int
+    :return: Header line, and (start, end) offsets of each range after the header
+    :rtype: Tuple[bytes, List[Tuple[int, int]]]
+    """
+    ranges = []
+    with open(csv_path, "rb") as f:
+        header = f.readline()
+        size = os.fstat(f.fileno()).st_size
+        start = f.tell()
+        while start < size:
+            f.seek(min(start + chunk_bytes, size))
+            f.readline()
+            end = min(f.tell(), size)
+            ranges.append((start, end))
+            start = end
+    return header, ranges
+
+
+def _init_worker(model_dir: Optional[str]):
+    global _worker_model
+    _worker_model = load_model(model_dir) if model_dir is not None else None
+
+
+def _score_range(
+        csv_path: str,
+        columns: List[str],
+        start: int,
+        end: int,
+        seed: np.random.SeedSequence,
+    ) -> bytes:
+    with open(csv_path, "rb") as f:
+        f.seek(start)
+        text = f.read(end - start)
+    if not text.strip():
+        return b""
+    dtypes, _ = read_options("ha_inputs", columns)
+    input_df = pd.read_csv(io.BytesIO(text), header=None, names=columns, dtype=dtypes)
+
+    if _worker_model is not None:
+        features_df = build_features(input_df, _worker_model.metadata["categories"])
+        had_heart_attack = predict(_worker_model, features_df)[:, 0]
+    else:
+        had_heart_attack = (
+            np.random.default_rng(seed).random(len(input_df)) < HEART_ATTACK_PERCENT
+        ).astype(np.int8)
+    output_df = pd.DataFrame(
+        {ID_COL_NAME: input_df[ID_COL_NAME], "HadHeartAttack": had_heart_attack}
+    )
+    return output_df.to_csv(index=False, header=False).encode()
+
+
+def write_results(
+        inputs_csv_path: str,
+        results_csv_path: str,
+        model_dir: Optional[str],
+        num_workers: int = 1,
+        chunk_bytes: int = CHUNK_BYTES,
+        seed: Optional[int] = None,
+    ) -> int:
+    """Score every patient of inputs.csv and write results.csv, in input order.
+
+    :param inputs_csv_path: Path to the test set's inputs.csv
+    :type inputs_csv_path: str
+    :param results_csv_path: Path of results.csv to write
+    :type results_csv_path: str
+    :param model_dir: Directory of a model saved by train.py, or None to guess randomly
+    :type model_dir: Optional[str]
+    :param num_workers: Number of worker processes. 1 scores in this process.
+    :type num_workers: int
+    :param chunk_bytes: Approximate number of bytes of inputs.csv scored per task
+    :type chunk_bytes: int
+    :param seed: Seed of the random guesses made without a model. Guesses do not depend on
+        `num_workers`.
+    :type seed: Optional[int]
+    :return: Number of chunks scored
+    :rtype: int
+    """
+    header, ranges = chunk_ranges(inputs_csv_path, chunk_bytes)
+    columns = list(pd.read_csv(io.BytesIO(header), nrows=0).columns)
+    assert ID_COL_NAME in columns, f"{inputs_csv_path} has no `{ID_COL_NAME}` column."
+    range_seeds = np.random.SeedSequence(seed).spawn(len(ranges))
+
+    with open(results_csv_path, "wb") as results_file:
+        results_file.write(f"{ID_COL_NAME},HadHeartAttack\n".encode())
+        if num_workers <= 1 or len(ranges) <= 1:
+            _init_worker(model_dir)
+            for (start, end), range_seed in zip(ranges, range_seeds):
+                results_file.write(
+                    _score_range(inputs_csv_path, columns, start, end, range_seed)
+                )
+            return len(ranges)
+
+        with ProcessPoolExecutor(
+            max_workers=num_workers, initializer=_init_worker, initargs=(model_dir,)
+        ) as executor:
+            # Bound the chunks in flight, instead of submitting them all up front, so
+            #  scored chunks waiting behind a slow one cannot pile up in memory.
+            pending = deque()
+            for (start, end), range_seed in zip(ranges, range_seeds):
+                if len(pending) >= 2 * num_workers:
+                    results_file.write(pending.popleft().result())
+                pending.append(executor.submit(
+                    _score_range, inputs_csv_path, columns, start, end, range_seed
+                ))
+            while pending:
+                results_file.write(pending.popleft().result())
+    return len(ranges)
@@ -0,0 +1,157 @@
+import argparse
+import os
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+
+import cross_validation
+import features
+import schemas
+from cross_validation import FitConfig
+from features import ID_COL_NAME, build_features, learn_categories
+from schemas import read_table
+
+
+def main(
+        train_set_dir: str,
+        l2_values: List[float],
+        n_folds: int,
+        num_workers: int,
+        seed: int = 0,
+        min_folds: int = 2,
+        prune_margin: float = 0.02,
+        tune_threshold: bool = True,
+        results_csv_path: Optional[str] = None,
+    ):
+    """Cross-validate train.py's model over a grid of L2 penalties on a training set.
+
+    :param train_set_dir: Directory with inputs.csv and labels.csv
+    :type train_set_dir: str
+    :param l2_values: L2 penalties to compare
+    :type l2_values: List[float]
+    :param n_folds: Number of folds, stratified on HadHeartAttack
+    :type n_folds: int
+    :param num_workers: Number of worker processes fitting (penalty, fold) pairs
+    :type num_workers: int
+    :param seed: Seed of the fold assignment
+    :type seed: int
+    :param min_folds: Folds a penalty is scored on before it may be dropped
+    :type min_folds: int
+    :param prune_margin: Drop a penalty once another's mean F1 beats it by more than this
+        on the same folds
+    :type prune_margin: float
+    :param tune_threshold: Tune the decision threshold on each fold's training rows, as
+        train.py does by default
+    :type tune_threshold: bool
+    :param results_csv_path: If given, also write the results table to this CSV
+    :type results_csv_path: Optional[str]
+    """
+    inputs_path = os.path.join(train_set_dir, "inputs.csv")
+    labels_path = os.path.join(train_set_dir, "labels.csv")
+    label_df = read_table(labels_path, "ha_labels", cached=True)
+
+    def fold_features(is_train: np.ndarray) -> pd.DataFrame:
+        # Only called when the folds are not cached yet.
+        input_df = read_table(inputs_path, "ha_inputs", cached=True)
+        train_ids = label_df[ID_COL_NAME].to_numpy()[is_train]
+        categories = learn_categories(input_df[input_df[ID_COL_NAME].isin(train_ids)])
+        return build_features(input_df, categories).reindex(label_df[ID_COL_NAME])
+
+    entry_dir = cross_validation.prepare_folds(
+        fold_features,
+        label_df[["HadHeartAttack"]],
+        "HadHeartAttack",
+        [inputs_path, labels_path, features.__file__, schemas.__file__],
+        n_folds=n_folds,
+        seed=seed,
+    )
+    results_df = cross_validation.cross_validate(
+        entry_dir,
+        [FitConfig(l2, tune_thresholds=tune_threshold) for l2 in l2_values],
+        num_workers=num_workers,
+        min_folds=min_folds,
+        prune_margin=prune_margin,
+    )
+    print(results_df.to_string())
+    print(
+        f"Best: python train.py --bth_train_set {train_set_dir} "
+        f"--l2 {results_df.l2[0]:g}"
+    )
+    if results_csv_path is not None:
+        results_df.to_csv(results_csv_path, index=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--bth_train_set",
+        type=str,
+        required=True,
+        help="Directory with the ha training inputs.csv and labels.csv, e.g. "
+             "../ha_train_set."
+    )
+    parser.add_argument(
+        "--l2",
+        type=float,
+        nargs="+",
+        default=[0.01, 0.1, 1.0, 10.0, 100.0],
+        help="L2 penalties to compare."
+    )
+    parser.add_argument(
+        "--n_folds",
+        type=int,
+        default=5,
+        help="Number of cross-validation folds, stratified on HadHeartAttack."
+    )
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        default=cross_validation.default_num_workers(),
+        help="Number of processes fitting (penalty, fold) pairs. Defaults to every "
+             "available CPU."
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="Seed of the fold assignment. Folds are cached per seed."
+    )
+    parser.add_argument(
+        "--min_folds",
+        type=int,
+        default=2,
+        help="Folds a penalty is scored on before it may be dropped."
+    )
+    parser.add_argument(
+        "--prune_margin",
+        type=float,
+        default=0.02,
+        help="Drop a penalty once another's mean F1 beats it by more than this on the same "
+             "folds. Pass inf to score every penalty on every fold."
+    )
+    parser.add_argument(
+        "--no_threshold_tuning",
+        action="store_true",
+        help="Predict at probability 0.5 instead of at the threshold maximizing F1 on each "
+             "fold's training rows."
+    )
+    parser.add_argument(
+        "--results_csv",
+        type=str,
+        default=None,
+        help="Also write the results table to this CSV."
+    )
+
+    args = parser.parse_args()
+    main(
+        args.bth_train_set,
+        args.l2,
+        args.n_folds,
+        args.num_workers,
+        seed=args.seed,
+        min_folds=args.min_folds,
+        prune_margin=args.prune_margin,
+        tune_threshold=not args.no_threshold_tuning,
+        results_csv_path=args.results_csv,
+    )
@@ -4,40 +4,57 @@ import os
 import pandas as pd
 import numpy as np
 
+from feature_store import FeatureStore, default_store_dir
+from linear_model import load_model, predict
+
 
 PREDICTION_WINDOW_MONTHS = [3, 6, 9, 12]  # Constant for this charge-off prediction task.
+# Written by train.py.
+MODEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "model")
 
 
 def main(test_set_dir: str, results_dir: str):
     
-    # Load test set data.
-    account_state_df = pd.read_csv(os.path.join(test_set_dir, "account_state_log.csv"))
-    payments_df = pd.read_csv(os.path.join(test_set_dir, "payments_log.csv"))
-    transactions_df = pd.read_csv(os.path.join(test_set_dir, "transactions_log.csv"))
+    # Fold whatever was appended to the logs since the last run into the feature store,
+    #  instead of rescanning them.
+    feature_store = FeatureStore(
+        default_store_dir(test_set_dir), PREDICTION_WINDOW_MONTHS
+    )
+    feature_store.update(test_set_dir)
 
     # ---------------------------------
     # START PROCESSING TEST SET INPUTS
     # Beep boop bop you should do something with test inputs unlike this script.
 
-    # In lieu of doing something test inputs, maybe you "learned" from training data that
-    #  30% of accounts are charge-off across all periods (not true), so you randomly 
-    #  guess with that percentage.
-    co_percent = 0.3
-    agents = list(set(account_state_df.agent_id).union(set(payments_df.agent_id)).union(set(transactions_df.agent_id)))
+    # One row per agent seen in any log.
+    features_df = feature_store.features()
+    agents = list(features_df.index)
     col_names = {months: f"charge_off_within_{months}_months" for months in PREDICTION_WINDOW_MONTHS}
     output_df = pd.DataFrame(columns=["agent_id"] + list(col_names.values()))
     output_df["agent_id"] = agents
-    for months in PREDICTION_WINDOW_MONTHS:
-        col_name = col_names[months]
-        preds = np.array(
-            [1]*int(co_percent * len(agents)) +
-            [0]*int((1 - co_percent) * len(agents))
-        )
-        # When unsure of whether their predictions span the entire set of agents to predict
-        #  for, the true data scientist pads their predictions with zeros lol.
-        preds = np.append(preds, [0]*(len(agents) - len(preds)))
-        np.random.shuffle(preds)
-        output_df[col_name] = preds
+    if os.path.isfile(os.path.join(MODEL_DIR, "meta.json")):
+        # Fitted ahead of time by train.py, so inference is just feature updates plus one
+        #  matrix product per batch of agents.
+        model = load_model(MODEL_DIR)
+        preds = predict(model, features_df)
+        for i, col_name in enumerate(model.target_names):
+            output_df[col_name] = preds[:, i]
+    else:
+        # In lieu of a trained model, maybe you "learned" from training data that 30% of
+        #  accounts are charge-off across all periods (not true), so you randomly guess
+        #  with that percentage.
+        co_percent = 0.3
+        for months in PREDICTION_WINDOW_MONTHS:
+            col_name = col_names[months]
+            preds = np.array(
+                [1]*int(co_percent * len(agents)) +
+                [0]*int((1 - co_percent) * len(agents))
+            )
+            # When unsure of whether their predictions span the entire set of agents to
+            #  predict for, the true data scientist pads their predictions with zeros lol.
+            preds = np.append(preds, [0]*(len(agents) - len(preds)))
+            np.random.shuffle(preds)
+            output_df[col_name] = preds
 
     # END PROCESSING TEST SET INPUTS
     # ---------------------------------
@@ -0,0 +1,74 @@
+"""Confusion-matrix metric engine shared by the grading scripts.
+
+TP/FP/FN/TN are counted for every prediction column in one vectorized pass over an
+(n_rows, n_cols) block, and each metric is a cheap function of those counts. Adding a metric
+to a grading script's `metrics` table therefore costs nothing per row.
+"""
+from typing import NamedTuple
+
+import numpy as np
+
+
+class ConfusionCounts(NamedTuple):
+    """Per-column confusion-matrix counts, each an int64 array of shape (n_cols,)."""
+    tp: np.ndarray
+    fp: np.ndarray
+    fn: np.ndarray
+    tn: np.ndarray
+
+
+def confusion_counts(labels: np.ndarray, preds: np.ndarray) -> ConfusionCounts:
+    """Count TP/FP/FN/TN per column of aligned 0/1 label and prediction blocks.
+
+    :param labels: (n_rows, n_cols) block of 0/1 labels
+    :type labels: np.ndarray
+    :param preds: (n_rows, n_cols) block of 0/1 predictions, row-aligned with `labels`
+    :type preds: np.ndarray
+    :return: Confusion counts per column
+    :rtype: ConfusionCounts
+    """
+    assert labels.shape == preds.shape, f"{labels.shape=} != {preds.shape=}"
+    labels = labels.astype(bool, copy=False)
+    preds = preds.astype(bool, copy=False)
+    tp = np.count_nonzero(labels & preds, axis=0)
+    fp = np.count_nonzero(preds, axis=0) - tp
+    fn = np.count_nonzero(labels, axis=0) - tp
+    tn = labels.shape[0] - tp - fp - fn
+    return ConfusionCounts(tp, fp, fn, tn)
+
+
+def _safe_divide(numerator: np.ndarray, denominator: np.ndarray) -> np.ndarray:
+    # Matches sklearn's zero_division behavior: an undefined metric scores 0.
+    numerator = np.asarray(numerator, dtype=np.float64)
+    denominator = np.asarray(denominator, dtype=np.float64)
+    return np.divide(
+        numerator,
+        denominator,
+        out=np.zeros(np.broadcast(numerator, denominator).shape),
+        where=denominator != 0,
+    )
+
+
+def f1(counts: ConfusionCounts) -> np.ndarray:
+    """F1 score per column, as `sklearn.metrics.f1_score` computes it."""
+    return _safe_divide(2 * counts.tp, 2 * counts.tp + counts.fp + counts.fn)
+
+
+def precision(counts: ConfusionCounts) -> np.ndarray:
+    """Precision per column, as `sklearn.metrics.precision_score` computes it."""
+    return _safe_divide(counts.tp, counts.tp + counts.fp)
+
+
+def recall(counts: ConfusionCounts) -> np.ndarray:
+    """Recall per column, as `sklearn.metrics.recall_score` computes it."""
+    return _safe_divide(counts.tp, counts.tp + counts.fn)
+
+
+def mcc(counts: ConfusionCounts) -> np.ndarray:
+    """Matthews correlation coefficient per column, as sklearn's `matthews_corrcoef`."""
+    # Float before multiplying: products of four counts overflow int64 at scale.
+    tp, fp, fn, tn = (np.asarray(count, dtype=np.float64) for count in counts)
+    return _safe_divide(
+        tp * tn - fp * fn,
+        np.sqrt((tp + fp) * (tp + fn) * (tn + fp) * (tn + fn)),
+    )
@@ -0,0 +1,512 @@
+"""Incremental feature store for the append-only synthcc event logs.
+
+`build_features` rescans every log on each call. The store instead keeps, per agent, the
+running aggregates those features are made of (counts, sums, maxima, latest account state,
+last event time) and, per log file, how many bytes of it have been ingested plus the latest
+event time seen (its high-water mark). `FeatureStore.update` then parses only the text
+appended since the last run and folds it into the aggregates.
+
+Rolling-window features cannot be kept as running sums, because their windows move as the
+logs grow. The store keeps the raw (agent, time, amount) events that are still within the
+longest window of the newest event instead. They are written to append-only segment files,
+one per update holding the events it ingested, so an update writes only what it ingested;
+a segment is deleted once its newest event can no longer fall in any window.
+`FeatureStore.features` therefore returns the same matrix as `build_features` over the
+full logs, up to float summation order.
+
+If a log was rewritten rather than appended to (it shrank, its header changed, or the bytes
+just before the ingested offset or sampled across the rest of the ingested part changed),
+the whole store is rebuilt from the logs. A log whose size and mtime are those it had when
+it was last ingested is not re-read for this check.
+"""
+import hashlib
+import io
+import os
+import pickle
+import tempfile
+from typing import Dict, List, Sequence
+
+import numpy as np
+import pandas as pd
+
+from features import (
+    ACCOUNT_STATE_COLS,
+    DEFAULT_WINDOWS_MONTHS,
+    NEVER_NS,
+    bincount_2d,
+    days_since,
+    window_buckets,
+    windowed_features,
+)
+from schemas import read_options
+from status_encoding import (
+    account_status_codes,
+    combine_status_transitions,
+    status_transition_features,
+    status_transitions,
+)
+
+
+# Bump when the pickled state layout changes so stale stores are rebuilt, not misread.
+STORE_FORMAT_VERSION = 3
+DEFAULT_STORE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "bth-feature-store")
+LOG_NAMES = ("account_state_log", "payments_log", "transactions_log")
+# Bytes just before the ingested offset that are re-hashed to detect rewritten logs, and
+#  the blocks sampled evenly across the rest of the ingested part that are hashed with them.
+FINGERPRINT_BYTES = 64 * 2**10
+FINGERPRINT_SAMPLES = 64
+FINGERPRINT_SAMPLE_BYTES = 4 * 2**10
+CHUNK_SIZE = 1_000_000
+# How each log's per-agent running aggregates combine across chunks and runs.
+TRANSACTION_AGGREGATES = {
+    "count": "sum", "total": "sum", "approved": "sum", "online": "sum", "last_ns": "max"
+}
+PAYMENT_AGGREGATES = {"count": "sum", "total": "sum", "last_ns": "max"}
+ACCOUNT_STATE_AGGREGATES = {"max_missed": "max", "delinquent": "sum"}
+# Raw events kept in segment files for the rolling windows, and their columns.
+RECENT_EVENT_COLUMNS = {
+    "recent_transactions": ["agent_id", "timestamp", "amount"],
+    "recent_payments": ["agent_id", "timestamp", "amount"],
+    "recent_delinquent": ["agent_id", "timestamp"],
+}
+
+
+def default_store_dir(test_set_dir: str) -> str:
+    """Return the store directory for a test set: $BTH_FEATURE_STORE_DIR or ~/.cache, keyed
+    by the test set's absolute path.
+    """
+    root = os.environ.get("BTH_FEATURE_STORE_DIR", DEFAULT_STORE_DIR)
+    key = hashlib.sha1(os.path.abspath(test_set_dir).encode()).hexdigest()[:16]
+    return os.path.join(root, key)
+
+
+def _fingerprint(f: io.BufferedReader, offset: int) -> str:
+    sha1 = hashlib.sha1()
+    tail_start = max(0, offset - FINGERPRINT_BYTES)
+    for i in range(FINGERPRINT_SAMPLES):
+        start = tail_start * i // FINGERPRINT_SAMPLES
+        f.seek(start)
+        sha1.update(f.read(min(FINGERPRINT_SAMPLE_BYTES, tail_start - start)))
+    f.seek(tail_start)
+    sha1.update(f.read(offset - tail_start))
+    return sha1.hexdigest()
+
+
+def _combine(old: pd.DataFrame, new: pd.DataFrame, how: Dict[str, str]) -> pd.DataFrame:
+    # Both frames are indexed by agent_id; the result has one row per agent.
+    return pd.concat([old, new]).groupby(level=0).agg(how)
+
+
+def _empty_aggregates(columns: Sequence[str]) -> pd.DataFrame:
+    return pd.DataFrame(
+        {col_name: pd.Series(dtype=np.float64) for col_name in columns},
+        index=pd.Index([], dtype=np.int32, name="agent_id"),
+    )
+
+
+def _empty_events(columns: Sequence[str]) -> pd.DataFrame:
+    dtypes = {"agent_id": np.int32, "timestamp": "datetime64[ns]", "amount": np.float64}
+    return pd.DataFrame(
+        {col_name: pd.Series(dtype=dtypes[col_name]) for col_name in columns}
+    )
+
+
+class FeatureStore:
+    """Per-agent running aggregates over the synthcc logs, persisted between runs.
+
+    :param store_dir: Directory the store is saved to and loaded from
+    :type store_dir: str
+    :param windows_months: Rolling-window lengths in months, ascending
+    :type windows_months: Sequence[int]
+    """
+
+    def __init__(
+            self,
+            store_dir: str,
+            windows_months: Sequence[int] = DEFAULT_WINDOWS_MONTHS,
+        ):
+        self.store_dir = store_dir
+        self.windows_months = tuple(windows_months)
+        self._state = self._load()
+        # Events ingested by the current update, written to new segments when it ends.
+        self._pending_events: Dict[str, List[pd.DataFrame]] = {}
+
+    @property
+    def _state_path(self) -> str:
+        return os.path.join(self.store_dir, "state.pkl")
+
+    @property
+    def _segments_dir(self) -> str:
+        return os.path.join(self.store_dir, "segments")
+
+    def _new_state(self) -> dict:
+        return {
+            "version": STORE_FORMAT_VERSION,
+            "windows_months": self.windows_months,
+            # Per log: bytes ingested, header, fingerprint, size and mtime when ingested,
+            #  and latest event time in ns.
+            "logs": {},
+            "transactions": _empty_aggregates(TRANSACTION_AGGREGATES),
+            "category_spend": _empty_aggregates([]),
+            "payments": _empty_aggregates(PAYMENT_AGGREGATES),
+            "latest_account_state": _empty_aggregates(["last_ns"] + ACCOUNT_STATE_COLS),
+            "account_state": _empty_aggregates(ACCOUNT_STATE_AGGREGATES),
+            "status_transitions": _empty_aggregates([]),
+            # Per kind of recent event: its segment files' names and newest event times.
+            "segments": {key: [] for key in RECENT_EVENT_COLUMNS},
+        }
+
+    def _load(self) -> dict:
+        try:
+            with open(self._state_path, "rb") as f:
+                state = pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return self._new_state()
+        if (
+            state.get("version") != STORE_FORMAT_VERSION
+            or state.get("windows_months") != self.windows_months
+            or not all(
+                os.path.isfile(os.path.join(self._segments_dir, segment["name"]))
+                for segments in state["segments"].values()
+                for segment in segments
+            )
+        ):
+            return self._new_state()
+        return state
+
+    def _save(self):
+        # Segments are written before the state that lists them, and unlisted ones are
+        #  removed after it, so a crash at any point leaves a consistent store.
+        os.makedirs(self.store_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.store_dir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(self._state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self._state_path)
+        listed = {
+            segment["name"]
+            for segments in self._state["segments"].values()
+            for segment in segments
+        }
+        for name in os.listdir(self._segments_dir):
+            if name not in listed:
+                os.remove(os.path.join(self._segments_dir, name))
+
+    def _is_appended(self, log_path: str, log_state: dict) -> bool:
+        """Whether the log still starts with the bytes this store has ingested."""
+        stat = os.stat(log_path)
+        if (stat.st_size, stat.st_mtime_ns) == (log_state["size"], log_state["mtime_ns"]):
+            # Untouched since it was ingested.
+            return True
+        if stat.st_size < log_state["offset"]:
+            return False
+        with open(log_path, "rb") as f:
+            if f.readline() != log_state["header"]:
+                return False
+            return _fingerprint(f, log_state["offset"]) == log_state["fingerprint"]
+
+    def update(self, test_set_dir: str) -> Dict[str, int]:
+        """Ingest the rows appended to each log since the last update, then save the store.
+
+        :param test_set_dir: Directory holding the three synthcc log CSVs
+        :type test_set_dir: str
+        :return: Number of new rows ingested per log
+        :rtype: Dict[str, int]
+        """
+        log_paths = {
+            log_name: os.path.join(test_set_dir, f"{log_name}.csv")
+            for log_name in LOG_NAMES
+        }
+        for log_path in log_paths.values():
+            assert os.path.isfile(log_path), f"{log_path=} is not a file."
+        if not all(
+            self._is_appended(log_paths[log_name], log_state)
+            for log_name, log_state in self._state["logs"].items()
+        ):
+            self._state = self._new_state()
+
+        self._pending_events = {key: [] for key in RECENT_EVENT_COLUMNS}
+        n_new_rows = {
+            log_name: self._ingest_log(log_name, log_path)
+            for log_name, log_path in log_paths.items()
+        }
+        self._write_segments()
+        self._save()
+        return n_new_rows
+
+    def _ingest_log(self, log_name: str, log_path: str) -> int:
+        log_state = self._state["logs"].get(log_name)
+        with open(log_path, "rb") as f:
+            header = f.readline()
+            offset = log_state["offset"] if log_state else len(header)
+            f.seek(offset)
+            text = f.read()
+            # Stop at the last complete line in case a writer is mid-append.
+            text = text[:text.rfind(b"\n") + 1]
+            new_offset = offset + len(text)
+            fingerprint = _fingerprint(f, new_offset)
+            stat = os.fstat(f.fileno())
+
+        high_water_mark = log_state["high_water_mark"] if log_state else NEVER_NS
+        n_rows = 0
+        if text:
+            column_names = pd.read_csv(io.BytesIO(header), nrows=0).columns
+            # Strings stay str: each chunk would otherwise get its own categories.
+            dtypes, parse_dates = read_options(log_name, column_names, strings_as=str)
+            chunks = pd.read_csv(
+                io.BytesIO(text),
+                header=None,
+                names=column_names,
+                dtype=dtypes,
+                parse_dates=parse_dates,
+                chunksize=CHUNK_SIZE,
+            )
+            ingest_chunk = getattr(self, f"_ingest_{log_name}")
+            for chunk in chunks:
+                ingest_chunk(chunk)
+                high_water_mark = max(
+                    high_water_mark, chunk["timestamp"].max().value
+                )
+                n_rows += len(chunk)
+
+        self._state["logs"][log_name] = {
+            "offset": new_offset,
+            "header": header,
+            "fingerprint": fingerprint,
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "high_water_mark": high_water_mark,
+        }
+        return n_rows
+
+    def _append_events(self, key: str, events: pd.DataFrame):
+        self._pending_events[key].append(events)
+
+    def _ingest_transactions_log(self, chunk: pd.DataFrame):
+        rows = pd.DataFrame({
+            "agent_id": chunk["agent_id"],
+            "count": 1.0,
+            "total": chunk["amount"].astype(np.float64),
+            "approved": (chunk["status"] == "approved").astype(np.float64),
+            "online": chunk["online"].astype(np.float64),
+            "last_ns": chunk["timestamp"].to_numpy(dtype="datetime64[ns]").view(np.int64),
+        })
+        self._state["transactions"] = _combine(
+            self._state["transactions"],
+            rows.groupby("agent_id").agg(TRANSACTION_AGGREGATES),
+            TRANSACTION_AGGREGATES,
+        )
+        category_spend = chunk.groupby(["agent_id", "merchant_category"])["amount"].sum()
+        self._state["category_spend"] = (
+            self._state["category_spend"]
+            .add(category_spend.unstack(fill_value=0.0), fill_value=0.0)
+            .fillna(0.0)
+            .sort_index(axis=1)
+        )
+        self._append_events(
+            "recent_transactions", chunk[["agent_id", "timestamp", "amount"]]
+        )
+
+    def _ingest_payments_log(self, chunk: pd.DataFrame):
+        rows = pd.DataFrame({
+            "agent_id": chunk["agent_id"],
+            "count": 1.0,
+            "total": chunk["amount"].astype(np.float64),
+            "last_ns": chunk["timestamp"].to_numpy(dtype="datetime64[ns]").view(np.int64),
+        })
+        self._state["payments"] = _combine(
+            self._state["payments"],
+            rows.groupby("agent_id").agg(PAYMENT_AGGREGATES),
+            PAYMENT_AGGREGATES,
+        )
+        self._append_events("recent_payments", chunk[["agent_id", "timestamp", "amount"]])
+
+    def _ingest_account_state_log(self, chunk: pd.DataFrame):
+        # Latest snapshot per agent. Stable sorts keep file order among equal timestamps,
+        #  so later rows (and later chunks) win ties as they do in build_features.
+        snapshots = pd.DataFrame({
+            "agent_id": chunk["agent_id"],
+            "last_ns": chunk["timestamp"].to_numpy(dtype="datetime64[ns]").view(np.int64),
+        })
+        for col_name in ACCOUNT_STATE_COLS:
+            snapshots[col_name] = chunk[col_name].astype(np.float64)
+        latest = pd.concat(
+            [self._state["latest_account_state"].reset_index(), snapshots],
+            ignore_index=True,
+        )
+        order = np.lexsort((latest["last_ns"].to_numpy(), latest["agent_id"].to_numpy()))
+        latest = latest.iloc[order].drop_duplicates("agent_id", keep="last")
+        self._state["latest_account_state"] = latest.set_index("agent_id")
+
+        missed_payments = chunk["current_missed_payments"].astype(np.float64)
+        rows = pd.DataFrame({
+            "agent_id": chunk["agent_id"],
+            "max_missed": missed_payments,
+            "delinquent": (missed_payments > 0).astype(np.float64),
+        })
+        self._state["account_state"] = _combine(
+            self._state["account_state"],
+            rows.groupby("agent_id").agg(ACCOUNT_STATE_AGGREGATES),
+            ACCOUNT_STATE_AGGREGATES,
+        )
+        self._append_events(
+            "recent_delinquent", chunk.loc[missed_payments > 0, ["agent_id", "timestamp"]]
+        )
+        # Appended snapshots follow the ingested ones, so their summaries chain.
+        self._state["status_transitions"] = combine_status_transitions(
+            self._state["status_transitions"],
+            status_transitions(
+                chunk["agent_id"].to_numpy(),
+                chunk["timestamp"],
+                account_status_codes(chunk),
+            ),
+        )
+
+    def as_of(self) -> pd.Timestamp:
+        """Return the latest event time across logs, which rolling windows end at."""
+        high_water_marks = [
+            log_state["high_water_mark"] for log_state in self._state["logs"].values()
+        ]
+        assert high_water_marks and max(high_water_marks) != NEVER_NS, \
+            "The feature store has not ingested any events."
+        return pd.Timestamp(max(high_water_marks))
+
+    def _write_segments(self):
+        """Write the events ingested by this update to new segments, and drop the segments
+        whose events have all expired.
+        """
+        # as_of only moves forward as logs grow, so events before the longest window's start
+        #  can never be in a window again.
+        window_start = self.as_of() - pd.DateOffset(months=max(self.windows_months))
+        os.makedirs(self._segments_dir, exist_ok=True)
+        for key, pending_events in self._pending_events.items():
+            segments = [
+                segment for segment in self._state["segments"][key]
+                if segment["max_ns"] >= window_start.value
+            ]
+            events = pd.concat(
+                [_empty_events(RECENT_EVENT_COLUMNS[key]), *pending_events],
+                ignore_index=True,
+            )
+            events = events[events["timestamp"] >= window_start].reset_index(drop=True)
+            if len(events) > 0:
+                # A fresh name, so no segment listed by the saved state is ever overwritten.
+                fd, path = tempfile.mkstemp(
+                    dir=self._segments_dir, prefix=f"{key}-", suffix=".pkl"
+                )
+                with os.fdopen(fd, "wb") as f:
+                    pickle.dump(events, f, protocol=pickle.HIGHEST_PROTOCOL)
+                segments.append({
+                    "name": os.path.basename(path),
+                    "max_ns": events["timestamp"].max().value,
+                })
+            self._state["segments"][key] = segments
+        self._pending_events = {}
+
+    def _recent_events(self, key: str) -> pd.DataFrame:
+        """Load the events of every segment of one kind. Some may have left every window."""
+        events = [_empty_events(RECENT_EVENT_COLUMNS[key])]
+        for segment in self._state["segments"][key]:
+            with open(os.path.join(self._segments_dir, segment["name"]), "rb") as f:
+                events.append(pickle.load(f))
+        return pd.concat(events, ignore_index=True)
+
+    def _windowed_features(
+            self,
+            prefix: str,
+            aggregates: pd.DataFrame,
+            recent_events: pd.DataFrame,
+            agent_index: pd.Index,
+            as_of: pd.Timestamp,
+        ) -> Dict[str, np.ndarray]:
+        features = windowed_features(
+            prefix,
+            agent_index.get_indexer(recent_events["agent_id"]),
+            window_buckets(recent_events["timestamp"], as_of, self.windows_months),
+            recent_events["amount"].to_numpy(dtype=np.float64),
+            len(agent_index),
+            self.windows_months,
+        )
+        # Only the windows come from recent events; overall totals are running sums.
+        aggregates = aggregates.reindex(agent_index)
+        counts = aggregates["count"].fillna(0.0).to_numpy()
+        totals = aggregates["total"].fillna(0.0).to_numpy()
+        features[f"{prefix}_count"] = counts
+        features[f"{prefix}_total"] = totals
+        features[f"{prefix}_mean"] = np.divide(
+            totals, counts, out=np.zeros(len(agent_index)), where=counts > 0
+        )
+        return features
+
+    def features(self) -> pd.DataFrame:
+        """Build the agent x feature matrix from the store, as `build_features` would from
+        the ingested logs.
+
+        :return: float32 features, one row per agent in any log, indexed by sorted agent_id
+        :rtype: pd.DataFrame
+        """
+        state = self._state
+        as_of = self.as_of()
+        agent_index = (
+            state["transactions"].index
+            .union(state["payments"].index)
+            .union(state["account_state"].index)
+            .rename("agent_id")
+        )
+        n_agents = len(agent_index)
+
+        transactions = state["transactions"].reindex(agent_index)
+        features = self._windowed_features(
+            "spend", transactions, self._recent_events("recent_transactions"), agent_index,
+            as_of,
+        )
+        txn_counts = np.maximum(features["spend_count"], 1)
+        features["approved_rate"] = (
+            transactions["approved"].fillna(0.0).to_numpy() / txn_counts
+        )
+        features["online_rate"] = transactions["online"].fillna(0.0).to_numpy() / txn_counts
+        features["days_since_last_transaction"] = days_since(
+            transactions["last_ns"].fillna(NEVER_NS).to_numpy(dtype=np.int64), as_of
+        )
+        category_spend = state["category_spend"].reindex(agent_index, fill_value=0.0)
+        total_spend = np.maximum(features["spend_total"], np.finfo(np.float64).tiny)
+        for category in category_spend.columns:
+            features[f"spend_share_{category}"] = (
+                category_spend[category].to_numpy() / total_spend
+            )
+
+        payments = state["payments"].reindex(agent_index)
+        features.update(self._windowed_features(
+            "payment", payments, self._recent_events("recent_payments"), agent_index, as_of
+        ))
+        features["days_since_last_payment"] = days_since(
+            payments["last_ns"].fillna(NEVER_NS).to_numpy(dtype=np.int64), as_of
+        )
+
+        latest = state["latest_account_state"].reindex(agent_index)
+        for col_name in ACCOUNT_STATE_COLS:
+            features[f"latest_{col_name}"] = latest[col_name].to_numpy(dtype=np.float64)
+        account_state = state["account_state"].reindex(agent_index, fill_value=0.0)
+        features["max_missed_payments"] = account_state["max_missed"].to_numpy()
+        features["delinquent_snapshots"] = account_state["delinquent"].to_numpy()
+        recent_delinquent = self._recent_events("recent_delinquent")
+        delinquent_counts = np.cumsum(
+            bincount_2d(
+                agent_index.get_indexer(recent_delinquent["agent_id"]),
+                window_buckets(recent_delinquent["timestamp"], as_of, self.windows_months),
+                n_agents,
+                len(self.windows_months) + 1,
+            ),
+            axis=1,
+        )
+        for i, months in enumerate(self.windows_months):
+            features[f"delinquent_snapshots_{months}m"] = delinquent_counts[:, i]
+
+        features.update(
+            status_transition_features(state["status_transitions"], agent_index)
+        )
+
+        spend = features["spend_total"]
+        features["payment_to_spend_ratio"] = np.divide(
+            features["payment_total"], spend, out=np.zeros(n_agents), where=spend > 0
+        )
+        return pd.DataFrame(features, index=agent_index).astype(np.float32)
@@ -0,0 +1,303 @@
+"""Per-agent feature matrix built from the synthcc event logs.
+
+Every log is reduced in a single linear pass: each row is mapped to an (agent, bucket) code
+and aggregated with `np.bincount`, so the cost grows linearly with log size instead of with
+agents x rows as it does when filtering the log once per agent. Rolling-window aggregates
+come from the same pass: each row is assigned to the narrowest prediction window that
+contains it, and cumulative sums over those buckets give the 3/6/9/12-month totals.
+"""
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from status_encoding import (
+    account_status_codes, status_transition_features, status_transitions
+)
+
+
+DEFAULT_WINDOWS_MONTHS = (3, 6, 9, 12)
+ACCOUNT_STATE_COLS = [
+    "credit_balance",
+    "credit_utilization",
+    "interest_rate",
+    "min_payment_factor",
+    "current_missed_payments",
+]
+
+
+def timestamps_of(log: pd.DataFrame) -> pd.Series:
+    # Logs loaded through the columnar cache already hold datetime64; plain read_csv
+    #  output holds strings.
+    return pd.to_datetime(log["timestamp"])
+
+
+def log_end(*logs: pd.DataFrame) -> pd.Timestamp:
+    """Return the latest timestamp across logs, i.e. the time predictions are made from."""
+    return max(timestamps_of(log).max() for log in logs if len(log) > 0)
+
+
+def window_buckets(
+        timestamps: pd.Series,
+        as_of: pd.Timestamp,
+        windows_months: Sequence[int] = DEFAULT_WINDOWS_MONTHS,
+    ) -> np.ndarray:
+    """Index of the narrowest window (in ascending `windows_months`) holding each event.
+
+    Events in the most recent `windows_months[0]` months get bucket 0, and so on. Events
+    older than every window get bucket `len(windows_months)`.
+
+    :param timestamps: Event times
+    :type timestamps: pd.Series
+    :param as_of: Time that windows end at
+    :type as_of: pd.Timestamp
+    :param windows_months: Window lengths in months, ascending
+    :type windows_months: Sequence[int]
+    :return: int8 bucket per event
+    :rtype: np.ndarray
+    """
+    # Window starts, oldest first, so searchsorted counts the starts at or before an event.
+    window_starts = np.array(
+        [as_of - pd.DateOffset(months=months) for months in reversed(windows_months)],
+        dtype="datetime64[ns]",
+    )
+    n_starts_before = np.searchsorted(
+        window_starts, timestamps.to_numpy(dtype="datetime64[ns]"), side="right"
+    )
+    return (len(windows_months) - n_starts_before).astype(np.int8)
+
+
+def bincount_2d(
+        agent_codes: np.ndarray,
+        bucket_codes: np.ndarray,
+        n_agents: int,
+        n_buckets: int,
+        weights: Optional[np.ndarray] = None,
+    ) -> np.ndarray:
+    flat_codes = agent_codes.astype(np.int64) * n_buckets + bucket_codes
+    counts = np.bincount(flat_codes, weights=weights, minlength=n_agents * n_buckets)
+    return counts.reshape(n_agents, n_buckets)
+
+
+def windowed_features(
+        prefix: str,
+        agent_codes: np.ndarray,
+        buckets: np.ndarray,
+        amounts: np.ndarray,
+        n_agents: int,
+        windows_months: Sequence[int],
+    ) -> Dict[str, np.ndarray]:
+    n_buckets = len(windows_months) + 1
+    bucket_counts = bincount_2d(agent_codes, buckets, n_agents, n_buckets)
+    bucket_sums = bincount_2d(agent_codes, buckets, n_agents, n_buckets, amounts)
+    window_counts = np.cumsum(bucket_counts, axis=1)
+    window_sums = np.cumsum(bucket_sums, axis=1)
+
+    features = {
+        f"{prefix}_count": window_counts[:, -1],
+        f"{prefix}_total": window_sums[:, -1],
+        f"{prefix}_mean": np.divide(
+            window_sums[:, -1],
+            window_counts[:, -1],
+            out=np.zeros(n_agents),
+            where=window_counts[:, -1] > 0,
+        ),
+    }
+    for i, months in enumerate(windows_months):
+        features[f"{prefix}_count_{months}m"] = window_counts[:, i]
+        features[f"{prefix}_total_{months}m"] = window_sums[:, i]
+        # Monthly rate, comparable across windows of different lengths.
+        features[f"{prefix}_rate_{months}m"] = window_sums[:, i] / months
+    return features
+
+
+# Stands in for "no event yet" in int64 nanosecond timestamps.
+NEVER_NS = np.iinfo(np.int64).min
+
+
+def days_since(last_ns: np.ndarray, as_of: pd.Timestamp) -> np.ndarray:
+    # Agents with no events get NaN, which downstream models can treat as missing.
+    days = (as_of.value - last_ns) / (24 * 3600 * 1e9)
+    days[last_ns == NEVER_NS] = np.nan
+    return days
+
+
+def _days_since_last(
+        agent_codes: np.ndarray,
+        timestamps: pd.Series,
+        as_of: pd.Timestamp,
+        n_agents: int,
+    ) -> np.ndarray:
+    last_ns = np.full(n_agents, NEVER_NS)
+    event_ns = timestamps.to_numpy(dtype="datetime64[ns]").view(np.int64)
+    np.maximum.at(last_ns, agent_codes, event_ns)
+    return days_since(last_ns, as_of)
+
+
+def transaction_features(
+        transactions_df: pd.DataFrame,
+        agent_index: pd.Index,
+        as_of: pd.Timestamp,
+        windows_months: Sequence[int] = DEFAULT_WINDOWS_MONTHS,
+    ) -> Dict[str, np.ndarray]:
+    """Spend totals, counts and rates, approval/online rates, and merchant-category mix."""
+    n_agents = len(agent_index)
+    agent_codes = agent_index.get_indexer(transactions_df["agent_id"])
+    timestamps = timestamps_of(transactions_df)
+    amounts = transactions_df["amount"].to_numpy(dtype=np.float64)
+    buckets = window_buckets(timestamps, as_of, windows_months)
+
+    features = windowed_features(
+        "spend", agent_codes, buckets, amounts, n_agents, windows_months
+    )
+    txn_counts = np.maximum(features["spend_count"], 1)
+    is_approved = (transactions_df["status"] == "approved").to_numpy(dtype=np.float64)
+    features["approved_rate"] = np.bincount(
+        agent_codes, weights=is_approved, minlength=n_agents
+    ) / txn_counts
+    features["online_rate"] = np.bincount(
+        agent_codes,
+        weights=transactions_df["online"].to_numpy(dtype=np.float64),
+        minlength=n_agents,
+    ) / txn_counts
+    features["days_since_last_transaction"] = _days_since_last(
+        agent_codes, timestamps, as_of, n_agents
+    )
+
+    # Share of each agent's spend going to each merchant category.
+    categories = transactions_df["merchant_category"].astype("category")
+    category_codes = categories.cat.codes.to_numpy()
+    has_category = category_codes >= 0
+    category_spend = bincount_2d(
+        agent_codes[has_category],
+        category_codes[has_category],
+        n_agents,
+        len(categories.cat.categories),
+        amounts[has_category],
+    )
+    total_spend = np.maximum(features["spend_total"], np.finfo(np.float64).tiny)
+    for i, category in enumerate(categories.cat.categories):
+        features[f"spend_share_{category}"] = category_spend[:, i] / total_spend
+    return features
+
+
+def payment_features(
+        payments_df: pd.DataFrame,
+        agent_index: pd.Index,
+        as_of: pd.Timestamp,
+        windows_months: Sequence[int] = DEFAULT_WINDOWS_MONTHS,
+    ) -> Dict[str, np.ndarray]:
+    """Payment totals, counts and rates, overall and per rolling window."""
+    agent_codes = agent_index.get_indexer(payments_df["agent_id"])
+    timestamps = timestamps_of(payments_df)
+    features = windowed_features(
+        "payment",
+        agent_codes,
+        window_buckets(timestamps, as_of, windows_months),
+        payments_df["amount"].to_numpy(dtype=np.float64),
+        len(agent_index),
+        windows_months,
+    )
+    features["days_since_last_payment"] = _days_since_last(
+        agent_codes, timestamps, as_of, len(agent_index)
+    )
+    return features
+
+
+def account_state_features(
+        account_state_df: pd.DataFrame,
+        agent_index: pd.Index,
+        as_of: pd.Timestamp,
+        windows_months: Sequence[int] = DEFAULT_WINDOWS_MONTHS,
+    ) -> Dict[str, np.ndarray]:
+    """Latest account state plus delinquency (missed-payment) counts per rolling window."""
+    n_agents = len(agent_index)
+    agent_codes = agent_index.get_indexer(account_state_df["agent_id"])
+    timestamps = timestamps_of(account_state_df)
+
+    # One sort by (agent, time) finds every agent's latest snapshot.
+    order = np.lexsort((timestamps.to_numpy(), agent_codes))
+    sorted_codes = agent_codes[order]
+    is_last = np.append(sorted_codes[1:] != sorted_codes[:-1], True)
+    last_rows = order[is_last]
+    last_codes = sorted_codes[is_last]
+
+    features = {}
+    for col_name in ACCOUNT_STATE_COLS:
+        latest = np.full(n_agents, np.nan)
+        values = account_state_df[col_name].to_numpy(dtype=np.float64)
+        latest[last_codes] = values[last_rows]
+        features[f"latest_{col_name}"] = latest
+
+    missed_payments = account_state_df["current_missed_payments"].to_numpy(
+        dtype=np.float64
+    )
+    max_missed = np.zeros(n_agents)
+    np.maximum.at(max_missed, agent_codes, missed_payments)
+    features["max_missed_payments"] = max_missed
+
+    n_buckets = len(windows_months) + 1
+    buckets = window_buckets(timestamps, as_of, windows_months)
+    delinquent_counts = np.cumsum(
+        bincount_2d(
+            agent_codes, buckets, n_agents, n_buckets, (missed_payments > 0).astype(float)
+        ),
+        axis=1,
+    )
+    features["delinquent_snapshots"] = delinquent_counts[:, -1]
+    for i, months in enumerate(windows_months):
+        features[f"delinquent_snapshots_{months}m"] = delinquent_counts[:, i]
+    return features
+
+
+def build_features(
+        account_state_df: pd.DataFrame,
+        payments_df: pd.DataFrame,
+        transactions_df: pd.DataFrame,
+        windows_months: Sequence[int] = DEFAULT_WINDOWS_MONTHS,
+        as_of: Optional[pd.Timestamp] = None,
+    ) -> pd.DataFrame:
+    """Build the agent x feature matrix from the three synthcc logs.
+
+    :param account_state_df: account_state_log
+    :type account_state_df: pd.DataFrame
+    :param payments_df: payments_log
+    :type payments_df: pd.DataFrame
+    :param transactions_df: transactions_log
+    :type transactions_df: pd.DataFrame
+    :param windows_months: Rolling-window lengths in months, ascending
+    :type windows_months: Sequence[int]
+    :param as_of: Time that rolling windows end at. Defaults to the end of the logs.
+    :type as_of: Optional[pd.Timestamp]
+    :return: float32 features, one row per agent in any log, indexed by sorted agent_id
+    :rtype: pd.DataFrame
+    """
+    logs = (account_state_df, payments_df, transactions_df)
+    if as_of is None:
+        as_of = log_end(*logs)
+    agent_index = pd.Index(
+        np.unique(np.concatenate([log["agent_id"].to_numpy() for log in logs])),
+        name="agent_id",
+    )
+
+    features = {}
+    features.update(
+        transaction_features(transactions_df, agent_index, as_of, windows_months)
+    )
+    features.update(payment_features(payments_df, agent_index, as_of, windows_months))
+    features.update(
+        account_state_features(account_state_df, agent_index, as_of, windows_months)
+    )
+    features.update(status_transition_features(
+        status_transitions(
+            account_state_df["agent_id"].to_numpy(),
+            timestamps_of(account_state_df),
+            account_status_codes(account_state_df),
+        ),
+        agent_index,
+    ))
+    spend = features["spend_total"]
+    features["payment_to_spend_ratio"] = np.divide(
+        features["payment_total"], spend, out=np.zeros(len(agent_index)), where=spend > 0
+    )
+    return pd.DataFrame(features, index=agent_index).astype(np.float32)
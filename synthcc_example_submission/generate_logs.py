@@ -0,0 +1,355 @@
+"""Generate synthcc-like event logs and labels at any scale, for load-testing locally.
+
+Writes account_state_log.csv, payments_log.csv, transactions_log.csv and labels.csv with the
+train set's schemas, e.g. to run `train.py`, `__main__.py` or the EDA plots on millions of
+agents and billions of events.
+
+Agents are simulated week by week, all at once with NumPy, one block of agents at a time:
+- Each agent has a spending rate and amount scale, a favourite merchant category, an
+    online propensity, a credit limit, and a payment cadence (weekly, every two weeks or
+    monthly) with its own day in the cycle.
+- Approved card spend and interest grow the balance; payments shrink it. Transactions are
+    declined over the credit limit, and more often while delinquent.
+- On each due date the agent pays or misses. The miss probability is the agent's risk,
+    and much higher once already behind. An agent is delinquent while it has missed
+    payments (`current_missed_payments` > 0) and is charged off after
+    CHARGE_OFF_MISSED_PAYMENTS misses in a row, after which it stops producing events.
+
+Each week writes one account state snapshot per active agent, dated the start of the week,
+and its transactions and payments, time-sorted within each block of agents. The files are
+therefore in week order and can be appended to, as in production.
+
+Labels come from simulating a further 12 months past the end of the logs with expected
+spend instead of sampled transactions. Agents already charged off within the logs are
+labelled 1 for every window.
+"""
+import argparse
+import os
+from typing import Dict, NamedTuple, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+PREDICTION_WINDOW_MONTHS = [3, 6, 9, 12]  # Constant for this charge-off prediction task.
+WEEKS_PER_MONTH = 52 / 12
+MERCHANT_CATEGORIES = np.array([
+    "Business", "Clothing", "Entertainment", "Gas", "Grocery", "Health", "Misc",
+    "Restaurants", "Retail", "Travel", "Utilities",
+])
+MERCHANT_CATEGORY_WEIGHTS = np.array([6, 8, 7, 10, 16, 5, 12, 12, 14, 4, 6]) / 100
+MERCHANTS_PER_CATEGORY = 5_000
+CHARGE_OFF_MISSED_PAYMENTS = 4
+SECONDS_PER_WEEK = 7 * 24 * 3600
+
+
+class AgentProfiles(NamedTuple):
+    """Static per-agent parameters, one array entry per agent."""
+    credit_limit: np.ndarray
+    interest_rate: np.ndarray
+    min_payment_factor: np.ndarray
+    weekly_transactions: np.ndarray
+    log_amount_scale: np.ndarray
+    favourite_category: np.ndarray
+    online_rate: np.ndarray
+    payment_cadence_weeks: np.ndarray
+    payment_phase: np.ndarray
+    payment_fraction: np.ndarray
+    risk: np.ndarray
+
+
+class AgentState(NamedTuple):
+    """Per-agent state that evolves week by week. Arrays are updated in place."""
+    balance: np.ndarray
+    missed_payments: np.ndarray
+    # Week in which the agent was charged off, or -1 while it is active.
+    charge_off_week: np.ndarray
+
+
+def init_agents(
+        n_agents: int,
+        rng: np.random.Generator,
+    ) -> Tuple[AgentProfiles, AgentState]:
+    """Draw every agent's profile and starting state."""
+    credit_limit = np.round(rng.lognormal(np.log(2_500), 0.6, n_agents), -2).clip(300)
+    payment_cadence_weeks = rng.choice([1, 2, 4], n_agents, p=[0.1, 0.3, 0.6])
+    profiles = AgentProfiles(
+        credit_limit=credit_limit,
+        interest_rate=rng.uniform(0.15, 0.30, n_agents),
+        min_payment_factor=rng.choice([0.02, 0.03, 0.05], n_agents, p=[0.2, 0.3, 0.5]),
+        weekly_transactions=rng.gamma(2.0, 0.75, n_agents),
+        log_amount_scale=rng.normal(np.log(45), 0.5, n_agents),
+        favourite_category=rng.choice(
+            len(MERCHANT_CATEGORIES), n_agents, p=MERCHANT_CATEGORY_WEIGHTS
+        ),
+        online_rate=rng.beta(2, 5, n_agents),
+        payment_cadence_weeks=payment_cadence_weeks,
+        payment_phase=rng.integers(0, payment_cadence_weeks),
+        payment_fraction=rng.beta(2, 2, n_agents),
+        risk=rng.beta(0.6, 30, n_agents),
+    )
+    state = AgentState(
+        balance=credit_limit * rng.uniform(0.05, 0.6, n_agents),
+        missed_payments=np.zeros(n_agents, dtype=np.int8),
+        charge_off_week=np.full(n_agents, -1, dtype=np.int32),
+    )
+    return profiles, state
+
+
+def _merchant_ids(rng: np.random.Generator) -> np.ndarray:
+    # (n_categories, MERCHANTS_PER_CATEGORY) 8-character IDs like "EPJJ1K11".
+    alphabet = np.array(list("ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789"), dtype="<U1")
+    chars = rng.choice(alphabet, (len(MERCHANT_CATEGORIES) * MERCHANTS_PER_CATEGORY, 8))
+    return chars.view("<U8").reshape(len(MERCHANT_CATEGORIES), MERCHANTS_PER_CATEGORY)
+
+
+def _sorted_by_time(df: pd.DataFrame) -> pd.DataFrame:
+    return df.sort_values("timestamp", kind="stable", ignore_index=True)
+
+
+def simulate_week(
+        profiles: AgentProfiles,
+        state: AgentState,
+        agents: slice,
+        week: int,
+        week_start: np.datetime64,
+        rng: np.random.Generator,
+        merchant_ids: Optional[np.ndarray] = None,
+    ) -> Optional[Dict[str, pd.DataFrame]]:
+    """Advance a block of agents by one week, updating `state` in place.
+
+    :param profiles: Every agent's profile
+    :type profiles: AgentProfiles
+    :param state: Every agent's state
+    :type state: AgentState
+    :param agents: Block of agents to simulate
+    :type agents: slice
+    :param week: Index of the week, from the start of the logs
+    :type week: int
+    :param week_start: Start of the week
+    :type week_start: np.datetime64
+    :param rng: Random generator
+    :type rng: np.random.Generator
+    :param merchant_ids: Merchant IDs per category, from `_merchant_ids`. Without them,
+        transactions are not sampled and agents spend their expected amount, which is how
+        weeks past the end of the logs are simulated for the labels.
+    :type merchant_ids: Optional[np.ndarray]
+    :return: The week's rows of each log, or None without `merchant_ids`
+    :rtype: Optional[Dict[str, pd.DataFrame]]
+    """
+    agent_ids = np.arange(agents.start, agents.stop, dtype=np.int32)
+    active = state.charge_off_week[agents] < 0
+    balance = state.balance[agents]
+    missed = state.missed_payments[agents]
+    limit = profiles.credit_limit[agents]
+    is_delinquent = missed > 0
+    # Delinquent agents spend less and get declined more.
+    spend_rate = profiles.weekly_transactions[agents] * np.where(is_delinquent, 0.5, 1.0)
+    spend_rate[~active] = 0
+
+    logs = None
+    if merchant_ids is None:
+        mean_amount = np.exp(profiles.log_amount_scale[agents] + 0.8**2 / 2)
+        spend = np.minimum(spend_rate * mean_amount, np.maximum(limit - balance, 0))
+    else:
+        n_transactions = rng.poisson(spend_rate)
+        rows = np.repeat(np.arange(len(agent_ids)), n_transactions)
+        amounts = np.round(
+            np.exp(rng.normal(profiles.log_amount_scale[agents][rows], 0.8)), 2
+        ).clip(0.5)
+        category = np.where(
+            rng.random(len(rows)) < 0.4,
+            profiles.favourite_category[agents][rows],
+            rng.choice(len(MERCHANT_CATEGORIES), len(rows), p=MERCHANT_CATEGORY_WEIGHTS),
+        )
+        decline_rate = np.where(is_delinquent[rows], 0.25, 0.02)
+        approved = (rng.random(len(rows)) >= decline_rate) & (
+            amounts <= (limit - balance)[rows]
+        )
+        spend = np.bincount(
+            rows, weights=amounts * approved, minlength=len(agent_ids)
+        )
+        transaction_offsets = rng.integers(0, SECONDS_PER_WEEK, len(rows))
+        transactions_df = pd.DataFrame({
+            "agent_id": agent_ids[rows],
+            "status": np.where(approved, "approved", "declined"),
+            "amount": amounts,
+            "merchant_category": MERCHANT_CATEGORIES[category],
+            "merchant_id": merchant_ids[
+                category, rng.integers(0, MERCHANTS_PER_CATEGORY, len(rows))
+            ],
+            "online": (rng.random(len(rows)) < profiles.online_rate[agents][rows]).astype(
+                np.int8
+            ),
+            "timestamp": week_start + transaction_offsets.astype("timedelta64[s]"),
+        })
+        logs = {"transactions_log": _sorted_by_time(transactions_df)}
+
+    balance += spend
+    balance *= 1 + profiles.interest_rate[agents] / 52
+
+    is_due = active & (
+        week % profiles.payment_cadence_weeks[agents] == profiles.payment_phase[agents]
+    ) & (balance > 1)
+    miss_rate = np.where(is_delinquent, 0.4 + profiles.risk[agents], profiles.risk[agents])
+    pays = is_due & (rng.random(len(agent_ids)) >= miss_rate)
+    payments = np.round(
+        np.maximum(
+            profiles.min_payment_factor[agents],
+            profiles.payment_fraction[agents] * rng.uniform(0.7, 1.3, len(agent_ids)),
+        ).clip(max=1) * balance,
+        2,
+    )
+    payments[~pays] = 0
+    balance -= payments
+    missed[pays] = 0
+    missed[is_due & ~pays] += 1
+    charged_off = active & (missed >= CHARGE_OFF_MISSED_PAYMENTS)
+    state.charge_off_week[agents][charged_off] = week
+    state.balance[agents] = balance
+    state.missed_payments[agents] = missed
+
+    if logs is None:
+        return None
+    payment_offsets = rng.integers(0, SECONDS_PER_WEEK, int(pays.sum()))
+    logs["payments_log"] = _sorted_by_time(pd.DataFrame({
+        "agent_id": agent_ids[pays],
+        "amount": payments[pays],
+        "timestamp": week_start + payment_offsets.astype("timedelta64[s]"),
+    }))
+    # One snapshot per agent still active at the start of the week, including the one
+    #  charged off during it.
+    logs["account_state_log"] = pd.DataFrame({
+        "agent_id": agent_ids[active],
+        "credit_balance": balance[active],
+        "credit_utilization": np.round(balance[active] / limit[active], 3),
+        "interest_rate": profiles.interest_rate[agents][active],
+        "min_payment_factor": profiles.min_payment_factor[agents][active],
+        "current_missed_payments": missed[active],
+        "timestamp": np.full(active.sum(), week_start),
+    })
+    return logs
+
+
+def labels_from_charge_offs(charge_off_week: np.ndarray, n_log_weeks: int) -> pd.DataFrame:
+    """Label each agent by whether it is charged off within each window after the logs."""
+    label_df = pd.DataFrame({"agent_id": np.arange(len(charge_off_week), dtype=np.int32)})
+    charged_off = charge_off_week >= 0
+    for months in PREDICTION_WINDOW_MONTHS:
+        window_end = n_log_weeks + round(months * WEEKS_PER_MONTH)
+        label_df[f"charge_off_within_{months}_months"] = (
+            charged_off & (charge_off_week < window_end)
+        ).astype(np.int8)
+    return label_df
+
+
+def main(
+        out_dir: str,
+        n_agents: int,
+        n_weeks: int,
+        start_date: str,
+        agents_per_chunk: int,
+        seed: int,
+    ):
+    """Simulate `n_agents` for `n_weeks` and write the logs and labels to `out_dir`."""
+    rng = np.random.default_rng(seed)
+    profiles, state = init_agents(n_agents, rng)
+    merchant_ids = _merchant_ids(rng)
+    os.makedirs(out_dir, exist_ok=True)
+    log_names = ("account_state_log", "payments_log", "transactions_log")
+    log_files = {
+        log_name: open(os.path.join(out_dir, f"{log_name}.csv"), "w")
+        for log_name in log_names
+    }
+    n_rows = dict.fromkeys(log_names, 0)
+    start = np.datetime64(start_date, "s")
+    blocks = [
+        slice(first, min(first + agents_per_chunk, n_agents))
+        for first in range(0, n_agents, agents_per_chunk)
+    ]
+    try:
+        for week in range(n_weeks):
+            week_start = start + np.timedelta64(week * SECONDS_PER_WEEK, "s")
+            for agents in blocks:
+                logs = simulate_week(
+                    profiles, state, agents, week, week_start, rng, merchant_ids
+                )
+                for log_name, log_df in logs.items():
+                    log_df.to_csv(
+                        log_files[log_name], header=n_rows[log_name] == 0, index=False
+                    )
+                    n_rows[log_name] += len(log_df)
+            print(
+                f"Week {week + 1}/{n_weeks}: "
+                + ", ".join(f"{n:,} {log_name} rows" for log_name, n in n_rows.items())
+            )
+    finally:
+        for f in log_files.values():
+            f.close()
+
+    # Labels only need the charge-off weeks, so the rest of the year is simulated without
+    #  sampling or writing events.
+    horizon_weeks = round(PREDICTION_WINDOW_MONTHS[-1] * WEEKS_PER_MONTH)
+    for week in range(n_weeks, n_weeks + horizon_weeks):
+        for agents in blocks:
+            simulate_week(profiles, state, agents, week, None, rng)
+    label_df = labels_from_charge_offs(state.charge_off_week, n_weeks)
+    label_df.to_csv(os.path.join(out_dir, "labels.csv"), index=False)
+    print(
+        f"Wrote labels for {n_agents:,} agents to {out_dir}. Positive rates: "
+        + ", ".join(
+            f"{col_name} {label_df[col_name].mean():.3f}"
+            for col_name in label_df.columns[1:]
+        )
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--out_dir",
+        type=str,
+        required=True,
+        help="Directory to write the three logs and labels.csv to, laid out like "
+             "../synthcc_train_set."
+    )
+    parser.add_argument(
+        "--n_agents",
+        type=int,
+        default=100_000,
+        help="Number of agents."
+    )
+    parser.add_argument(
+        "--n_weeks",
+        type=int,
+        default=52,
+        help="Number of weeks of logs. Each active agent makes about 1.5 transactions a "
+             "week."
+    )
+    parser.add_argument(
+        "--start_date",
+        type=str,
+        default="2023-01-01",
+        help="Date the logs start at."
+    )
+    parser.add_argument(
+        "--agents_per_chunk",
+        type=int,
+        default=1_000_000,
+        help="Agents simulated and written at a time. Bounds memory use."
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="Random seed."
+    )
+    args = parser.parse_args()
+    main(
+        args.out_dir,
+        args.n_agents,
+        args.n_weeks,
+        args.start_date,
+        args.agents_per_chunk,
+        args.seed,
+    )
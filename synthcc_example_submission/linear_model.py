@@ -0,0 +1,447 @@
+"""Logistic-regression model, its on-disk artifact, and batched scoring.
+
+The submission envs only ship pandas and numpy, so the model is fitted with Newton's method
+in numpy: with a few dozen features each step is one pass over the rows plus a small linear
+solve, and a handful of steps converge.
+
+For targets that are nested events, like charge-off within 3/6/9/12 months, `fit_model`
+can instead fit one joint model: a single linear risk score shared by every target, plus a
+per-target intercept. Scoring then costs one dot product per row however many targets
+there are, and predictions are made monotone across the targets (a positive for one
+target implies a positive for every later one), as the labels are.
+
+`best_f1_thresholds` tunes the decision thresholds, which start at 0.5, for F1 on the
+training scores: one sort per target gives F1 at every distinct threshold from cumulative
+true/false positive counts, instead of scoring each candidate threshold separately.
+
+`init_model` and `fit_weights` split `fit_model` into standardizing and fitting, so
+cross-validation can standardize each fold once, cache the result and fit many
+configurations on it with `fit_weights` and `proba_of_standardized`.
+
+`save_model` writes the model as a directory of uncompressed `.npy` arrays plus `meta.json`.
+`load_model` memory-maps the arrays, so loading an artifact at inference time costs little
+more than opening the files, and scoring is one matrix product per batch of rows.
+"""
+import json
+import os
+from typing import List, NamedTuple, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+# Bump when the artifact layout changes so stale artifacts fail loudly, not silently.
+MODEL_FORMAT_VERSION = 2
+MODEL_ARRAYS = ("center", "scale", "coef", "intercept", "threshold")
+BATCH_SIZE = 100_000
+# Threshold a model starts with, and the one kept when there are no rows to tune it on.
+DEFAULT_THRESHOLD = 0.5
+
+
+class LinearModel(NamedTuple):
+    """Standardize-then-logistic model with one output per target column.
+
+    A joint model has a single coefficient column, shared by every target.
+    """
+    feature_names: List[str]
+    target_names: List[str]
+    center: np.ndarray  # (n_features,) training means
+    scale: np.ndarray  # (n_features,) training standard deviations
+    coef: np.ndarray  # (n_features, n_targets), or (n_features, 1) for a joint model
+    intercept: np.ndarray  # (n_targets,)
+    threshold: np.ndarray  # (n_targets,) probability at or above which to predict 1
+    # Whether a positive for a target implies a positive for every later target.
+    monotonic: bool
+    # Anything else inference needs to rebuild the features, e.g. category encodings.
+    metadata: dict
+
+
+def _sigmoid(z: np.ndarray) -> np.ndarray:
+    return 1 / (1 + np.exp(-np.clip(z, -500, 500)))
+
+
+def standardized_batches(model: LinearModel, features_df: pd.DataFrame, batch_size: int):
+    """Yield float32 blocks of standardized features, `batch_size` rows at a time.
+
+    Columns are matched to the model's by name: columns the model has not seen are dropped
+    and columns it expects but `features_df` lacks are treated as missing. Missing values
+    are imputed with the training mean, i.e. 0 after standardizing.
+    """
+    features_df = features_df.reindex(columns=model.feature_names)
+    center = np.asarray(model.center, dtype=np.float32)
+    scale = np.asarray(model.scale, dtype=np.float32)
+    for start in range(0, len(features_df), batch_size):
+        block = features_df.iloc[start:start + batch_size].to_numpy(dtype=np.float32)
+        block -= center
+        block /= scale
+        np.nan_to_num(block, copy=False, nan=0.0, posinf=0.0, neginf=0.0)
+        yield block
+
+
+def fit_logistic(
+        X: np.ndarray,
+        y: np.ndarray,
+        l2: float = 1.0,
+        max_iter: int = 50,
+        tol: float = 1e-6,
+        batch_size: int = BATCH_SIZE,
+    ) -> np.ndarray:
+    """Fit an L2-regularized logistic regression with Newton's method.
+
+    :param X: (n_rows, n_features) standardized features
+    :type X: np.ndarray
+    :param y: (n_rows,) 0/1 labels
+    :type y: np.ndarray
+    :param l2: L2 penalty on the coefficients. The intercept is not penalized.
+    :type l2: float
+    :param max_iter: Maximum number of Newton steps
+    :type max_iter: int
+    :param tol: Stop once no weight moves by more than this in a step
+    :type tol: float
+    :param batch_size: Rows per block when accumulating the gradient and Hessian
+    :type batch_size: int
+    :return: (n_features + 1,) weights, the intercept last
+    :rtype: np.ndarray
+    """
+    n_rows, n_features = X.shape
+    y = np.asarray(y, dtype=np.float64)
+    # A tiny penalty on the intercept keeps the Hessian invertible when a label is constant.
+    penalty = np.full(n_features + 1, float(l2))
+    penalty[-1] = 1e-8
+    weights = np.zeros(n_features + 1)
+    for _ in range(max_iter):
+        gradient = penalty * weights
+        hessian = np.diag(penalty)
+        # Accumulate over row blocks so temporaries stay O(batch_size x n_features).
+        for start in range(0, n_rows, batch_size):
+            X_block = np.asarray(X[start:start + batch_size], dtype=np.float64)
+            X_block = np.hstack([X_block, np.ones((len(X_block), 1))])
+            p = _sigmoid(X_block @ weights)
+            gradient += X_block.T @ (p - y[start:start + batch_size])
+            hessian += (X_block * (p * (1 - p))[:, None]).T @ X_block
+        step = np.linalg.solve(hessian, gradient)
+        weights -= step
+        if np.max(np.abs(step)) < tol:
+            break
+    return weights
+
+
+def fit_joint_logistic(
+        X: np.ndarray,
+        Y: np.ndarray,
+        l2: float = 1.0,
+        max_iter: int = 50,
+        tol: float = 1e-6,
+        batch_size: int = BATCH_SIZE,
+    ) -> np.ndarray:
+    """Fit one logistic risk score shared by every label column, with Newton's method.
+
+    Label column k is modeled as sigmoid(X @ coef + intercept[k]), i.e. as the stacked
+    logistic regression over all (row, column) pairs, without materializing the stack.
+
+    :param X: (n_rows, n_features) standardized features
+    :type X: np.ndarray
+    :param Y: (n_rows, n_targets) 0/1 labels
+    :type Y: np.ndarray
+    :param l2: L2 penalty on the coefficients. The intercepts are not penalized.
+    :type l2: float
+    :param max_iter: Maximum number of Newton steps
+    :type max_iter: int
+    :param tol: Stop once no weight moves by more than this in a step
+    :type tol: float
+    :param batch_size: Rows per block when accumulating the gradient and Hessian
+    :type batch_size: int
+    :return: (n_features + n_targets,) weights: the shared coefficients, then one intercept
+        per label column
+    :rtype: np.ndarray
+    """
+    n_rows, n_features = X.shape
+    n_targets = Y.shape[1]
+    Y = np.asarray(Y, dtype=np.float64)
+    penalty = np.concatenate([np.full(n_features, float(l2)), np.full(n_targets, 1e-8)])
+    weights = np.zeros(n_features + n_targets)
+    for _ in range(max_iter):
+        coef, intercept = weights[:n_features], weights[n_features:]
+        gradient = penalty * weights
+        hessian = np.diag(penalty)
+        for start in range(0, n_rows, batch_size):
+            X_block = np.asarray(X[start:start + batch_size], dtype=np.float64)
+            p = _sigmoid((X_block @ coef)[:, None] + intercept)
+            residual = p - Y[start:start + batch_size]
+            curvature = p * (1 - p)
+            gradient[:n_features] += X_block.T @ residual.sum(axis=1)
+            gradient[n_features:] += residual.sum(axis=0)
+            hessian[:n_features, :n_features] += (
+                (X_block * curvature.sum(axis=1)[:, None]).T @ X_block
+            )
+            cross = X_block.T @ curvature
+            hessian[:n_features, n_features:] += cross
+            hessian[n_features:, :n_features] += cross.T
+            hessian[n_features:, n_features:] += np.diag(curvature.sum(axis=0))
+        step = np.linalg.solve(hessian, gradient)
+        weights -= step
+        if np.max(np.abs(step)) < tol:
+            break
+    return weights
+
+
+def init_model(
+        features_df: pd.DataFrame,
+        target_names: List[str],
+        metadata: Optional[dict] = None,
+        joint: bool = False,
+    ) -> LinearModel:
+    """Return an unfitted model that standardizes features with `features_df`'s statistics.
+
+    :param features_df: Training features
+    :type features_df: pd.DataFrame
+    :param target_names: Names of the label columns, one per target
+    :type target_names: List[str]
+    :param metadata: JSON-serializable info saved with the model
+    :type metadata: Optional[dict]
+    :param joint: Whether the model will be a joint, monotonic one
+    :type joint: bool
+    :return: Model with the training means and standard deviations, zero weights, and
+        every threshold at 0.5
+    :rtype: LinearModel
+    """
+    values = features_df.to_numpy(dtype=np.float64)
+    center = np.nan_to_num(np.nanmean(values, axis=0))
+    scale = np.nan_to_num(np.nanstd(values, axis=0))
+    scale[scale == 0] = 1.0
+    return LinearModel(
+        feature_names=[str(col_name) for col_name in features_df.columns],
+        target_names=[str(target_name) for target_name in target_names],
+        center=center,
+        scale=scale,
+        coef=np.zeros((len(center), 1 if joint else len(target_names))),
+        intercept=np.zeros(len(target_names)),
+        threshold=np.full(len(target_names), DEFAULT_THRESHOLD),
+        monotonic=joint,
+        metadata=metadata or {},
+    )
+
+
+def fit_weights(
+        X: np.ndarray,
+        Y: np.ndarray,
+        l2: float = 1.0,
+        joint: bool = False,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+    """Fit the coefficients and intercepts of a model on standardized features.
+
+    :param X: (n_rows, n_features) standardized features, e.g. a memory-mapped array
+    :type X: np.ndarray
+    :param Y: (n_rows, n_targets) 0/1 labels
+    :type Y: np.ndarray
+    :param l2: L2 penalty on the coefficients
+    :type l2: float
+    :param joint: Whether to fit a single risk score shared by the label columns
+    :type joint: bool
+    :return: (n_features, n_targets) coefficients, or (n_features, 1) if `joint`, and
+        (n_targets,) intercepts
+    :rtype: Tuple[np.ndarray, np.ndarray]
+    """
+    n_features = X.shape[1]
+    if joint:
+        weights = fit_joint_logistic(X, Y, l2)
+        return weights[:n_features, None], weights[n_features:]
+    coef = np.empty((n_features, Y.shape[1]))
+    intercept = np.empty(Y.shape[1])
+    for i in range(Y.shape[1]):
+        weights = fit_logistic(X, Y[:, i], l2)
+        coef[:, i] = weights[:-1]
+        intercept[i] = weights[-1]
+    return coef, intercept
+
+
+def fit_model(
+        features_df: pd.DataFrame,
+        labels_df: pd.DataFrame,
+        l2: float = 1.0,
+        metadata: Optional[dict] = None,
+        joint: bool = False,
+    ) -> LinearModel:
+    """Fit one logistic regression per label column on standardized features.
+
+    With `joint`, fit a single risk score shared by the label columns instead. The columns
+    must then be nested events in order, each implying the next.
+
+    :param features_df: Features, row-aligned with `labels_df`
+    :type features_df: pd.DataFrame
+    :param labels_df: 0/1 label columns only, one per target
+    :type labels_df: pd.DataFrame
+    :param l2: L2 penalty on the coefficients
+    :type l2: float
+    :param metadata: JSON-serializable info saved with the model
+    :type metadata: Optional[dict]
+    :param joint: Whether to fit a joint, monotonic model
+    :type joint: bool
+    :return: Fitted model, with every threshold at 0.5
+    :rtype: LinearModel
+    """
+    assert len(features_df) == len(labels_df), \
+        f"{len(features_df)=} != {len(labels_df)=}"
+    model = init_model(features_df, list(labels_df.columns), metadata, joint)
+    X = np.concatenate(list(standardized_batches(model, features_df, BATCH_SIZE)))
+    coef, intercept = fit_weights(X, labels_df.to_numpy(), l2, joint)
+    return model._replace(coef=coef, intercept=intercept)
+
+
+def save_model(model: LinearModel, model_dir: str):
+    """Write the model to `model_dir` as `.npy` arrays plus `meta.json`."""
+    os.makedirs(model_dir, exist_ok=True)
+    for array_name in MODEL_ARRAYS:
+        np.save(
+            os.path.join(model_dir, f"{array_name}.npy"),
+            np.asarray(getattr(model, array_name), dtype=np.float32),
+        )
+    meta = {
+        "version": MODEL_FORMAT_VERSION,
+        "feature_names": model.feature_names,
+        "target_names": model.target_names,
+        "monotonic": model.monotonic,
+        "metadata": model.metadata,
+    }
+    with open(os.path.join(model_dir, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+
+
+def load_model(model_dir: str) -> LinearModel:
+    """Load a model saved by `save_model`, memory-mapping its arrays."""
+    meta_path = os.path.join(model_dir, "meta.json")
+    assert os.path.isfile(meta_path), f"{meta_path=} is not a file. Run train.py first."
+    with open(meta_path) as f:
+        meta = json.load(f)
+    assert meta["version"] == MODEL_FORMAT_VERSION, (
+        f"Model in {model_dir} has format version {meta['version']}, but this code reads "
+        f"version {MODEL_FORMAT_VERSION}. Re-run train.py."
+    )
+    arrays = {
+        array_name: np.load(os.path.join(model_dir, f"{array_name}.npy"), mmap_mode="r")
+        for array_name in MODEL_ARRAYS
+    }
+    return LinearModel(
+        feature_names=meta["feature_names"],
+        target_names=meta["target_names"],
+        monotonic=meta["monotonic"],
+        metadata=meta["metadata"],
+        **arrays,
+    )
+
+
+def predict_proba(
+        model: LinearModel,
+        features_df: pd.DataFrame,
+        batch_size: int = BATCH_SIZE,
+    ) -> np.ndarray:
+    """Score every row, `batch_size` rows at a time.
+
+    :return: (n_rows, n_targets) float32 probabilities
+    :rtype: np.ndarray
+    """
+    proba = np.empty((len(features_df), len(model.target_names)), dtype=np.float32)
+    start = 0
+    for block in standardized_batches(model, features_df, batch_size):
+        # A joint model's single score column broadcasts against the per-target intercepts.
+        proba[start:start + len(block)] = _sigmoid(block @ model.coef + model.intercept)
+        start += len(block)
+    if model.monotonic:
+        np.maximum.accumulate(proba, axis=1, out=proba)
+    return proba
+
+
+def proba_of_standardized(
+        X: np.ndarray,
+        coef: np.ndarray,
+        intercept: np.ndarray,
+        monotonic: bool = False,
+        batch_size: int = BATCH_SIZE,
+    ) -> np.ndarray:
+    """Score rows of already standardized features, as `predict_proba` does.
+
+    :return: (n_rows, n_targets) float32 probabilities
+    :rtype: np.ndarray
+    """
+    proba = np.empty((len(X), len(intercept)), dtype=np.float32)
+    for start in range(0, len(X), batch_size):
+        block = np.asarray(X[start:start + batch_size], dtype=np.float32)
+        proba[start:start + len(block)] = _sigmoid(block @ coef + intercept)
+    if monotonic:
+        np.maximum.accumulate(proba, axis=1, out=proba)
+    return proba
+
+
+def apply_thresholds(
+        proba: np.ndarray,
+        threshold: np.ndarray,
+        monotonic: bool = False,
+    ) -> np.ndarray:
+    """Return (n_rows, n_targets) int8 0/1 predictions of probabilities at thresholds."""
+    preds = (proba >= np.asarray(threshold)).astype(np.int8)
+    if monotonic:
+        # Per-target thresholds can break the ordering the probabilities have.
+        np.maximum.accumulate(preds, axis=1, out=preds)
+    return preds
+
+
+def predict(
+        model: LinearModel,
+        features_df: pd.DataFrame,
+        batch_size: int = BATCH_SIZE,
+    ) -> np.ndarray:
+    """Return (n_rows, n_targets) int8 0/1 predictions at the model's thresholds."""
+    proba = predict_proba(model, features_df, batch_size)
+    return apply_thresholds(proba, model.threshold, model.monotonic)
+
+
+def best_f1_thresholds(
+        scores: np.ndarray,
+        labels: np.ndarray,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+    """Per target, find the threshold at which predicting `score >= threshold` maximizes F1.
+
+    Each target's scores are sorted once, descending. Cutting after the i-th sorted score
+    predicts the top i rows positive, so cumulative sums of the sorted labels give the true
+    and false positives of every cut at once. Only cuts between distinct scores are
+    candidates, since tied rows are always predicted alike. Cost is O(n log n) per target.
+
+    For a monotonic model, `predict` can still turn a target's negatives positive when an
+    earlier target is positive, which this sweep does not model.
+
+    :param scores: (n_rows, n_targets) scores, e.g. from `predict_proba`
+    :type scores: np.ndarray
+    :param labels: (n_rows, n_targets) 0/1 labels
+    :type labels: np.ndarray
+    :return: (n_targets,) thresholds and the F1 each achieves on these rows. A target
+        without positives gets threshold inf, predicting no positives, and F1 0. Without
+        any rows, every target keeps DEFAULT_THRESHOLD, with F1 0.
+    :rtype: Tuple[np.ndarray, np.ndarray]
+    """
+    scores = np.asarray(scores)
+    labels = np.asarray(labels, dtype=bool)
+    n_targets = scores.shape[1] if scores.ndim == 2 else 1
+    if len(scores) == 0:
+        # No cut to choose from: argmax over zero rows would raise.
+        return np.full(n_targets, DEFAULT_THRESHOLD), np.zeros(n_targets)
+    scores = scores.reshape(len(scores), n_targets)
+    labels = labels.reshape(len(labels), n_targets)
+    order = np.argsort(-scores, axis=0, kind="stable")
+    sorted_scores = np.take_along_axis(scores, order, axis=0)
+    true_pos = np.cumsum(np.take_along_axis(labels, order, axis=0), axis=0)
+    n_predicted = np.arange(1, len(scores) + 1)[:, None]
+    # F1 = 2 TP / (2 TP + FP + FN) = 2 TP / (n_predicted + n_positives)
+    f1 = 2 * true_pos / (n_predicted + labels.sum(axis=0)).astype(np.float64)
+    # A cut inside a run of tied scores is not reachable with a threshold.
+    is_tied_with_next = np.zeros_like(f1, dtype=bool)
+    is_tied_with_next[:-1] = sorted_scores[:-1] == sorted_scores[1:]
+    f1[is_tied_with_next] = -1
+
+    best = np.argmax(f1, axis=0)
+    targets = np.arange(scores.shape[1])
+    thresholds = sorted_scores[best, targets].astype(np.float64)
+    best_f1 = f1[best, targets]
+    no_positives = ~labels.any(axis=0)
+    thresholds[no_positives] = np.inf
+    best_f1[no_positives] = 0.0
+    return thresholds, best_f1
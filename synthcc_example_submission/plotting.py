@@ -1,9 +1,25 @@
+from typing import NamedTuple, Optional
+
 import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
 import numpy as np
 import matplotlib.patches as mpatches
 
+from status_encoding import (
+    GOOD, STATUS_CATEGORIES, STATUS_CODES, encode_status, status_categorical
+)
+
+# Lines drawn by plot_behavior_over_time; more are unreadable and slow to render.
+MAX_PLOTTED_AGENTS = 20
+# Rows sampled to estimate a KDE, and points it is evaluated at. Histograms use every row.
+MAX_KDE_ROWS = 100_000
+KDE_GRID_SIZE = 256
+# event_counts only uses np.bincount, which allocates one counter per integer up to the
+#  largest value, while that is at most this many counters per row.
+MAX_BINCOUNT_COUNTERS_PER_ROW = 4
+
+
 def count_merchant_types(transactions_log):
     """
     Count the occurrences of each 'Merchant Type'.
@@ -16,39 +32,173 @@ def count_merchant_types(transactions_log):
     """
     return transactions_log['merchant_category'].value_counts()
 
+class AgentIndex:
+    """
+    A log with its rows grouped by agent, so each agent's rows are a contiguous slice.
+
+    Build it once per log, e.g. `AgentIndex(transactions_log)`, then look agents up
+    repeatedly: each lookup is a binary search over the agent IDs plus a row slice, instead
+    of a scan of the whole log. The functions below that take a log also take an
+    AgentIndex of it.
+
+    Attributes:
+    log (pd.DataFrame): The log, sorted by agent_id (stable, so each agent's rows keep
+        their order).
+    agent_ids (np.ndarray): Sorted unique agent IDs.
+    offsets (np.ndarray): Rows of `agent_ids[i]` are `log.iloc[offsets[i]:offsets[i + 1]]`.
+    """
+
+    def __init__(self, log):
+        if not log['agent_id'].is_monotonic_increasing:
+            log = log.iloc[np.argsort(log['agent_id'].to_numpy(), kind='stable')]
+        self.log = log.reset_index(drop=True)
+        sorted_ids = self.log['agent_id'].to_numpy()
+        is_first = np.ones(len(sorted_ids), dtype=bool)
+        is_first[1:] = sorted_ids[1:] != sorted_ids[:-1]
+        self.agent_ids = sorted_ids[is_first]
+        self.offsets = np.append(np.flatnonzero(is_first), len(sorted_ids))
+
+    def rows(self, agent_id):
+        """
+        Return the agent's rows, as a slice of `log` (empty if the agent has none).
+        """
+        i = np.searchsorted(self.agent_ids, agent_id)
+        if i == len(self.agent_ids) or self.agent_ids[i] != agent_id:
+            return self.log.iloc[0:0]
+        return self.log.iloc[self.offsets[i]:self.offsets[i + 1]]
+
+
+def agent_rows(log, agent_id):
+    """
+    Return the rows of one agent from a log or from an AgentIndex of it.
+
+    Parameters:
+    log (pd.DataFrame or AgentIndex): The log.
+    agent_id (int): The ID of the agent.
+
+    Returns:
+    pd.DataFrame: The agent's rows.
+    """
+    if isinstance(log, AgentIndex):
+        return log.rows(agent_id)
+    return log[log['agent_id'] == agent_id]
+
+
 def filter_agent_data(agent_id, transactions_log, account_state_log):
     """
     Filter data for the specified agent.
 
     Parameters:
     agent_id (int): The ID of the agent to filter.
-    transactions_log (pd.DataFrame): DataFrame containing transactions log.
-    account_state_log (pd.DataFrame): DataFrame containing account state logs.
+    transactions_log (pd.DataFrame or AgentIndex): Transactions log, or an AgentIndex of it
+        to look the agent up without scanning the log.
+    account_state_log (pd.DataFrame or AgentIndex): Account state log, or an AgentIndex
+        of it.
 
     Returns:
     tuple: Filtered transactions and account state logs for the agent.
     """
-    agent_transactions = transactions_log[transactions_log['agent_id'] == agent_id]
-    agent_account_state = account_state_log[account_state_log['agent_id'] == agent_id]
+    agent_transactions = agent_rows(transactions_log, agent_id)
+    agent_account_state = agent_rows(account_state_log, agent_id)
     return agent_transactions, agent_account_state
 
 
-def plot_transaction_amount_distribution(agent_transactions, agent_id=None):
+class Histogram(NamedTuple):
+    """
+    Binned counts of a column, plus an optional KDE scaled to the same counts.
+
+    Small next to the rows it summarizes, so compute it once with `histogram` and keep it
+    (or pickle it) to re-plot without touching the log again.
+    """
+    counts: np.ndarray
+    edges: np.ndarray
+    kde_x: Optional[np.ndarray] = None
+    kde_y: Optional[np.ndarray] = None
+
+
+def _binned_gaussian_kde(values, lo, hi, grid_size=KDE_GRID_SIZE):
+    # Gaussian KDE with Scott's bandwidth, computed by smoothing a fine histogram with a
+    #  Gaussian kernel: linear in the number of values instead of values x grid points.
+    bandwidth = values.std() * len(values) ** (-1 / 5)
+    if not bandwidth > 0 or not hi > lo:
+        return None, None
+    fine_counts, fine_edges = np.histogram(values, bins=grid_size, range=(lo, hi))
+    dx = fine_edges[1] - fine_edges[0]
+    half_width = min(int(np.ceil(4 * bandwidth / dx)), grid_size)
+    offsets = np.arange(-half_width, half_width + 1) * dx
+    kernel = np.exp(-0.5 * (offsets / bandwidth) ** 2)
+    kernel /= kernel.sum()
+    smoothed = np.convolve(fine_counts, kernel)[half_width:half_width + grid_size]
+    grid = (fine_edges[:-1] + fine_edges[1:]) / 2
+    return grid, smoothed / (len(values) * dx)
+
+
+def histogram(values, bins=30, kde=True, kde_max_rows=MAX_KDE_ROWS, seed=0):
+    """
+    Bin values with NumPy and, optionally, estimate their KDE on a sample.
+
+    Parameters:
+    values (array-like): Values to summarize, e.g. transactions_log['amount']. Missing
+        values are ignored.
+    bins (int): Number of equal-width bins.
+    kde (bool): Whether to also estimate a KDE.
+    kde_max_rows (int): The KDE is estimated on at most this many randomly sampled values.
+        If None, on all of them.
+    seed (int): Seed of the KDE sample.
+
+    Returns:
+    Histogram: Counts per bin and bin edges, and the KDE scaled to counts per bin.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    values = values[np.isfinite(values)]
+    counts, edges = np.histogram(values, bins=bins)
+    if not kde or len(values) < 2:
+        return Histogram(counts, edges)
+    sample = values
+    if kde_max_rows is not None and len(values) > kde_max_rows:
+        sample = np.random.default_rng(seed).choice(values, size=kde_max_rows, replace=False)
+    kde_x, density = _binned_gaussian_kde(sample, edges[0], edges[-1])
+    if kde_x is None:
+        return Histogram(counts, edges)
+    return Histogram(counts, edges, kde_x, density * len(values) * (edges[1] - edges[0]))
+
+
+def _plot_histogram(hist, alpha=1.0, label=None):
+    plt.bar(hist.edges[:-1], hist.counts, width=np.diff(hist.edges), align='edge', alpha=alpha, label=label)
+    if hist.kde_x is not None:
+        plt.plot(hist.kde_x, hist.kde_y)
+
+
+def plot_transaction_amount_distribution(agent_transactions, agent_id=None, bins=30, kde_max_rows=MAX_KDE_ROWS):
     """
     Plot histogram of transaction amounts.
 
+    Counts are binned with NumPy over every row and the KDE is estimated on at most
+    `kde_max_rows` of them, so this stays fast on full logs.
+
     Parameters:
-    agent_transactions (pd.DataFrame): DataFrame containing agent transactions.
+    agent_transactions (pd.DataFrame, AgentIndex or Histogram): DataFrame containing agent
+        transactions, an AgentIndex of the transactions log, or a Histogram of amounts
+        computed earlier with `histogram`.
     agent_id (int, optional): The ID of the agent. If None, plot for the entire population.
+    bins (int): Number of bins for the histogram.
+    kde_max_rows (int): Maximum number of rows the KDE is estimated on.
     """
     if agent_id is not None:
-        agent_transactions = agent_transactions[agent_transactions['agent_id'] == agent_id]
         title = f'Agent {agent_id} Transaction Amount Distribution'
     else:
         title = 'Population Transaction Amount Distribution'
-    
+    if isinstance(agent_transactions, Histogram):
+        hist = agent_transactions
+    else:
+        if agent_id is not None:
+            agent_transactions = agent_rows(agent_transactions, agent_id)
+        elif isinstance(agent_transactions, AgentIndex):
+            agent_transactions = agent_transactions.log
+        hist = histogram(agent_transactions['amount'], bins=bins, kde_max_rows=kde_max_rows)
+
     plt.figure(figsize=(12, 6))
-    sns.histplot(agent_transactions['amount'], bins=30, kde=True)
+    _plot_histogram(hist)
     plt.xlabel('Transaction Amount')
     plt.ylabel('Frequency')
     plt.title(title)
@@ -60,9 +210,12 @@ def plot_spending_patterns(agent_id, agent_transactions):
 
     Parameters:
     agent_id (int): The ID of the agent.
-    agent_transactions (pd.DataFrame): DataFrame containing agent transactions.
+    agent_transactions (pd.DataFrame or AgentIndex): DataFrame containing agent
+        transactions, or an AgentIndex of the transactions log to look the agent up in.
     """
-    merchant_category_summary = agent_transactions.groupby('merchant_category').agg(
+    if isinstance(agent_transactions, AgentIndex):
+        agent_transactions = agent_transactions.rows(agent_id)
+    merchant_category_summary = agent_transactions.groupby('merchant_category', observed=True).agg(
         total_spending=('amount', 'sum'),
         avg_transaction_amount=('amount', 'mean'),
         transaction_count=('amount', 'count')
@@ -81,10 +234,13 @@ def plot_merchant_type_distribution(transactions_log):
     Plot the distribution of 'Merchant Type'.
 
     Parameters:
-    transactions_log (pd.DataFrame): DataFrame containing transactions log.
+    transactions_log (pd.DataFrame or pd.Series): DataFrame containing transactions log, or
+        merchant type counts computed earlier with `count_merchant_types`.
     """
-
-    merchant_type_counts = count_merchant_types(transactions_log)
+    if isinstance(transactions_log, pd.Series):
+        merchant_type_counts = transactions_log
+    else:
+        merchant_type_counts = count_merchant_types(transactions_log)
 
     plt.figure(figsize=(10, 6))
     merchant_type_counts.plot(kind='bar')  # Creates a bar chart
@@ -96,21 +252,50 @@ def plot_merchant_type_distribution(transactions_log):
     plt.show()
 
 
+def event_counts(log, column):
+    """
+    Count the events of each distinct value of a column, e.g. of each agent.
+
+    Non-negative integer columns with dense values, such as agent_id, are counted with
+    `np.bincount`, in one pass without hashing. Sparse ones, e.g. hashed IDs, are counted
+    with `value_counts`, since `np.bincount` would allocate a counter per integer up to
+    their largest value.
+
+    Parameters:
+    log (pd.DataFrame): DataFrame containing the log (transactions or payments).
+    column (str): The column to count events of.
+
+    Returns:
+    np.ndarray: Number of events of each value that occurs, in no particular order.
+    """
+    values = log[column]
+    if (
+        pd.api.types.is_integer_dtype(values)
+        and len(values) > 0
+        and values.min() >= 0
+        and values.max() < MAX_BINCOUNT_COUNTERS_PER_ROW * len(values)
+    ):
+        counts = np.bincount(values.to_numpy())
+        return counts[counts > 0]
+    return values.value_counts().to_numpy()
+
+
 def plot_event_distribution(log, column, title, xlabel, bins=100, alpha=0.5):
     """
     Plot the distribution of events for a specified column.
 
     Parameters:
-    log (pd.DataFrame): DataFrame containing the log (transactions or payments).
+    log (pd.DataFrame or np.ndarray): DataFrame containing the log (transactions or
+        payments), or event counts computed earlier with `event_counts`.
     column (str): The column to count events.
     title (str): The title of the plot.
     xlabel (str): The label for the x-axis.
     bins (int): Number of bins for the histogram.
     alpha (float): Transparency level for the histogram.
     """
-    event_counts = log[column].value_counts()
+    counts = log if isinstance(log, np.ndarray) else event_counts(log, column)
     plt.figure(figsize=(10, 6))
-    event_counts.plot(kind='hist', bins=bins, alpha=alpha)
+    _plot_histogram(histogram(counts, bins=bins, kde=False), alpha=alpha, label='count')
     plt.title(title)
     plt.xlabel(xlabel)
     plt.ylabel('Frequency')
@@ -125,27 +310,49 @@ def categorize_status(status):
     Parameters:
     status (str): The account status.
 
+    For a whole status column, use `categorize_statuses`, which does not call Python per
+    row.
+
     Returns:
     str: The categorized status.
     """
-    if status == 'charge off':
-        return 'Charge Off'
-    elif status == 'delinquent':
-        return 'Delinquent'
-    else:
-        return 'Good'
+    return STATUS_CATEGORIES[STATUS_CODES.get(status, GOOD)]
+
+
+def categorize_statuses(statuses):
+    """
+    Categorize a column of account statuses into 'Good', 'Delinquent' and 'Charge Off' in
+    one vectorized pass. Same result as `statuses.apply(categorize_status)`, as a
+    categorical with int8 codes.
+
+    Parameters:
+    statuses (pd.Series): The account statuses.
+
+    Returns:
+    pd.Series: The categorized statuses, with the index of `statuses`.
+    """
+    return pd.Series(status_categorical(encode_status(statuses)), index=statuses.index, name=statuses.name)
 
 
-def plot_behavior_over_time(log, agent_ids=None, sample_size=None, period='W', data_type='transactions'):
+def plot_behavior_over_time(log, agent_ids=None, sample_size=None, period='W', data_type='transactions', max_lines=MAX_PLOTTED_AGENTS):
     """
     Plot behavior over time for different agents, aggregated over specified periods.
 
+    The log is aggregated once into an agent x period matrix of summed amounts with a single
+    groupby, instead of filtering and resampling the log once per agent, so this stays fast
+    on full logs. At most `max_lines` agents are drawn; the rest are left out at random.
+
     Parameters:
     log (pd.DataFrame): DataFrame containing the log (transactions or payments).
     agent_ids (list): List of agent IDs to include in the plot. If None, include all agents.
     sample_size (int): Number of agents to sample. If None, include all agents.
     period (str): Resampling period ('W' for weekly, 'M' for monthly).
     data_type (str): Type of data ('transactions' or 'payments').
+    max_lines (int): Maximum number of agents drawn. If None, draw every agent.
+
+    Returns:
+    pd.DataFrame: Summed amount per period (rows) and agent (columns), for every included
+    agent, including those not drawn.
     """
     if agent_ids is not None:
         log = log[log['agent_id'].isin(agent_ids)]
@@ -153,19 +360,30 @@ def plot_behavior_over_time(log, agent_ids=None, sample_size=None, period='W', d
         agent_ids = log['agent_id'].unique()
         sampled_agent_ids = np.random.choice(agent_ids, size=sample_size, replace=False)
         log = log[log['agent_id'].isin(sampled_agent_ids)]
-    
+
+    if not pd.api.types.is_datetime64_any_dtype(log['timestamp']):
+        log = log.assign(timestamp=pd.to_datetime(log['timestamp']))
+    amount_by_period = log.groupby(
+        ['agent_id', pd.Grouper(key='timestamp', freq=period)]
+    )['amount'].sum()
+    # Periods without events count as 0, as when resampling each agent's log.
+    behavior = amount_by_period.unstack('agent_id', fill_value=0).resample(period).sum()
+
+    plotted = behavior
+    if max_lines is not None and behavior.shape[1] > max_lines:
+        plotted = behavior[np.sort(np.random.choice(behavior.columns, size=max_lines, replace=False))]
+
     plt.figure(figsize=(12, 6))
-    for agent_id in log['agent_id'].unique():
-        agent_log = log[log['agent_id'] == agent_id]
-        agent_log.set_index('timestamp', inplace=True)
-        agent_log_resampled = agent_log['amount'].resample(period).sum()
-        plt.plot(agent_log_resampled.index, agent_log_resampled, label=f'Agent {agent_id}')
-    
+    lines = plt.plot(plotted.index, plotted.to_numpy())
     plt.xlabel('Timestamp')
     plt.ylabel('Amount')
-    plt.title(f'{data_type.capitalize()} Behavior Over Time for Different Agents (Aggregated by {period})')
-    plt.legend()
+    title = f'{data_type.capitalize()} Behavior Over Time for Different Agents (Aggregated by {period})'
+    if plotted is not behavior:
+        title += f'\n{plotted.shape[1]} of {behavior.shape[1]} agents shown'
+    plt.title(title)
+    plt.legend(lines, [f'Agent {agent_id}' for agent_id in plotted.columns])
     plt.show()
+    return behavior
 
 
 # Display the first few rows and data types of each table
@@ -0,0 +1,199 @@
+"""Vectorized account status encoding and per-agent status-transition features.
+
+Statuses are encoded as int8 codes into STATUS_CATEGORIES in one pass: raw values are
+factorized first, so only the distinct values go through the mapping table, however many
+rows there are. Status transitions come from one sort of the snapshots by (agent, time) and
+array comparisons between consecutive rows. They are summarized per agent so that the
+summaries of consecutive stretches of a log combine into that of the whole log, which lets
+the feature store fold appended snapshots in without rescanning the log.
+"""
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+
+
+GOOD, DELINQUENT, CHARGE_OFF = 0, 1, 2
+STATUS_CATEGORIES = ["Good", "Delinquent", "Charge Off"]
+# Raw status values that are not Good. Any other value, including a missing one, is Good.
+STATUS_CODES: Dict[str, int] = {"delinquent": DELINQUENT, "charge off": CHARGE_OFF}
+STATUS_DTYPE = pd.CategoricalDtype(STATUS_CATEGORIES)
+
+
+def encode_status(statuses: pd.Series) -> np.ndarray:
+    """Map raw status values to int8 codes into STATUS_CATEGORIES.
+
+    :param statuses: Raw statuses, e.g. "delinquent" or "charge off", as strings or as a
+        categorical
+    :type statuses: pd.Series
+    :return: int8 code per row
+    :rtype: np.ndarray
+    """
+    if isinstance(statuses.dtype, pd.CategoricalDtype):
+        raw_codes = statuses.cat.codes.to_numpy()
+        categories = statuses.cat.categories
+    else:
+        raw_codes, categories = pd.factorize(statuses)
+    # One extra GOOD entry at the end, which missing values' code -1 picks.
+    table = np.array(
+        [STATUS_CODES.get(category, GOOD) for category in categories] + [GOOD],
+        dtype=np.int8,
+    )
+    return table[raw_codes]
+
+
+def status_categorical(codes: np.ndarray) -> pd.Categorical:
+    """Wrap int8 status codes as a categorical of 'Good', 'Delinquent' and 'Charge Off'."""
+    return pd.Categorical.from_codes(codes, dtype=STATUS_DTYPE)
+
+
+
+def status_from_missed_payments(missed_payments: pd.Series) -> np.ndarray:
+    """Status codes of account snapshots without a status column: Delinquent while any
+    payment is missed, else Good.
+    """
+    return np.where(missed_payments.to_numpy() > 0, DELINQUENT, GOOD).astype(np.int8)
+
+
+def account_status_codes(account_state_df: pd.DataFrame) -> np.ndarray:
+    """Status code of each account snapshot, from its status column if the log has one."""
+    if "status" in account_state_df.columns:
+        return encode_status(account_state_df["status"])
+    return status_from_missed_payments(account_state_df["current_missed_payments"])
+
+
+# Stands in for "never delinquent" in int64 nanosecond timestamps, so that min() skips it.
+NEVER_BAD_NS = np.iinfo(np.int64).max
+# How the columns of two `status_transitions` summaries combine, earlier one first.
+TRANSITION_AGGREGATES = {
+    "first_ns": "min",
+    "first_bad_ns": "min",
+    "starts_bad": "first",
+    "ends_bad": "last",
+    "episodes": "sum",
+    "snapshots": "sum",
+    "bad_snapshots": "sum",
+}
+
+
+def status_transitions(
+        agent_ids: np.ndarray,
+        timestamps: pd.Series,
+        status_codes: np.ndarray,
+    ) -> pd.DataFrame:
+    """Summarize each agent's sequence of status snapshots for `status_transition_features`.
+
+    :param agent_ids: Agent of each snapshot
+    :type agent_ids: np.ndarray
+    :param timestamps: Time of each snapshot
+    :type timestamps: pd.Series
+    :param status_codes: Status code of each snapshot, as from `account_status_codes`
+    :type status_codes: np.ndarray
+    :return: One row per agent, indexed by sorted agent_id, with the times of its first
+        snapshot and of its first non-Good one (NEVER_BAD_NS if none), whether its first
+        and last snapshots are non-Good, its number of runs of consecutive non-Good
+        snapshots (delinquent episodes), and its numbers of snapshots and of non-Good ones
+    :rtype: pd.DataFrame
+    """
+    agent_index, agent_codes = np.unique(np.asarray(agent_ids), return_inverse=True)
+    n_agents = len(agent_index)
+    event_ns = pd.to_datetime(timestamps).to_numpy(dtype="datetime64[ns]").view(np.int64)
+    # lexsort is stable, so snapshots with equal times stay in log order.
+    order = np.lexsort((event_ns, agent_codes))
+    sorted_codes = agent_codes[order]
+    sorted_ns = event_ns[order]
+    is_bad = status_codes[order] != GOOD
+
+    is_agent_start = np.ones(len(order), dtype=bool)
+    is_agent_start[1:] = sorted_codes[1:] != sorted_codes[:-1]
+    is_agent_end = np.ones(len(order), dtype=bool)
+    is_agent_end[:-1] = is_agent_start[1:]
+    is_episode_start = is_bad.copy()
+    is_episode_start[1:] &= is_agent_start[1:] | ~is_bad[:-1]
+
+    # Rows are time-sorted within each agent, so an agent's first bad row is its
+    #  first non-Good snapshot.
+    bad_codes = sorted_codes[is_bad]
+    is_first_bad = np.ones(len(bad_codes), dtype=bool)
+    is_first_bad[1:] = bad_codes[1:] != bad_codes[:-1]
+    first_bad_ns = np.full(n_agents, NEVER_BAD_NS)
+    first_bad_ns[bad_codes[is_first_bad]] = sorted_ns[is_bad][is_first_bad]
+
+    return pd.DataFrame(
+        {
+            "first_ns": sorted_ns[is_agent_start],
+            "first_bad_ns": first_bad_ns,
+            "starts_bad": is_bad[is_agent_start],
+            "ends_bad": is_bad[is_agent_end],
+            "episodes": np.bincount(sorted_codes[is_episode_start], minlength=n_agents),
+            "snapshots": np.bincount(sorted_codes, minlength=n_agents),
+            "bad_snapshots": np.bincount(sorted_codes[is_bad], minlength=n_agents),
+        },
+        index=pd.Index(agent_index, name="agent_id"),
+    )
+
+
+def combine_status_transitions(earlier: pd.DataFrame, later: pd.DataFrame) -> pd.DataFrame:
+    """Combine the `status_transitions` of two consecutive stretches of a log.
+
+    :param earlier: Summary of the earlier snapshots
+    :type earlier: pd.DataFrame
+    :param later: Summary of the snapshots that follow them, e.g. rows appended to the log
+    :type later: pd.DataFrame
+    :return: Summary of both stretches, as `status_transitions` of all their snapshots
+    :rtype: pd.DataFrame
+    """
+    if len(earlier) == 0:
+        return later
+    combined = pd.concat([earlier, later]).groupby(level=0).agg(TRANSITION_AGGREGATES)
+    # An episode still running at the end of `earlier` continues into `later`, where it
+    #  was counted again.
+    common = earlier.index.intersection(later.index)
+    is_continued = (
+        earlier.loc[common, "ends_bad"].to_numpy()
+        & later.loc[common, "starts_bad"].to_numpy()
+    )
+    combined.loc[common[is_continued], "episodes"] -= 1
+    return combined
+
+
+def _month_number(ns: np.ndarray) -> np.ndarray:
+    return ns.view("datetime64[ns]").astype("datetime64[M]").astype(np.int64)
+
+
+def status_transition_features(
+        transitions: pd.DataFrame,
+        agent_index: pd.Index,
+    ) -> Dict[str, np.ndarray]:
+    """Per-agent delinquency history from a `status_transitions` summary.
+
+    - months_to_first_delinquency: calendar months from the agent's first snapshot to its
+      first Delinquent or Charge Off one, NaN if there is none;
+    - delinquent_episodes: number of runs of consecutive non-Good snapshots;
+    - delinquent_share: fraction of the agent's snapshots that are not Good.
+    """
+    n_agents = len(agent_index)
+    # Scattered by position rather than reindexed, which would turn the int64 times into
+    #  floats wherever an agent has no snapshots.
+    positions = agent_index.get_indexer(transitions.index)
+    transitions = transitions[positions >= 0]
+    positions = positions[positions >= 0]
+    first_ns = transitions["first_ns"].to_numpy()
+    first_bad_ns = transitions["first_bad_ns"].to_numpy()
+    is_delinquent = first_bad_ns != NEVER_BAD_NS
+
+    months_to_first = np.full(n_agents, np.nan)
+    months_to_first[positions[is_delinquent]] = (
+        _month_number(first_bad_ns[is_delinquent]) - _month_number(first_ns[is_delinquent])
+    )
+    episodes = np.zeros(n_agents)
+    episodes[positions] = transitions["episodes"].to_numpy()
+    delinquent_share = np.zeros(n_agents)
+    delinquent_share[positions] = (
+        transitions["bad_snapshots"].to_numpy() / transitions["snapshots"].to_numpy()
+    )
+    return {
+        "months_to_first_delinquency": months_to_first,
+        "delinquent_episodes": episodes,
+        "delinquent_share": delinquent_share,
+    }
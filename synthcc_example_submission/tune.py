@@ -0,0 +1,202 @@
+import argparse
+import os
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+
+import cross_validation
+import features
+import schemas
+import status_encoding
+from cross_validation import FitConfig
+from features import build_features
+from schemas import read_table
+
+
+PREDICTION_WINDOW_MONTHS = [3, 6, 9, 12]  # Constant for this charge-off prediction task.
+LOG_NAMES = ("account_state_log", "payments_log", "transactions_log")
+WINDOW_MODES = {"joint": True, "independent": False}
+
+
+def main(
+        train_set_dir: str,
+        l2_values: List[float],
+        window_modes: List[str],
+        n_folds: int,
+        num_workers: int,
+        seed: int = 0,
+        min_folds: int = 2,
+        prune_margin: float = 0.02,
+        tune_thresholds: bool = True,
+        results_csv_path: Optional[str] = None,
+    ):
+    """Cross-validate train.py's model over a grid of L2 penalties and window modes.
+
+    :param train_set_dir: Directory with the three synthcc logs and labels.csv
+    :type train_set_dir: str
+    :param l2_values: L2 penalties to compare
+    :type l2_values: List[float]
+    :param window_modes: Keys of WINDOW_MODES to compare: one joint model across the
+        prediction windows, and/or one model per window
+    :type window_modes: List[str]
+    :param n_folds: Number of folds, stratified on charge-off within 12 months
+    :type n_folds: int
+    :param num_workers: Number of worker processes fitting (configuration, fold) pairs
+    :type num_workers: int
+    :param seed: Seed of the fold assignment
+    :type seed: int
+    :param min_folds: Folds a configuration is scored on before it may be dropped
+    :type min_folds: int
+    :param prune_margin: Drop a configuration once another's mean F1 beats it by more than
+        this on the same folds
+    :type prune_margin: float
+    :param tune_thresholds: Tune the decision thresholds on each fold's training rows, as
+        train.py does by default
+    :type tune_thresholds: bool
+    :param results_csv_path: If given, also write the results table to this CSV
+    :type results_csv_path: Optional[str]
+    """
+    log_paths = {
+        log_name: os.path.join(train_set_dir, f"{log_name}.csv") for log_name in LOG_NAMES
+    }
+    labels_path = os.path.join(train_set_dir, "labels.csv")
+    label_df = read_table(labels_path, "synthcc_labels", cached=True)
+    col_names = [
+        f"charge_off_within_{months}_months" for months in PREDICTION_WINDOW_MONTHS
+    ]
+    features_dfs = []
+
+    def fold_features(is_train: np.ndarray) -> pd.DataFrame:
+        # Per-agent log aggregates learn nothing from other agents, so one feature matrix
+        #  serves every fold. It is only built when the folds are not cached yet.
+        if not features_dfs:
+            features_df = build_features(
+                *(
+                    read_table(log_paths[log_name], log_name, cached=True)
+                    for log_name in LOG_NAMES
+                ),
+                PREDICTION_WINDOW_MONTHS,
+            )
+            # Agents with labels but no log rows get all-missing features.
+            features_dfs.append(features_df.reindex(label_df["agent_id"]))
+        return features_dfs[0]
+
+    entry_dir = cross_validation.prepare_folds(
+        fold_features,
+        label_df[col_names],
+        col_names[-1],
+        [
+            *log_paths.values(),
+            labels_path,
+            features.__file__,
+            schemas.__file__,
+            status_encoding.__file__,
+        ],
+        n_folds=n_folds,
+        seed=seed,
+    )
+    results_df = cross_validation.cross_validate(
+        entry_dir,
+        [
+            FitConfig(l2, joint=WINDOW_MODES[window_mode], tune_thresholds=tune_thresholds)
+            for l2 in l2_values
+            for window_mode in window_modes
+        ],
+        num_workers=num_workers,
+        min_folds=min_folds,
+        prune_margin=prune_margin,
+    )
+    print(results_df.to_string())
+    best = results_df.iloc[0]
+    print(
+        f"Best: python train.py --bth_train_set {train_set_dir} --l2 {best.l2:g}"
+        + ("" if best.joint else " --independent_windows")
+    )
+    if results_csv_path is not None:
+        results_df.to_csv(results_csv_path, index=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--bth_train_set",
+        type=str,
+        required=True,
+        help="Directory with the synthcc training logs and labels.csv, e.g. "
+             "../synthcc_train_set."
+    )
+    parser.add_argument(
+        "--l2",
+        type=float,
+        nargs="+",
+        default=[0.01, 0.1, 1.0, 10.0, 100.0],
+        help="L2 penalties to compare."
+    )
+    parser.add_argument(
+        "--windows",
+        type=str,
+        nargs="+",
+        choices=list(WINDOW_MODES),
+        default=list(WINDOW_MODES),
+        help="Window modes to compare: one joint, monotonic model across the prediction "
+             "windows, and/or one model per window (train.py's --independent_windows)."
+    )
+    parser.add_argument(
+        "--n_folds",
+        type=int,
+        default=5,
+        help="Number of cross-validation folds, stratified on charge-off within 12 months."
+    )
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        default=cross_validation.default_num_workers(),
+        help="Number of processes fitting (configuration, fold) pairs. Defaults to every "
+             "available CPU."
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="Seed of the fold assignment. Folds are cached per seed."
+    )
+    parser.add_argument(
+        "--min_folds",
+        type=int,
+        default=2,
+        help="Folds a configuration is scored on before it may be dropped."
+    )
+    parser.add_argument(
+        "--prune_margin",
+        type=float,
+        default=0.02,
+        help="Drop a configuration once another's mean F1 beats it by more than this on "
+             "the same folds. Pass inf to score every configuration on every fold."
+    )
+    parser.add_argument(
+        "--no_threshold_tuning",
+        action="store_true",
+        help="Predict at probability 0.5 instead of at the thresholds maximizing F1 on "
+             "each fold's training rows."
+    )
+    parser.add_argument(
+        "--results_csv",
+        type=str,
+        default=None,
+        help="Also write the results table to this CSV."
+    )
+
+    args = parser.parse_args()
+    main(
+        args.bth_train_set,
+        args.l2,
+        args.windows,
+        args.n_folds,
+        args.num_workers,
+        seed=args.seed,
+        min_folds=args.min_folds,
+        prune_margin=args.prune_margin,
+        tune_thresholds=not args.no_threshold_tuning,
+        results_csv_path=args.results_csv,
+    )
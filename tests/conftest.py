@@ -0,0 +1,23 @@
+import os
+import sys
+
+import pytest
+
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# The grading scripts and the synthcc example submission import their modules by sibling
+#  name. The modules both hold are identical copies, so either directory may provide them.
+for dir_name in ("grading", "synthcc_example_submission"):
+    sys.path.insert(0, os.path.join(REPO_DIR, dir_name))
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    """Keep the columnar cache of every test's tables out of ~/.cache."""
+    monkeypatch.setenv("BTH_CACHE_DIR", str(tmp_path / "columnar_cache"))
+
+
+@pytest.fixture(scope="session")
+def grading_data_dir(tmp_path_factory):
+    """Directory that benchmark_grading.generate_task_files writes test data into, once."""
+    return str(tmp_path_factory.mktemp("grading_data"))
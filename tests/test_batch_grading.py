@@ -0,0 +1,121 @@
+import os
+import shutil
+import subprocess
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import batch_grading
+from benchmark_grading import TASKS, generate_task_files
+
+
+N_ROWS = 2_000
+SORT_BY = {"ha": "f1_HadHeartAttack", "synthcc": "f1_avg"}
+
+
+def grading_csv(grading_output_dir, submission_name):
+    return pd.read_csv(
+        os.path.join(grading_output_dir, f"{submission_name}.csv"), index_col=0
+    )
+
+
+@pytest.mark.parametrize("num_workers", [1, 2])
+@pytest.mark.parametrize("task_name", sorted(TASKS))
+def test_batch_matches_one_at_a_time(
+        grading_data_dir, tmp_path, task_name, num_workers
+    ):
+    task = TASKS[task_name]
+    cases = ["valid", "valid_npz", "duplicate_ids", "mismatched_ids"]
+    for case in cases:
+        labels_path, _ = generate_task_files(task, N_ROWS, case, grading_data_dir)
+    data_dir = os.path.dirname(labels_path)
+    for case in ("valid", "valid_npz"):
+        task.grading_module.main(
+            os.path.join(data_dir, f"bth-results-{case}"),
+            labels_path,
+            str(tmp_path / "one"),
+        )
+
+    task.grading_module.main_batch(
+        [os.path.join(data_dir, "bth-results-*")],
+        labels_path,
+        str(tmp_path / "batch"),
+        num_workers=num_workers,
+    )
+    leaderboard_df = pd.read_csv(tmp_path / "batch" / "leaderboard.csv")
+    assert sorted(leaderboard_df["submission"]) == sorted(
+        f"bth-results-{case}" for case in cases
+    )
+    # Graded submissions rank first, best first, and failed ones record why.
+    is_graded = leaderboard_df["error"].isna()
+    assert is_graded.tolist() == [True, True, False, False]
+    assert leaderboard_df[SORT_BY[task_name]][is_graded].is_monotonic_decreasing
+    assert sorted(leaderboard_df.loc[is_graded, "submission"]) == [
+        "bth-results-valid", "bth-results-valid_npz"
+    ]
+    assert leaderboard_df.loc[~is_graded, "error"].str.startswith("ValueError").all()
+    for case in ("valid", "valid_npz"):
+        submission_name = f"bth-results-{case}"
+        pd.testing.assert_frame_equal(
+            grading_csv(tmp_path / "batch", submission_name),
+            grading_csv(tmp_path / "one", submission_name),
+        )
+
+
+def test_same_basename_dirs_get_separate_outputs(grading_data_dir, tmp_path):
+    task = TASKS["synthcc"]
+    labels_path, results_dir = generate_task_files(task, N_ROWS, "valid", grading_data_dir)
+    shutil.copytree(results_dir, tmp_path / "teamA" / "bth-results")
+    # Team B predicts the opposite of team A, so its scores differ.
+    os.makedirs(tmp_path / "teamB" / "bth-results")
+    pred_df = pd.read_csv(os.path.join(results_dir, "results.csv"))
+    pred_df[task.label_col_names] = 1 - pred_df[task.label_col_names]
+    pred_df.to_csv(tmp_path / "teamB" / "bth-results" / "results.csv", index=False)
+
+    task.grading_module.main_batch(
+        [str(tmp_path / "team*" / "bth-results")], labels_path, str(tmp_path / "out")
+    )
+    leaderboard_df = pd.read_csv(tmp_path / "out" / "leaderboard.csv")
+    assert sorted(leaderboard_df["submission"]) == [
+        "teamA__bth-results", "teamB__bth-results"
+    ]
+    f1 = {
+        name: grading_csv(tmp_path / "out", name).loc["f1", "avg"]
+        for name in leaderboard_df["submission"]
+    }
+    assert f1["teamA__bth-results"] != f1["teamB__bth-results"]
+    np.testing.assert_allclose(
+        leaderboard_df.set_index("submission")["f1_avg"].to_dict()["teamA__bth-results"],
+        f1["teamA__bth-results"],
+    )
+
+
+def test_submission_names():
+    assert batch_grading.submission_names(["a/x", "b/y"]) == {"a/x": "x", "b/y": "y"}
+    assert batch_grading.submission_names(["r/a/x", "r/b/x"]) == {
+        "r/a/x": "a__x", "r/b/x": "b__x"
+    }
+
+
+@pytest.mark.parametrize("mode_args", [
+    ["--results_dirs", "bth-results-*"],
+    ["--paired_results_dirs", "bth-results-a", "bth-results-b"],
+])
+def test_streaming_is_rejected_outside_single_results_dir(tmp_path, mode_args):
+    grading_dir = os.path.dirname(batch_grading.__file__)
+    completed = subprocess.run(
+        [
+            sys.executable,
+            os.path.join(grading_dir, "grade_synthbank_submission.py"),
+            *mode_args,
+            "--test_labels_path", str(tmp_path / "labels.csv"),
+            "--grading_output_dir", str(tmp_path / "out"),
+            "--streaming",
+        ],
+        capture_output=True,
+        text=True,
+    )
+    assert completed.returncode == 2
+    assert "--streaming is only supported with --results_dir" in completed.stderr
@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+import binary_results
+from benchmark_grading import TASKS, generate_task_files
+
+
+N_ROWS = 5_000
+
+
+@pytest.mark.parametrize("task_name", sorted(TASKS))
+def test_npz_matches_csv(grading_data_dir, task_name):
+    task = TASKS[task_name]
+    labels_path, csv_results_dir = generate_task_files(
+        task, N_ROWS, "valid", grading_data_dir
+    )
+    _, npz_results_dir = generate_task_files(task, N_ROWS, "valid_npz", grading_data_dir)
+    label_df = task.grading_module.load_labels(labels_path)
+    np.testing.assert_array_equal(
+        task.grading_module.load_aligned_predictions(npz_results_dir, label_df),
+        task.grading_module.load_aligned_predictions(csv_results_dir, label_df),
+    )
+
+
+def test_several_results_files_are_rejected(tmp_path):
+    for file_name in ("results.csv", "results.npz"):
+        (tmp_path / file_name).touch()
+    with pytest.raises(AssertionError, match="more than one results file"):
+        binary_results.find_results_file(str(tmp_path))
+
+
+def test_missing_results_file_defaults_to_csv(tmp_path):
+    assert binary_results.find_results_file(str(tmp_path)) == str(tmp_path / "results.csv")
@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+import bootstrap_metrics
+import confusion_metrics
+
+
+METRICS = {"f1": confusion_metrics.f1, "mcc": confusion_metrics.mcc}
+COL_NAMES = ["a", "b", "c"]
+
+
+@pytest.fixture
+def labels_and_preds():
+    rng = np.random.default_rng(0)
+    labels = (rng.random((5_000, 3)) < 0.2).astype(np.int8)
+    # Right on 80% of the cells.
+    preds = np.where(rng.random(labels.shape) < 0.8, labels, 1 - labels).astype(np.int8)
+    return labels, preds
+
+
+def test_identical_predictions_have_zero_difference(labels_and_preds):
+    labels, preds = labels_and_preds
+    comparison_df = bootstrap_metrics.paired_comparison_df(
+        labels, preds, preds.copy(), METRICS, COL_NAMES, n_resamples=200,
+        confidence=0.95, seed=0, avg_col_name="avg",
+    )
+    for metric_name in METRICS:
+        for row_suffix in ("diff", "diff_ci_low", "diff_ci_high"):
+            assert (comparison_df.loc[f"{metric_name}_{row_suffix}"] == 0).all()
+        assert (comparison_df.loc[f"{metric_name}_p_value"] == 1).all()
+        assert comparison_df.loc[f"{metric_name}_baseline"].equals(
+            comparison_df.loc[f"{metric_name}_candidate"]
+        )
+
+
+def test_confidence_interval_contains_the_point_estimate(labels_and_preds):
+    labels, preds = labels_and_preds
+    samples = bootstrap_metrics.bootstrap_metrics(
+        bootstrap_metrics.confusion_categories(labels, preds), METRICS, 1_000, seed=0
+    )
+    ci_df = bootstrap_metrics.confidence_interval_df(samples, COL_NAMES, 0.95, "avg")
+    counts = confusion_metrics.confusion_counts(labels, preds)
+    for metric_name, metric_fn in METRICS.items():
+        point = metric_fn(counts)
+        point = np.append(point, point.mean())
+        assert (ci_df.loc[f"{metric_name}_ci_low"].to_numpy() < point).all()
+        assert (point < ci_df.loc[f"{metric_name}_ci_high"].to_numpy()).all()
+
+
+def test_resamples_keep_the_number_of_rows(labels_and_preds):
+    labels, preds = labels_and_preds
+    combinations, frequencies = bootstrap_metrics.category_combinations(
+        bootstrap_metrics.confusion_categories(labels, preds)
+    )
+    counts = bootstrap_metrics.resample_counts(
+        combinations, frequencies, 50, np.random.default_rng(0)
+    )
+    totals = counts.tp + counts.fp + counts.fn + counts.tn
+    assert (totals == len(labels)).all()
@@ -0,0 +1,58 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+import columnar_cache
+
+
+def write_csv(path, n_rows, seed):
+    rng = np.random.default_rng(seed)
+    pd.DataFrame({
+        "agent_id": rng.permutation(n_rows),
+        "label": rng.choice(["a", "b"], n_rows),
+    }).to_csv(path, index=False)
+
+
+def test_sorted_load_maps_the_cache_without_a_copy(tmp_path):
+    csv_path = str(tmp_path / "labels.csv")
+    write_csv(csv_path, 1_000, seed=0)
+    expected = pd.read_csv(csv_path, dtype={"label": "category"}).sort_values(
+        "agent_id", kind="stable", ignore_index=True
+    )
+    for _ in range(2):
+        df = columnar_cache.read_csv_cached(csv_path, sort_by="agent_id")
+        pd.testing.assert_frame_equal(df, expected)
+    # The second load is served from the cache's sorted columns as they are mapped.
+    assert isinstance(df["agent_id"].to_numpy().base, np.memmap)
+
+
+def test_cache_is_pruned_to_its_size_limit_least_recently_used_first(
+        tmp_path, monkeypatch
+    ):
+    cache_root = os.environ["BTH_CACHE_DIR"]
+    csv_paths = []
+    for i in range(3):
+        csv_paths.append(str(tmp_path / f"{i}.csv"))
+        write_csv(csv_paths[-1], 1_000, seed=i)
+    columnar_cache.read_csv_cached(csv_paths[0])
+    columnar_cache.read_csv_cached(csv_paths[1])
+    entry_bytes = max(
+        columnar_cache._entry_size(entry.path)
+        for entry in os.scandir(cache_root) if entry.is_dir()
+    )
+    # Room for two entries: adding a third removes the least recently used one. Loading
+    #  the first again marks it as used, so the second is the one removed. Both entries
+    #  are dated back first, as they may share a timestamp on a coarse clock.
+    monkeypatch.setenv("BTH_CACHE_MAX_BYTES", str(2 * entry_bytes + entry_bytes // 2))
+    for entry in os.scandir(cache_root):
+        if entry.is_dir():
+            os.utime(os.path.join(entry.path, "meta.json"), ns=(0, 0))
+    columnar_cache.read_csv_cached(csv_paths[0])
+    columnar_cache.read_csv_cached(csv_paths[2])
+    entry_digests = sorted(
+        entry.name.split("-")[0] for entry in os.scandir(cache_root) if entry.is_dir()
+    )
+    assert entry_digests == sorted(
+        columnar_cache.file_digest(csv_paths[i], cache_root) for i in (0, 2)
+    )
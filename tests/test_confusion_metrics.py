@@ -0,0 +1,74 @@
+import math
+
+import numpy as np
+import pytest
+
+import confusion_metrics
+
+
+def brute_force_metrics(labels, preds):
+    # One column, counted row by row, with sklearn's zero_division=0.
+    tp = fp = fn = tn = 0
+    for label, pred in zip(labels, preds):
+        tp += label and pred
+        fp += not label and pred
+        fn += label and not pred
+        tn += not label and not pred
+    mcc_denominator = math.sqrt((tp + fp) * (tp + fn) * (tn + fp) * (tn + fn))
+    return {
+        "counts": (tp, fp, fn, tn),
+        "f1": 2 * tp / (2 * tp + fp + fn) if tp + fp + fn else 0.0,
+        "precision": tp / (tp + fp) if tp + fp else 0.0,
+        "recall": tp / (tp + fn) if tp + fn else 0.0,
+        "mcc": (tp * tn - fp * fn) / mcc_denominator if mcc_denominator else 0.0,
+    }
+
+
+def labels_and_preds(seed, n_rows=1_000):
+    rng = np.random.default_rng(seed)
+    labels = (rng.random((n_rows, 4)) < 0.3).astype(np.int8)
+    preds = (rng.random((n_rows, 4)) < 0.4).astype(np.int8)
+    # Degenerate columns: no positive predictions, and every label positive.
+    preds[:, 2] = 0
+    labels[:, 3] = 1
+    return labels, preds
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_metrics_match_brute_force(seed):
+    labels, preds = labels_and_preds(seed)
+    counts = confusion_metrics.confusion_counts(labels, preds)
+    for col in range(labels.shape[1]):
+        expected = brute_force_metrics(labels[:, col].tolist(), preds[:, col].tolist())
+        assert tuple(count[col] for count in counts) == expected["counts"]
+        for metric_name in ("f1", "precision", "recall", "mcc"):
+            metric_fn = getattr(confusion_metrics, metric_name)
+            assert metric_fn(counts)[col] == pytest.approx(expected[metric_name])
+
+
+def test_metrics_match_sklearn():
+    sklearn_metrics = pytest.importorskip("sklearn.metrics")
+    labels, preds = labels_and_preds(seed=0)
+    counts = confusion_metrics.confusion_counts(labels, preds)
+    sklearn_fns = {
+        "f1": sklearn_metrics.f1_score,
+        "precision": sklearn_metrics.precision_score,
+        "recall": sklearn_metrics.recall_score,
+    }
+    for col in range(labels.shape[1]):
+        for metric_name, sklearn_fn in sklearn_fns.items():
+            assert getattr(confusion_metrics, metric_name)(counts)[col] == pytest.approx(
+                sklearn_fn(labels[:, col], preds[:, col], zero_division=0)
+            )
+        assert confusion_metrics.mcc(counts)[col] == pytest.approx(
+            sklearn_metrics.matthews_corrcoef(labels[:, col], preds[:, col])
+        )
+
+
+def test_mcc_does_not_overflow_at_scale():
+    # Counts whose four-way product is far beyond int64.
+    n = 10**7
+    counts = confusion_metrics.ConfusionCounts(
+        *(np.array([count], dtype=np.int64) for count in (4 * n, n, n, 4 * n))
+    )
+    assert confusion_metrics.mcc(counts)[0] == pytest.approx(15 / 25)
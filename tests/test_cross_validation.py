@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import cross_validation
+from cross_validation import FitConfig
+
+
+N_ROWS = 600
+CONFIGS = [
+    FitConfig(l2=l2, joint=joint) for l2 in (0.1, 10.0) for joint in (False, True)
+]
+
+
+@pytest.fixture
+def entry_dir(tmp_path):
+    rng = np.random.default_rng(0)
+    features_df = pd.DataFrame(rng.normal(size=(N_ROWS, 4)), columns=list("wxyz"))
+    risk = features_df["w"] + 0.5 * features_df["x"] + rng.normal(size=N_ROWS)
+    # Nested targets, like charge-off within 3 and 6 months.
+    labels_df = pd.DataFrame({"within_3": risk > 1.5, "within_6": risk > 1.0})
+    source_path = tmp_path / "source.txt"
+    source_path.write_text("features")
+    return cross_validation.prepare_folds(
+        lambda is_train: features_df,
+        labels_df,
+        "within_6",
+        [str(source_path)],
+        n_folds=3,
+        cache_dir=str(tmp_path / "cv_cache"),
+    )
+
+
+def test_stratified_folds_spread_each_stratum_evenly():
+    strata = np.repeat([0, 1], [90, 30])
+    folds = cross_validation.stratified_folds(strata, n_folds=3, seed=0)
+    for stratum, n_rows in ((0, 90), (1, 30)):
+        assert np.bincount(folds[strata == stratum]).tolist() == [n_rows // 3] * 3
+
+
+@pytest.mark.parametrize("num_workers", [2, 3])
+def test_pool_matches_serial_run(entry_dir, num_workers):
+    # No pruning: which configurations get dropped depends on the order jobs finish in.
+    serial_df = cross_validation.cross_validate(
+        entry_dir, CONFIGS, num_workers=1, prune_margin=np.inf
+    )
+    pool_df = cross_validation.cross_validate(
+        entry_dir, CONFIGS, num_workers=num_workers, prune_margin=np.inf
+    )
+    pd.testing.assert_frame_equal(pool_df, serial_df)
+    assert (serial_df["folds_scored"] == 3).all()
+    assert not serial_df["pruned"].any()
+
+
+def test_clearly_worse_configuration_is_dropped_early(entry_dir):
+    configs = [FitConfig(l2=0.1), FitConfig(l2=1e9, tune_thresholds=False)]
+    summary_df = cross_validation.cross_validate(
+        entry_dir, configs, num_workers=1, min_folds=1, prune_margin=0.0
+    ).set_index("l2")
+    assert summary_df.loc[1e9, "pruned"]
+    assert summary_df.loc[1e9, "folds_scored"] == 1
+    assert summary_df.loc[0.1, "folds_scored"] == 3
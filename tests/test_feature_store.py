@@ -0,0 +1,126 @@
+import os
+
+import pandas as pd
+import pytest
+
+import generate_logs
+from feature_store import LOG_NAMES, FeatureStore
+from features import build_features
+from schemas import read_table
+
+
+WINDOWS_MONTHS = (3, 6, 9, 12)
+
+
+@pytest.fixture(scope="module")
+def full_logs_dir(tmp_path_factory):
+    out_dir = str(tmp_path_factory.mktemp("synthcc_logs"))
+    generate_logs.main(
+        out_dir, n_agents=300, n_weeks=40, start_date="2023-01-02", agents_per_chunk=100,
+        seed=0,
+    )
+    return out_dir
+
+
+def read_lines(logs_dir):
+    lines = {}
+    for log_name in LOG_NAMES:
+        with open(os.path.join(logs_dir, f"{log_name}.csv")) as f:
+            lines[log_name] = f.readlines()
+    return lines
+
+
+def write_prefix(lines, logs_dir, fraction):
+    # The logs are written in time order, so a prefix of each is the log as of some time.
+    n_rows = {}
+    for log_name, log_lines in lines.items():
+        n_rows[log_name] = round((len(log_lines) - 1) * fraction)
+        with open(os.path.join(logs_dir, f"{log_name}.csv"), "w") as f:
+            f.writelines(log_lines[:1 + n_rows[log_name]])
+    return n_rows
+
+
+def expected_features(logs_dir):
+    return build_features(
+        *(
+            read_table(os.path.join(logs_dir, f"{log_name}.csv"), log_name)
+            for log_name in LOG_NAMES
+        ),
+        WINDOWS_MONTHS,
+    )
+
+
+def test_features_match_build_features(full_logs_dir, tmp_path):
+    store = FeatureStore(str(tmp_path / "store"), WINDOWS_MONTHS)
+    store.update(full_logs_dir)
+    pd.testing.assert_frame_equal(
+        store.features(), expected_features(full_logs_dir), rtol=1e-5
+    )
+
+
+def test_incremental_features_match_build_features(full_logs_dir, tmp_path):
+    lines = read_lines(full_logs_dir)
+    logs_dir = tmp_path / "logs"
+    logs_dir.mkdir()
+    store_dir = str(tmp_path / "store")
+    n_rows = dict.fromkeys(LOG_NAMES, 0)
+    for fraction in (0.3, 0.7, 1.0):
+        n_old_rows = n_rows
+        n_rows = write_prefix(lines, str(logs_dir), fraction)
+        # A new instance per run, as in __main__.py, so the store is reloaded from disk.
+        store = FeatureStore(store_dir, WINDOWS_MONTHS)
+        # Only the appended rows are ingested, not the whole logs again.
+        assert store.update(str(logs_dir)) == {
+            log_name: n_rows[log_name] - n_old_rows[log_name] for log_name in LOG_NAMES
+        }
+        pd.testing.assert_frame_equal(
+            store.features(), expected_features(str(logs_dir)), rtol=1e-5
+        )
+
+
+def test_update_writes_only_the_new_events(full_logs_dir, tmp_path):
+    lines = read_lines(full_logs_dir)
+    logs_dir = tmp_path / "logs"
+    logs_dir.mkdir()
+    store_dir = tmp_path / "store"
+    write_prefix(lines, str(logs_dir), 0.9)
+    FeatureStore(str(store_dir), WINDOWS_MONTHS).update(str(logs_dir))
+    segments_before = {
+        path.name: path.stat().st_mtime_ns for path in (store_dir / "segments").iterdir()
+    }
+    write_prefix(lines, str(logs_dir), 1.0)
+    FeatureStore(str(store_dir), WINDOWS_MONTHS).update(str(logs_dir))
+    segments_after = {
+        path.name: path.stat().st_mtime_ns for path in (store_dir / "segments").iterdir()
+    }
+    # Earlier segments are kept as they were, and each kind of event gets one new one.
+    kept = {name: segments_before[name] for name in segments_before.keys() & segments_after}
+    assert kept == {name: segments_after[name] for name in kept}
+    assert len(segments_after.keys() - segments_before.keys()) == 3
+
+
+def test_rewrite_in_the_middle_of_a_log_rebuilds_the_store(full_logs_dir, tmp_path):
+    lines = read_lines(full_logs_dir)
+    logs_dir = tmp_path / "logs"
+    logs_dir.mkdir()
+    store_dir = str(tmp_path / "store")
+    write_prefix(lines, str(logs_dir), 1.0)
+    FeatureStore(store_dir, WINDOWS_MONTHS).update(str(logs_dir))
+    # Same size, same header and tail: only a row far from the ingested offset changes.
+    #  The log is small enough that the blocks fingerprinted cover all of it.
+    payments = list(lines["payments_log"])
+    i = len(payments) // 3
+    fields = payments[i].rstrip("\n").split(",")
+    amount_col = payments[0].rstrip("\n").split(",").index("amount")
+    # Every digit of the amount shifted by one keeps its length.
+    shift_digits = str.maketrans("0123456789", "1234567890")
+    fields[amount_col] = fields[amount_col].translate(shift_digits)
+    payments[i] = ",".join(fields) + "\n"
+    with open(os.path.join(logs_dir, "payments_log.csv"), "w") as f:
+        f.writelines(payments)
+    store = FeatureStore(store_dir, WINDOWS_MONTHS)
+    n_new_rows = store.update(str(logs_dir))
+    assert n_new_rows["payments_log"] == len(payments) - 1
+    pd.testing.assert_frame_equal(
+        store.features(), expected_features(str(logs_dir)), rtol=1e-5
+    )
@@ -0,0 +1,44 @@
+import os
+import subprocess
+import sys
+
+import pandas as pd
+
+from conftest import REPO_DIR
+
+
+HA_SUBMISSION_DIR = os.path.join(REPO_DIR, "ha_example_submission")
+# Run from the ha submission, whose `features` module differs from the synthcc one the
+#  other tests import.
+WRITE_RESULTS = """
+import sys
+from streaming_inference import write_results
+inputs_csv_path, results_csv_path, num_workers = sys.argv[1:]
+write_results(
+    inputs_csv_path, results_csv_path, None, int(num_workers), chunk_bytes=2**10, seed=0
+)
+"""
+
+
+def test_random_guesses_do_not_depend_on_the_number_of_workers(tmp_path):
+    inputs_csv_path = str(tmp_path / "inputs.csv")
+    pd.DataFrame({
+        "PatientID": range(2_000),
+        "State": "Iowa",
+        "Sex": "Female",
+        "BMI": 26.44,
+        "SleepHours": 4,
+        "HadStroke": "No",
+    }).to_csv(inputs_csv_path, index=False)
+    results = {}
+    for num_workers in (1, 3):
+        results_csv_path = str(tmp_path / f"results_{num_workers}.csv")
+        subprocess.run(
+            [sys.executable, "-c", WRITE_RESULTS, inputs_csv_path, results_csv_path,
+             str(num_workers)],
+            cwd=HA_SUBMISSION_DIR,
+            check=True,
+        )
+        results[num_workers] = pd.read_csv(results_csv_path)
+    pd.testing.assert_frame_equal(results[1], results[3])
+    assert results[1]["PatientID"].tolist() == list(range(2_000))
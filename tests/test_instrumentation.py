@@ -0,0 +1,64 @@
+import json
+import os
+import subprocess
+import sys
+import time
+
+import instrumentation
+
+
+INSTRUMENTATION = instrumentation.__file__
+
+
+def is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    # A zombie still accepts signals; it is not running any more.
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return f.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except FileNotFoundError:
+        return not os.path.isdir("/proc")
+
+
+def test_timeout_kills_the_command_and_its_descendants(tmp_path):
+    report_path = str(tmp_path / "report.timings.json")
+    pid_path = tmp_path / "grandchild.pid"
+    # The command starts a grandchild and waits on it, like __main__.py with a worker pool.
+    command = f"sleep 60 & echo $! > {pid_path}; wait"
+    result = subprocess.run(
+        [
+            sys.executable, INSTRUMENTATION, "run", "--report", report_path,
+            "--stage", "inference", "--timeout_s", "1", "--", "bash", "-c", command,
+        ],
+        capture_output=True,
+        text=True,
+        timeout=30,
+    )
+    assert result.returncode == 124
+    assert "exceeded its 1s budget" in result.stdout
+    grandchild_pid = int(pid_path.read_text())
+    deadline = time.time() + 5
+    while is_running(grandchild_pid) and time.time() < deadline:
+        time.sleep(0.05)
+    assert not is_running(grandchild_pid)
+    with open(report_path) as f:
+        assert [record["stage"] for record in json.load(f)["stages"]] == ["inference"]
+
+
+def test_append_stages_replaces_a_stage_run_again(tmp_path):
+    report_path = str(tmp_path / "report.timings.json")
+    instrumentation.append_stages(report_path, [
+        instrumentation.stage_record("inference", 1.0),
+        instrumentation.stage_record("grading", 2.0),
+    ])
+    instrumentation.append_stages(
+        report_path, [instrumentation.stage_record("grading", 3.0)]
+    )
+    with open(report_path) as f:
+        stages = json.load(f)["stages"]
+    assert [(record["stage"], record["wall_s"]) for record in stages] == [
+        ("inference", 1.0), ("grading", 3.0)
+    ]
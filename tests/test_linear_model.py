@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+from linear_model import DEFAULT_THRESHOLD, best_f1_thresholds
+
+
+def brute_force_best_f1(scores, labels):
+    # Every distinct score as a threshold, each scored from scratch.
+    best_threshold, best_f1 = np.inf, 0.0
+    for threshold in np.unique(scores):
+        predicted = scores >= threshold
+        true_pos = np.sum(predicted & labels)
+        f1 = 2 * true_pos / (predicted.sum() + labels.sum())
+        if f1 > best_f1:
+            best_threshold, best_f1 = threshold, f1
+    return best_threshold, best_f1
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_sweep_matches_brute_force_scan(seed):
+    rng = np.random.default_rng(seed)
+    n_rows = 500
+    # Rounded scores, so there are many ties to step over.
+    scores = np.round(rng.random((n_rows, 3)), 2)
+    labels = rng.random((n_rows, 3)) < scores * rng.random(3)
+    thresholds, f1 = best_f1_thresholds(scores, labels)
+    for target in range(3):
+        _, expected_f1 = brute_force_best_f1(
+            scores[:, target], labels[:, target]
+        )
+        assert f1[target] == pytest.approx(expected_f1)
+        # The threshold itself may differ only between cuts that tie on F1.
+        predicted = scores[:, target] >= thresholds[target]
+        assert 2 * np.sum(predicted & labels[:, target]) / (
+            predicted.sum() + labels[:, target].sum()
+        ) == pytest.approx(expected_f1)
+
+
+def test_target_without_positives_predicts_none():
+    thresholds, f1 = best_f1_thresholds(np.array([[0.2], [0.9]]), np.array([[0], [0]]))
+    assert thresholds.tolist() == [np.inf]
+    assert f1.tolist() == [0.0]
+
+
+def test_no_rows_keeps_the_default_threshold():
+    thresholds, f1 = best_f1_thresholds(np.empty((0, 4)), np.empty((0, 4)))
+    assert thresholds.tolist() == [DEFAULT_THRESHOLD] * 4
+    assert f1.tolist() == [0.0] * 4
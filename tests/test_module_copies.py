@@ -0,0 +1,5 @@
+from check_module_copies import find_diverged_copies
+
+
+def test_shared_module_copies_are_identical():
+    assert find_diverged_copies() == []
@@ -0,0 +1,102 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import prediction_checks
+import streaming_grading
+from benchmark_grading import TASKS, generate_task_files
+
+
+def test_header_only_results_are_rejected(grading_data_dir, tmp_path):
+    task = TASKS["synthcc"]
+    labels_path, _ = generate_task_files(task, 1_000, "valid", grading_data_dir)
+    results_path = tmp_path / "results.csv"
+    results_path.write_text(",".join([task.id_col_name] + task.label_col_names) + "\n")
+    with pytest.raises(AssertionError, match="has no rows"):
+        prediction_checks.etl_binary_predictions(
+            str(results_path), task.id_col_name, task.label_col_names
+        )
+    with pytest.raises(AssertionError, match="has no rows"):
+        streaming_grading.stream_confusion_counts(
+            str(results_path), labels_path, task.id_col_name, task.label_col_names,
+            task.entity,
+        )
+
+
+def test_object_columns_of_numbers_are_accepted():
+    pred_df = pd.DataFrame({
+        "agent_id": pd.Series(["1", 2], dtype=object),
+        "pred": pd.Series(["1", 0], dtype=object),
+    })
+    assert prediction_checks.check_id_column(pred_df["agent_id"]).tolist() == [1, 2]
+    np.testing.assert_array_equal(
+        prediction_checks.validate_binary_columns(pred_df, ["pred"]), [[1], [0]]
+    )
+
+
+def test_first_non_number_is_reported():
+    pred_df = pd.DataFrame({"pred": pd.Series([1, 0, "x", "y"], dtype=object)})
+    with pytest.raises(AssertionError, match=r"row 12 \(line 14 of results.csv\)"):
+        prediction_checks.validate_binary_columns(pred_df, ["pred"], first_row=10)
+
+
+
+def test_reconcile_ids():
+    label_ids = np.arange(100)
+    shuffled_ids = np.random.default_rng(0).permutation(label_ids)
+    prediction_checks.reconcile_ids(shuffled_ids, label_ids, "agents")
+    with pytest.raises(ValueError, match="Labels have more agents than predictions"):
+        prediction_checks.reconcile_ids(label_ids[2:], label_ids, "agents")
+    with pytest.raises(ValueError, match=r"more than one row.*Duplicated agents: \[5\]"):
+        prediction_checks.reconcile_ids(np.append(label_ids, 5), label_ids, "agents")
+    with pytest.raises(ValueError, match=r"100 agents in labels but not in pred: \[0, 1,"):
+        prediction_checks.reconcile_ids(label_ids + 1000, label_ids, "agents")
+
+
+def test_first_invalid_prediction_is_reported_by_column_and_row():
+    pred_df = pd.DataFrame({
+        "a": np.zeros(10, dtype=np.int64),
+        "b": np.ones(10, dtype=np.int64),
+        "c": np.zeros(10, dtype=np.int64),
+    })
+    pred_df.loc[7, "a"] = 2
+    pred_df.loc[3, "c"] = -1
+    # The earliest row wins over the leftmost column.
+    with pytest.raises(
+        AssertionError,
+        match=r"Column `c` in results.csv does not consist of 0s and 1s: value -1 at row "
+              r"23 \(line 25 of results.csv\)\. 2 invalid prediction\(s\) among rows 20 to "
+              r"29\.",
+    ):
+        prediction_checks.validate_binary_columns(pred_df, ["a", "b", "c"], first_row=20)
+
+
+@pytest.mark.parametrize("value, problem", [
+    (np.nan, "is missing a value"),
+    (0.5, "does not consist of integers: value 0.5"),
+    (256, "does not consist of 0s and 1s: value 256"),
+])
+def test_each_kind_of_invalid_prediction_is_named(value, problem):
+    pred_df = pd.DataFrame({"pred": pd.Series([0, 1, value], dtype=np.float64)})
+    if value == 256:
+        # Checked in its own dtype, not narrowed first, where 256 would wrap to 0.
+        pred_df["pred"] = pred_df["pred"].astype(np.int16)
+    with pytest.raises(AssertionError, match=rf"{problem} at row 2 \(line 4"):
+        prediction_checks.validate_binary_columns(pred_df, ["pred"])
+
+
+def test_valid_predictions_of_mixed_dtypes_are_cast_to_int8():
+    pred_df = pd.DataFrame({
+        "a": np.array([True, False, True]),
+        "b": np.array([0.0, 1.0, 1.0]),
+        "c": np.array([1, 0, 0], dtype=np.uint8),
+    })
+    block = prediction_checks.validate_binary_columns(pred_df, ["c", "a", "b"])
+    assert block.dtype == np.int8
+    np.testing.assert_array_equal(block, [[1, 1, 0], [0, 0, 1], [0, 1, 1]])
+
+
+def test_binary_results_report_rows_without_lines():
+    pred_df = pd.DataFrame({"pred": np.array([0, 3], dtype=np.int8)})
+    with pytest.raises(AssertionError, match=r"value 3 at row 1\. "):
+        prediction_checks.validate_binary_columns(pred_df, ["pred"], "results.npz")
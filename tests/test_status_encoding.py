@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+
+from status_encoding import (
+    combine_status_transitions,
+    status_from_missed_payments,
+    status_transition_features,
+    status_transitions,
+)
+
+
+# Monthly snapshots of two agents, listed out of time order. Agent 1 is delinquent in
+#  March-April and again in June; agent 2 never is.
+ACCOUNT_STATE_ROWS = [
+    (1, "2023-06-01", 1),
+    (1, "2023-01-01", 0),
+    (2, "2023-01-15", 0),
+    (1, "2023-02-01", 0),
+    (1, "2023-03-01", 2),
+    (2, "2023-02-15", 0),
+    (1, "2023-04-01", 1),
+    (1, "2023-05-01", 0),
+]
+
+
+def account_state_log(rows):
+    return pd.DataFrame(rows, columns=["agent_id", "timestamp", "current_missed_payments"])
+
+
+def transitions_of(log):
+    return status_transitions(
+        log["agent_id"].to_numpy(),
+        pd.to_datetime(log["timestamp"]),
+        status_from_missed_payments(log["current_missed_payments"]),
+    )
+
+
+def test_status_transition_features():
+    agent_index = pd.Index([1, 2, 3], name="agent_id")
+    features = status_transition_features(
+        transitions_of(account_state_log(ACCOUNT_STATE_ROWS)), agent_index
+    )
+    np.testing.assert_array_equal(
+        features["months_to_first_delinquency"], [2, np.nan, np.nan]
+    )
+    np.testing.assert_array_equal(features["delinquent_episodes"], [2, 0, 0])
+    np.testing.assert_allclose(features["delinquent_share"], [3 / 6, 0, 0])
+
+
+def test_combined_transitions_match_whole_log():
+    log = account_state_log(ACCOUNT_STATE_ROWS)
+    log = log.sort_values("timestamp", kind="stable", ignore_index=True)
+    whole = transitions_of(log)
+    # Cuts inside agent 1's March-April episode and between its two episodes.
+    for cut in range(1, len(log)):
+        combined = combine_status_transitions(
+            transitions_of(log[:cut]), transitions_of(log[cut:])
+        )
+        pd.testing.assert_frame_equal(combined, whole, check_dtype=False)
@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+import binary_results
+import confusion_metrics
+import streaming_grading
+from benchmark_grading import TASKS, generate_task_files
+
+
+N_ROWS = 5_000
+# Small enough that the streaming path splits the files into several chunks and partitions.
+CHUNK_SIZE = 700
+NUM_PARTITIONS = 3
+
+
+def in_memory_counts(task, labels_path, results_dir):
+    label_df = task.grading_module.load_labels(labels_path)
+    preds = task.grading_module.load_aligned_predictions(results_dir, label_df)
+    labels = label_df[task.label_col_names].to_numpy(dtype=np.int8)
+    return confusion_metrics.confusion_counts(labels, preds)
+
+
+def streaming_counts(task, labels_path, results_dir):
+    return streaming_grading.stream_confusion_counts(
+        binary_results.find_results_file(results_dir),
+        labels_path,
+        task.id_col_name,
+        task.label_col_names,
+        task.entity,
+        chunk_size=CHUNK_SIZE,
+        num_partitions=NUM_PARTITIONS,
+    )
+
+
+@pytest.mark.parametrize("case", ["valid", "valid_npz"])
+@pytest.mark.parametrize("task_name", sorted(TASKS))
+def test_streaming_matches_in_memory(grading_data_dir, task_name, case):
+    task = TASKS[task_name]
+    labels_path, results_dir = generate_task_files(task, N_ROWS, case, grading_data_dir)
+    counts = in_memory_counts(task, labels_path, results_dir)
+    assert int(sum(counts)[0]) == N_ROWS
+    np.testing.assert_array_equal(
+        np.stack(streaming_counts(task, labels_path, results_dir)), np.stack(counts)
+    )
+
+
+@pytest.mark.parametrize("case", ["duplicate_ids", "mismatched_ids"])
+@pytest.mark.parametrize("task_name", sorted(TASKS))
+def test_both_paths_reject_bad_ids(grading_data_dir, task_name, case):
+    task = TASKS[task_name]
+    labels_path, results_dir = generate_task_files(task, N_ROWS, case, grading_data_dir)
+    with pytest.raises(ValueError):
+        in_memory_counts(task, labels_path, results_dir)
+    with pytest.raises(ValueError):
+        streaming_counts(task, labels_path, results_dir)